@@ -0,0 +1,294 @@
+"""
+Micro-benchmarks for the catalog app.
+
+Each benchmark builds a throwaway database (never touching catalog.db),
+fills it with synthetic data through the DAL, and prints a small table of
+timings.  Run from the catalog project directory:
+
+    python benchmark.py sidebar
+    python benchmark.py sidebar --counts 10,100,1000 --repeat 20
+    python benchmark.py entities --counts 100000
+    python benchmark.py import --counts 1000,10000
+    python benchmark.py login --counts 1,4,16 --latency 0.05
+    python benchmark.py pages --counts 10,100
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import dal
+import item_import
+import oauth_utils
+from entities import Item, to_json
+
+
+def timed(func, repeat):
+    """ Calls func() repeat times and returns the mean wall time in milliseconds. """
+    start = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - start) * 1000.0 / repeat
+
+
+def fresh_database(workdir, name):
+    """ Points the DAL at a new, empty database (and picture store) inside workdir. """
+    dal.configure_pool(db_path=os.path.join(workdir, name + ".db"))
+    dal.configure_picture_store(os.path.join(workdir, name + "_pictures"))
+    dal.initial_db_setup()
+
+
+def populate(cat_count, items_per_cat, pic="benchmark"):
+    """ Creates cat_count categories, each holding items_per_cat items. """
+    user_id = dal.get_or_create_user("bench@example.com", "benchmark", 1).user_id
+    for c in range(cat_count):
+        cat_id = dal.create_category("Category {}".format(c), user_id)
+        for i in range(items_per_cat):
+            dal.create_item("Item {}".format(i), cat_id, user_id, pic)
+
+
+def legacy_list_items_by_cat():
+    """ The original N+1 sidebar loader, kept here as a baseline. """
+    output = []
+    for cat in dal.get_categories():
+        output.append((cat, dal.get_items_by_cat(cat.cat_id)))
+    return output
+
+
+def bench_sidebar(workdir, args):
+    """ Sidebar load time and full dashboard render time versus category count. """
+    import catalog
+    catalog.app.secret_key = "benchmark"
+    client = catalog.app.test_client()
+
+    def uncached():
+        dal.invalidate_catalog_cache()
+        return dal.list_items_by_cat()
+
+    print("{:>10} {:>14} {:>14} {:>14} {:>14}".format(
+        "categories", "legacy (ms)", "sidebar (ms)", "cached (ms)", "GET / (ms)"))
+    for count in args.counts:
+        fresh_database(workdir, "sidebar_{}".format(count))
+        populate(count, args.items_per_cat)
+        legacy = timed(legacy_list_items_by_cat, args.repeat)
+        current = timed(uncached, args.repeat)
+        cached = timed(dal.list_items_by_cat, args.repeat)
+        page = timed(lambda: client.get("/"), args.repeat)
+        print("{:>10} {:>14.2f} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+            count, legacy, current, cached, page))
+
+
+class LegacyItem(object):
+    """ The original __dict__-based Item entity, kept here as a baseline. """
+    item_id = None
+    name = None
+    description = None
+    cat_id = None
+    cat_name = None
+    creator_id = None
+    creator_name = None
+    changed = None
+    pic_id = None
+    pic_hash = None
+
+
+def legacy_entity_from_row(entity_class, row):
+    """ The original setattr-per-column row conversion, kept here as a baseline. """
+    entity = entity_class()
+    for field in row.keys():
+        setattr(entity, field, row[field])
+    return entity
+
+
+def bench_entities(workdir, args):
+    """ Row conversion speed, JSON encoding speed and memory per Item. """
+    fresh_database(workdir, "entities")
+    populate(1, 1)
+    with dal.get_cursor() as cursor:
+        cursor.execute("SELECT * FROM pretty_items")
+        row = cursor.fetchone()
+
+    print("{:>10} {:>14} {:>14} {:>14} {:>14}".format(
+        "rows", "legacy rows/s", "slotted rows/s", "legacy json/s", "slotted json/s"))
+    for count in args.counts:
+        rows = [row] * count
+        start = time.time()
+        legacy = [legacy_entity_from_row(LegacyItem, r) for r in rows]
+        legacy_rate = count / (time.time() - start)
+        start = time.time()
+        slotted = dal.entities_from_rows(Item, rows)
+        slotted_rate = count / (time.time() - start)
+
+        start = time.time()
+        for entity in legacy:
+            json.dumps(entity, default=lambda o: o.__dict__)
+        legacy_json_rate = count / (time.time() - start)
+        start = time.time()
+        for entity in slotted:
+            to_json(entity)
+        slotted_json_rate = count / (time.time() - start)
+        print("{:>10} {:>14.0f} {:>14.0f} {:>14.0f} {:>14.0f}".format(
+            count, legacy_rate, slotted_rate, legacy_json_rate, slotted_json_rate))
+
+    # Per-instance overhead only; the field values themselves are shared
+    legacy_size = sys.getsizeof(legacy[0]) + sys.getsizeof(legacy[0].__dict__)
+    slotted_size = sys.getsizeof(slotted[0])
+    print("Memory per 100k Items (object overhead): legacy {:.1f} MB, slotted {:.1f} MB".format(
+        legacy_size * 100000 / 1e6, slotted_size * 100000 / 1e6))
+
+
+def write_feed(workdir, count, distinct_pictures=100):
+    """ Writes a CSV feed of count items (and their pictures) and returns its path. """
+    for p in range(distinct_pictures):
+        with open(os.path.join(workdir, "pic{}.jpg".format(p)), "wb") as pic_file:
+            # Just enough of a JFIF header for imghdr to accept it
+            pic_file.write("\xff\xd8\xff\xe0\x00\x10JFIF\x00" + str(p))
+    path = os.path.join(workdir, "feed{}.csv".format(count))
+    with open(path, "wb") as feed:
+        writer = csv.writer(feed)
+        writer.writerow(item_import.FIELDS)
+        for i in range(count):
+            writer.writerow(["Category {}".format(i % 10), "Item {}".format(i),
+                "Description {}".format(i), "pic{}.jpg".format(i % distinct_pictures)])
+    return path
+
+
+def bench_import(workdir, args):
+    """ Items/s for a create_item() loop versus the batched importer. """
+    print("{:>10} {:>14} {:>14}".format("items", "loop items/s", "import items/s"))
+    for count in args.counts:
+        path = write_feed(workdir, count)
+
+        fresh_database(workdir, "loop{}".format(count))
+        user_id = dal.get_or_create_user("bench@example.com", "benchmark", 1).user_id
+        start = time.time()
+        cat_ids = {}
+        for line_num, row in item_import.read_feed(path):
+            if row["category"] not in cat_ids:
+                cat_ids[row["category"]] = dal.create_category(row["category"], user_id)
+            with open(os.path.join(workdir, row["picture"]), "rb") as pic_file:
+                dal.create_item(row["name"], cat_ids[row["category"]], user_id,
+                    pic_file.read(), row["description"])
+        loop_rate = count / (time.time() - start)
+
+        fresh_database(workdir, "import{}".format(count))
+        user_id = dal.get_or_create_user("bench@example.com", "benchmark", 1).user_id
+        report = item_import.import_items(path, user_id)
+        if report.errors or report.imported != count:
+            raise ValueError("Import failed: {}".format(report.errors[:5]))
+        print("{:>10} {:>14.0f} {:>14.0f}".format(count, loop_rate, report.rows_per_second))
+
+
+def bench_login(workdir, args):
+    """
+    Logins/s through the whole /gconnect flow against a StubProvider that
+    sleeps for --latency seconds per provider call.  Here --counts is the
+    number of concurrent clients, each logging in --repeat times.
+    """
+    import catalog
+    from session_utils import SessionKeys
+    catalog.app.secret_key = "benchmark"
+    fresh_database(workdir, "login")
+    oauth_utils.configure_provider(oauth_utils.StubProvider(latency=args.latency))
+
+    def log_in(client_id, latencies):
+        client = catalog.app.test_client()
+        for i in range(args.repeat):
+            client.get("/login")
+            with client.session_transaction() as session:
+                state = session[SessionKeys.STATE]
+            start = time.time()
+            response = client.post("/gconnect?state=" + state,
+                data="user{}-{}".format(client_id, i))
+            latencies.append(time.time() - start)
+            if response.status_code != 200:
+                raise ValueError("Login failed: {}".format(response.data))
+            client.get("/logout")
+
+    print("Each provider call takes {:.0f} ms".format(args.latency * 1000))
+    print("{:>10} {:>14} {:>14}".format("clients", "logins/s", "mean (ms)"))
+    for count in args.counts:
+        latencies = []
+        threads = [threading.Thread(target=log_in, args=(c, latencies))
+            for c in range(count)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        print("{:>10} {:>14.1f} {:>14.1f}".format(count, len(latencies) / elapsed,
+            sum(latencies) * 1000.0 / len(latencies)))
+
+
+def bench_pages(workdir, args):
+    """
+    Requests/s for the dashboard and an item page, with the sidebar
+    rendered on every request (as before fragment caching) versus cached.
+    """
+    import catalog
+    import handler_utils
+    from session_utils import SessionKeys
+    catalog.app.secret_key = "benchmark"
+
+    def uncached(key, loader):
+        return loader()
+
+    print("{:>10} {:>10} {:>14} {:>14} {:>14}".format(
+        "categories", "viewer", "page", "uncached req/s", "cached req/s"))
+    for count in args.counts:
+        fresh_database(workdir, "pages_{}".format(count))
+        populate(count, args.items_per_cat)
+        user = dal.get_user(1)
+        for viewer in ("anonymous", "owner"):
+            client = catalog.app.test_client()
+            if viewer == "owner":
+                with client.session_transaction() as session:
+                    session[SessionKeys.CURRENT_USER] = user.to_json()
+            for page in ("/", "/catalog/Category 0/Item 0/"):
+                get = lambda: client.get(page)
+                get()
+                handler_utils.get_or_build_cached = uncached
+                before = timed(get, args.repeat)
+                handler_utils.get_or_build_cached = dal.get_or_build_cached
+                after = timed(get, args.repeat)
+                print("{:>10} {:>10} {:>14} {:>14.0f} {:>14.0f}".format(
+                    count, viewer, page[:14], 1000.0 / before, 1000.0 / after))
+
+
+BENCHMARKS = {
+    "entities": bench_entities,
+    "import": bench_import,
+    "login": bench_login,
+    "pages": bench_pages,
+    "sidebar": bench_sidebar,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--counts", default="10,100,1000",
+        type=lambda s: [int(x) for x in s.split(",")],
+        help="comma-separated category counts to test")
+    parser.add_argument("--items-per-cat", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05,
+        help="simulated auth provider latency in seconds (login benchmark)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="catalog_bench_")
+    try:
+        BENCHMARKS[args.benchmark](workdir, args)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
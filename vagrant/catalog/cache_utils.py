@@ -0,0 +1,168 @@
+"""
+This file contains the building blocks for our in-process caches.
+
+Cached values are tagged with a "generation" number when they're stored.
+Whenever the underlying data changes, the generation is bumped, and every
+value tagged with an older generation is treated as a miss from then on.
+This lets the DAL invalidate everything derived from the catalog with a
+single O(1) write instead of tracking individual keys.
+
+Two pieces are pluggable:
+ - The store, which holds the cached values for this process
+   (LRUCache, an in-memory LRU with an optional TTL).
+ - The generation counter, which decides when those values are stale.
+   LocalGeneration lives in process memory and is fine for a single
+   worker; SqliteGeneration keeps the counter in a small shared SQLite file
+   so that a write in one gunicorn worker invalidates every other worker.
+"""
+
+import collections
+import sqlite3
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Returned by stores on a miss, so that None can still be cached
+MISSING = object()
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded key/value store that evicts the least
+    recently used entry first.  If ttl (seconds) is set, entries older than
+    that are also treated as misses.
+    """
+    def __init__(self, max_entries=128, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the value stored under key, or MISSING. """
+        with self._lock:
+            try:
+                stored_at, value = self._entries.pop(key)
+            except KeyError:
+                return MISSING
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                return MISSING
+            # Re-insert to mark as most recently used
+            self._entries[key] = (stored_at, value)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LocalGeneration(object):
+    """ A generation counter that only lives in this process. """
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+class SqliteGeneration(object):
+    """
+    A generation counter stored in a shared SQLite file, so that every
+    process pointed at the same path sees the same value.  Reading it is
+    a single primary key lookup.
+    """
+    def __init__(self, path, name="catalog"):
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS generations (" +
+                "name TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO generations VALUES (?, 0)", (self.name,))
+
+    def _connection(self):
+        # One connection per thread; sqlite3 connections double as
+        # transaction context managers (commit on success, rollback on error).
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA busy_timeout = 5000")
+            self._local.conn = conn
+        return conn
+
+    def current(self):
+        row = self._connection().execute(
+            "SELECT generation FROM generations WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self):
+        with self._connection() as conn:
+            conn.execute("UPDATE generations SET generation = generation + 1 " +
+                "WHERE name = ?", (self.name,))
+        return self.current()
+
+
+class GenerationalCache(object):
+    """
+    Ties a store and a generation counter together.  Values are only
+    returned if they were stored during the current generation.
+
+    Cached values are shared between callers; treat them as read-only.
+    """
+    def __init__(self, store=None, generation=None):
+        self.store = store if store is not None else LRUCache()
+        self.generation = generation if generation is not None else LocalGeneration()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() to rebuild it
+        (and caching the result) if it's missing or stale.
+        """
+        generation = self.generation.current()
+        found = self.store.get(key)
+        if found is not MISSING and found[0] == generation:
+            self.hits += 1
+            return found[1]
+        self.misses += 1
+        value = loader()
+        # Tag with the generation read *before* loading; if a write
+        # sneaks in while we're loading, the value is already stale.
+        self.store.set(key, (generation, value))
+        return value
+
+    def current_generation(self):
+        return self.generation.current()
+
+    def invalidate(self):
+        """ Marks everything currently cached as stale. """
+        return self.generation.bump()
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": self.generation.current(),
+            }
@@ -9,55 +9,152 @@ and interact with the DAL to perform CRUD operations.
 # Python library includes
 import base64
 import bleach
-import httplib2
 import imghdr
 import json
 import logging
 logging.basicConfig()
 logger = logging.getLogger(__name__)
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
 import os
-import requests
+from tempfile import SpooledTemporaryFile
 
 # Third-party includes
 from flask import (
     Flask,
+    Request,
+    g,
     redirect,
     request,
+    send_file,
     session,
     )
+# Largest request we accept (including uploaded pictures), in bytes.  Bigger
+# ones are turned away with a 413 before their body is read.
+MAX_UPLOAD_SIZE = 8 * 1024 * 1024
+# Uploads are kept in memory up to this size, then spill over to a temp file
+UPLOAD_SPOOL_SIZE = 512 * 1024
+# Number of leading bytes checked to recognize a JPEG file
+PICTURE_HEADER_SIZE = 32
+
+class SpooledUploadRequest(Request):
+    """ Buffers every uploaded file in a SpooledTemporaryFile, bounding memory use per upload. """
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+            content_length=None):
+        return SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE, mode="wb+")
+
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE
+# /metrics reveals internal timings and counters, so it's only served when
+# this is set (e.g. on a deployment where it's firewalled off)
+app.config["EXPOSE_METRICS"] = False
 CLIENT_ID = json.loads(
     open("client_secrets.json", "r").read())["web"]["client_id"]
 from werkzeug import secure_filename
+# Pictures are content-addressed, so they can be cached for as long as
+# clients are willing to (one year is the conventional maximum)
+PICTURE_MAX_AGE = 365 * 24 * 60 * 60
+# Search results per page, by default and at most
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# Listing entries per page, by default and at most
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 500
 
 # Project-specific includes
 import dal
-from entities import AuthSource, jdefault
+import feed_utils
+import metrics
+import oauth_utils
+from entities import to_json
 from handler_utils import (
     already_exists_error,
     bad_request_error,
     create_atom_response,
     create_err_response,
     create_json_response,
-    date_to_atom_friendly,
+    create_json_stream_response,
+    create_metrics_response,
+    conflict_error,
+    decode_page_cursor,
+    encode_page_cursor,
     internal_error,
     not_authenticated_error,
     not_authorized_error,
     not_found_error,
     render,
+    too_large_error,
+    )
+from session_store import (
+    MemorySessionStore,
+    ServerSideSessionInterface,
     )
 from session_utils import (
     check_nonce,
     generate_nonce,
     get_active_user,
     load_from_session,
-    save_to_session,
     SessionKeys,
     set_active_user,
     )
 
+# Session data stays on the server; the cookie only holds an opaque ID.
+# (When running several worker processes, share the sessions between them:
+#  ServerSideSessionInterface(SqliteSessionStore("sessions.db")))
+app.session_interface = ServerSideSessionInterface(MemorySessionStore())
+# Likewise, several worker processes need to share the catalog cache's
+# generation, so that a write in one of them invalidates the others' caches:
+#  dal.configure_cache(generation=cache_utils.SqliteGeneration("cache.db"))
+
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+@app.after_request
+def defer_request_metrics(response):
+    """
+    Streamed responses (like /catalog.json) keep running queries after their
+    handler returns, so requests that got this far are only recorded once
+    their response has been sent.
+    """
+    route = metrics_route()
+    response.call_on_close(lambda: metrics.finish_request(route))
+    g.metrics_deferred = True
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    """ Records the request's timing and query counts, unless that's been deferred. """
+    if not getattr(g, "metrics_deferred", False):
+        metrics.finish_request(metrics_route())
+
+def metrics_route():
+    """ The route pattern requests are grouped by in metrics, e.g. /catalog/<cat_name>/<item_name>/ """
+    return request.url_rule.rule if request.url_rule else "(unmatched)"
+
+@app.route('/metrics')
+def metricsEndpoint():
+    """
+    Exposes request, DAL, connection pool, cache and session metrics in the
+    Prometheus text format.  Pretends not to exist unless
+    app.config["EXPOSE_METRICS"] is set.
+    """
+    if not app.config["EXPOSE_METRICS"]:
+        return not_found_error()
+    gauges = {}
+    for prefix, stats in (("catalog_db_pool_", dal.get_pool_stats()),
+            ("catalog_cache_", dal.get_cache_stats()),
+            ("catalog_sessions_", app.session_interface.get_stats())):
+        for name, value in stats.items():
+            gauges[prefix + name] = value
+    return create_metrics_response(metrics.render_metrics(gauges))
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """ Reports requests over MAX_UPLOAD_SIZE like our other errors. """
+    return too_large_error()
+
 
 @app.route('/static/<path:filename>')
 def download_static_file(filename):
@@ -67,29 +164,155 @@ def download_static_file(filename):
     """
     return send_from_directory("/static", filename, as_attachment=True)
 
+@app.route('/pictures/<pic_hash>.jpg')
+def download_picture(pic_hash):
+    """
+    Serves an item picture from the picture store.  Pictures are addressed
+    by the hash of their contents and never change, so clients may cache
+    them forever and revalidate with the hash as an ETag.
+
+    Set app.config["USE_X_SENDFILE"] when running behind a server that
+    supports it to hand the file transfer off to the server entirely.
+    """
+    path = dal.get_picture_path(pic_hash)
+    if not path:
+        return not_found_error()
+    response = send_file(path, mimetype="image/jpeg", add_etags=False, conditional=False)
+    response.set_etag(pic_hash)
+    response.headers["Cache-Control"] = "public, max-age={}, immutable".format(
+        PICTURE_MAX_AGE)
+    return response.make_conditional(request)
+
+@app.route('/pictures/<pic_hash>/<rendition>.jpg')
+def download_picture_rendition(pic_hash, rendition):
+    """
+    Serves a scaled-down rendition of an item picture (see thumbnails.py),
+    like download_picture().  Templates should link to the smallest
+    rendition that fits rather than the original upload.
+    """
+    found = dal.get_rendition_path(pic_hash, rendition)
+    if not found:
+        return not_found_error()
+    path, is_rendition = found
+    etag = "{}.{}".format(pic_hash, rendition)
+    response = send_file(path, mimetype="image/jpeg", add_etags=False, conditional=False)
+    response.set_etag(etag)
+    if is_rendition:
+        response.headers["Cache-Control"] = "public, max-age={}, immutable".format(
+            PICTURE_MAX_AGE)
+    else:
+        # A stand-in until the rendition can be generated; don't let it stick
+        response.headers["Cache-Control"] = "public, max-age=3600"
+    return response.make_conditional(request)
+
 @app.route('/')
 def dashboard():
     """ Serves the splash page for the application. """
-    recent_items = dal.get_recent_items(5)
+    recent_items = dal.get_recent_items(5, with_picture=True)
     return render("dashboard.html", recent_items=recent_items)
 
 
+@app.route('/search')
+def searchPage():
+    """ Shows the items matching the "q" query parameter (see searchEndpoint). """
+    results = run_search()
+    if results is None:
+        return bad_request_error()
+    return render("search.html", **results)
+
+@app.route('/search.json')
+def searchEndpoint():
+    """
+    Full-text search over item names, descriptions and category names,
+    best matches first.  Every word of the "q" query parameter has to match,
+    and the last one may be the start of a word (so "gag" finds "Gagh").
+    Accepts optional "limit" (results per page) and "page" (1-based)
+    query parameters; next_page is null on the last page.
+    """
+    results = run_search()
+    if results is None:
+        return bad_request_error()
+    return create_json_response(to_json({
+        "query": results["query"],
+        "page": results["page"],
+        "next_page": results["next_page"],
+        "items": results["items"],
+        }))
+
+def run_search():
+    """
+    Runs the search described by the current request's query parameters.
+    Returns a dict of template/JSON values, or None if the parameters are invalid.
+    """
+    query = request.args.get("q", u"")
+    try:
+        limit = int(request.args.get("limit", SEARCH_DEFAULT_LIMIT))
+        page = int(request.args.get("page", 1))
+    except ValueError:
+        return None
+    if not 1 <= limit <= SEARCH_MAX_LIMIT or page < 1:
+        return None
+
+    # Ask for one extra result to find out whether there's another page
+    items = dal.search_items(query, limit + 1, (page - 1) * limit, with_picture=True)
+    return {
+        "query": query,
+        "page": page,
+        "next_page": page + 1 if len(items) > limit else None,
+        "items": items[:limit],
+        }
+
 
 @app.route('/catalog.json')
 def jsonEndpoint():
-    """ Dumps all categories and items to JSON format """
-    categories = dal.get_categories()
-    items = dal.get_items()
+    """
+    Dumps all categories and items to JSON format.
+
+    The output is streamed straight from a database cursor, so memory use
+    stays flat no matter how large the catalog gets.  The "pictures" query
+    parameter controls how item pictures are included:
+        none: not at all
+        url: as a pic_url link to the picture (much cheaper than inline)
+        inline: as base64-encoded JPEG data in a pic field (the default, as
+          this is what the endpoint has always returned)
+    """
+    pic_mode = request.args.get("pictures", PictureModes.INLINE)
+    if pic_mode not in PictureModes.ALL:
+        return bad_request_error()
+    return create_json_stream_response(generate_catalog_json(pic_mode))
 
-    cat_dict = {}
-    for i in categories:
-        i.items = []
-        cat_dict[i.cat_id] = i
-    for j in items:
-        cat_dict[j.cat_id].items.append(j)
+class PictureModes(object):
+    """ Enum listing the ways /catalog.json can include item pictures. """
+    NONE = "none"
+    URL = "url"
+    INLINE = "inline"
+    ALL = (NONE, URL, INLINE)
 
-    output = json.dumps(cat_dict.values(), default=jdefault)
-    return create_json_response(output)
+def generate_catalog_json(pic_mode):
+    """
+    Generator that yields the JSON for the whole catalog piece by piece:
+    a list of categories, each with an "items" list.
+    """
+    yield "["
+    current_cat_id = None
+    for cat, item in dal.iter_catalog(lightweight=(pic_mode == PictureModes.NONE)):
+        if cat.cat_id != current_cat_id:
+            # Close out the previous category and open a new one.  The
+            # category's own fields are encoded normally, then its closing
+            # brace is swapped for the start of the items list.
+            prefix = "]}, " if current_cat_id is not None else ""
+            yield prefix + to_json(cat)[:-1] + ', "items": ['
+            current_cat_id = cat.cat_id
+            first_item = True
+        if item is None:
+            continue
+        if pic_mode == PictureModes.URL:
+            item.pic_url = "/pictures/{}.jpg".format(item.pic_hash)
+        elif pic_mode == PictureModes.INLINE:
+            item.pic = base64.b64encode(dal.read_picture(item.pic_hash))
+        yield ("" if first_item else ", ") + to_json(item)
+        first_item = False
+    yield "]}]" if current_cat_id is not None else "]"
 
 @app.route('/catalog.atom')
 def atomEndpoint():
@@ -97,17 +320,85 @@ def atomEndpoint():
     Displays recently added items in Atom format.
     Data is formatted as specified in http://atomenabled.org/developers/syndication/
     and was validated against https://validator.w3.org/feed/#validate_by_input/
+
+    Accepts optional "limit" (entries per page) and "page" (1-based) query
+    parameters; when more entries exist, the feed links to the next page.
+    Supports conditional requests (If-None-Match), so well-behaved feed
+    readers get a 304 Not Modified until the feed's contents change.
+    """
+    try:
+        limit = int(request.args.get("limit", feed_utils.DEFAULT_FEED_LIMIT))
+        page = int(request.args.get("page", 1))
+    except ValueError:
+        return bad_request_error()
+    if not 1 <= limit <= feed_utils.MAX_FEED_LIMIT or page < 1:
+        return bad_request_error()
+
+    feed = feed_utils.get_feed(request.url_root, limit, page)
+    response = create_atom_response(feed.body)
+    response.set_etag(feed.etag)
+    return response.make_conditional(request)
+
+
+@app.route('/catalog/categories.json')
+def categoryListEndpoint():
+    """
+    Lists categories in name order, a page at a time.  Accepts optional
+    "limit" (entries per page) and "after" (the "next" cursor returned with
+    the previous page) query parameters; "next" is null on the last page.
     """
-    last_updated = None
-    recent_items = dal.get_recent_items(10)
-    # Convert the dates to RFC-3339 format for Atom compatibility
-    for i in recent_items:
-       i.changed = date_to_atom_friendly(i.changed)
-    if recent_items:
-        last_updated = recent_items[0].changed
-    output = render("atom.xml", last_updated=last_updated, items=recent_items)
-    return create_atom_response(output)
+    paging = parse_paging_args()
+    if paging is None:
+        return bad_request_error()
+    limit, after = paging
+    cats = dal.get_categories_page(limit + 1, after)
+    return create_page_response(cats, limit, dal.category_page_key)
 
+@app.route('/catalog/<cat_name>/items.json')
+def itemListEndpoint(cat_name):
+    """
+    Lists the items in a category, a page at a time, like categoryListEndpoint.
+    The "order" query parameter picks between "name" (the default) and
+    "recent" (most recently changed first).
+    """
+    order = request.args.get("order", dal.ItemOrders.NAME)
+    paging = parse_paging_args()
+    if paging is None or order not in dal.ItemOrders.ALL:
+        return bad_request_error()
+    limit, after = paging
+    cat = dal.get_category_by_name(cat_name)
+    if not cat:
+        return not_found_error()
+    items = dal.get_items_page(limit + 1, after, cat.cat_id, order)
+    return create_page_response(items, limit,
+        lambda item: dal.item_page_key(item, order))
+
+def parse_paging_args():
+    """
+    Reads the "limit" and "after" query parameters of a listing endpoint.
+    Returns (limit, page key or None), or None if they're invalid.
+    """
+    try:
+        limit = int(request.args.get("limit", LIST_DEFAULT_LIMIT))
+        after = request.args.get("after")
+        if after is not None:
+            after = decode_page_cursor(after)
+    except ValueError:
+        return None
+    if not 1 <= limit <= LIST_MAX_LIMIT:
+        return None
+    return limit, after
+
+def create_page_response(entries, limit, page_key):
+    """
+    Builds the JSON response for one page of a listing.  entries holds up
+    to limit + 1 entries; the extra one only signals that there's a next page.
+    """
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_page_cursor(page_key(entries[-1]))
+    return create_json_response(to_json({"entries": entries, "next": next_cursor}))
 
 
 @app.route('/catalog/create-cat/', methods=['POST'])
@@ -194,7 +485,7 @@ def itemLookupByName(cat_name, item_name):
     if not cat:
         return not_found_error()
 
-    item = dal.get_item_by_name(cat.cat_id, item_name)
+    item = dal.get_item_by_name(cat.cat_id, item_name, with_picture=True)
     if not item:
         return not_found_error()
 
@@ -225,7 +516,7 @@ def itemCreate():
         return already_exists_error()
 
     try:
-        pic_data = validate_picture(request.files["item_create_pic"])
+        pic_file = validate_picture(request.files["item_create_pic"])
     except InvalidPictureError:
         return bad_request_error()
 
@@ -233,7 +524,7 @@ def itemCreate():
     generate_nonce()
     desc = bleach.clean(request.values.get("item_create_description"))
     item_id = dal.create_item(
-        item_name, cat.cat_id, active_user.user_id, pic_data, desc)
+        item_name, cat.cat_id, active_user.user_id, pic_file, desc)
     if not item_id:
         logging.error("Unable to create item: did not receive an item_id from database")
         return internal_error()
@@ -248,8 +539,9 @@ def validate_picture(pic):
     """
     Uses code from http://flask.pocoo.org/docs/0.10/patterns/fileuploads/
 
-    If pic is a valid picture file that can safely be stored in the db,
-    return its base64-encoded binary contents.
+    If pic is a valid picture file that can safely be stored, return a file
+    object to stream its contents from (see dal.store_picture()); the
+    upload is never read into memory as a whole.
     If the pic is malformed somehow, throws a descriptive InvalidPictureError.
     """
     pic.filename = secure_filename(pic.filename)
@@ -257,13 +549,20 @@ def validate_picture(pic):
         raise InvalidPictureError("Invalid extension")
     if len(pic.filename) <= 4:
         raise InvalidPictureError("Invalid filename length")
-    # Snoop into the file's data to ensure it actually contains a jpg image
-    content = pic.read()
-    if not imghdr.what("", h=content) == 'jpeg':
+    stream = pic.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        raise InvalidPictureError("Invalid file size")
+    # Snoop into the file's first bytes to ensure it actually contains a jpg image
+    stream.seek(0)
+    header = stream.read(PICTURE_HEADER_SIZE)
+    if not imghdr.what("", h=header) == 'jpeg':
         raise InvalidPictureError("Invalid file contents")
 
     # All checks passed
-    return base64.b64encode(content)
+    stream.seek(0)
+    return stream
 
 class InvalidPictureError(Exception):
     pass
@@ -304,52 +603,54 @@ def itemUpdate():
     """
     Selectively update fields on an item owned by the logged-in user
     """
-    # This will take a few steps. Start with loading the old object and performing
-    # our usual auth process.
     state = request.values.get('state')
     if not check_nonce(state):
         return bad_request_error()
 
-    old_parent_name = bleach.clean(request.values.get("item_update_old_parent"))
-    old_parent = dal.get_category_by_name(old_parent_name)
-    if not old_parent:
-        return not_found_error()
-
     active_user = get_active_user()
     if not active_user:
         return not_authenticated_error()
 
-    old_item_name = bleach.clean(request.values.get("item_update_old_name"))
-    old_item = dal.get_item_by_name(old_parent.cat_id, old_item_name)
-    if not old_item:
-        return not_found_error()
+    # The version the user was looking at when they opened the form, if known
+    try:
+        expected_version = int(request.values.get("item_update_version") or 0) or None
+    except ValueError:
+        return bad_request_error()
 
-    # Item was found, security checks out.  Now pull in the new values from
-    # the request.  If a field is empty, it's assumed that the user doesn't
-    # want to change it.  Set to None so the DAL will skip those.
+    # Pull in the new values from the request.  If a field is empty, it's
+    # assumed that the user doesn't want to change it.  Set to None so the
+    # DAL will skip those.
     new_item_name = bleach.clean(request.values.get("item_update_new_name")) or None
     desc = bleach.clean(request.values.get("item_update_description")) or None
 
-    raw_pic_data = request.files["item_update_pic"] or None
-    pic_data = None
+    raw_pic_file = request.files["item_update_pic"] or None
+    pic_file = None
     try:
-        if raw_pic_data:
-            pic_data = validate_picture(raw_pic_data)
+        if raw_pic_file:
+            pic_file = validate_picture(raw_pic_file)
     except InvalidPictureError:
         return bad_request_error()
 
+    old_parent_name = bleach.clean(request.values.get("item_update_old_parent"))
+    old_item_name = bleach.clean(request.values.get("item_update_old_name"))
     new_parent_name = bleach.clean(request.values.get("item_update_new_parent")) or None
+    if new_parent_name == old_parent_name:
+        new_parent_name = None
 
-    new_cat = dal.get_category_by_name(new_parent_name)
-    new_cat_id = new_cat.cat_id if new_cat else None
-
-    # New values look good.  All checks passed.
+    # The DAL finds the item and checks that the user owns it in the same
+    # transaction as the update itself.
     generate_nonce()
-    dal.update_item(old_item.item_id, name=new_item_name, description=desc,
-        pic_id=old_item.pic_id, pic=pic_data, cat_id=new_cat_id)
-    redirect_cat = new_parent_name or old_parent_name
-    redirect_item = new_item_name or old_item_name
-    return redirect("/catalog/{}/{}/".format(redirect_cat, redirect_item))
+    try:
+        item = dal.update_item_by_name(old_parent_name, old_item_name, active_user.user_id,
+            name=new_item_name, description=desc, pic=pic_file,
+            new_cat_name=new_parent_name, expected_version=expected_version)
+    except dal.UpdateForbiddenError:
+        return not_authorized_error()
+    except dal.UpdateConflictError:
+        return conflict_error()
+    if not item:
+        return not_found_error()
+    return redirect("/catalog/{}/{}/".format(item.cat_name, item.name))
 
 
 
@@ -374,58 +675,27 @@ def gconnect():
         return create_err_response("Invalid state parameter", 401)
     code = request.data
     try:
-        # Upgrade the authorization code into a credentials object
-        scope = "email profile"
-        oauth_flow = flow_from_clientsecrets("client_secrets.json", scope=scope)
-        oauth_flow.redirect_uri = "postmessage"
-        credentials = oauth_flow.step2_exchange(code)
-    except FlowExchangeError:
-        return create_err_response("Failed to upgrade the authorization code", 401)
-
-    # Check that the access token is valid
-    access_token = credentials.access_token
-    url = ("https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s" % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, "GET")[1])
-    if result.get("error") is not None:
-        return create_err_response(result.get("error"), 500)
-
-    # Verify that the access token is used for the intended user
-    gplus_id = credentials.id_token["sub"]
-    if result["user_id"] != gplus_id:
-        return create_err_response("Token's user ID doesn't match given user ID", 401)
+        # Exchanges the code, then verifies the token and fetches the user's
+        # info concurrently (see oauth_utils.py)
+        identity = oauth_utils.get_provider().login(code)
+    except oauth_utils.LoginError as e:
+        return create_err_response(str(e), e.status)
 
     # Check to see if user is already logged in
     stored_credentials = session.get(SessionKeys.CREDENTIALS)
     stored_gplus_id = session.get(SessionKeys.GPLUS_ID)
-    if stored_credentials is not None and gplus_id == stored_gplus_id:
+    if stored_credentials is not None and identity.auth_source_id == stored_gplus_id:
         return create_err_response("Current user is already connected", 200)
 
     # Store the access token in the session for later use.
-    save_to_session(SessionKeys.CREDENTIALS, credentials)
-    session[SessionKeys.GPLUS_ID] = gplus_id
-
-    # Get user info from Google
-    try:
-        answer = None
-        data = None
-
-        userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-        params = {"access_token": credentials.access_token, "alt":"json"}
-        answer = requests.get(userinfo_url, params=params)
-        data = json.loads(answer.text)
-
-        username = data["email"]
-        auth_source = AuthSource.GOOGLE_PLUS
-        auth_source_id = data["id"]
-        # Everything checks out.  Create a new user record if this is the
-        # first time they've logged in, then set them as active in the session.
-        user = dal.get_or_create_user(username, auth_source, auth_source_id)
-        set_active_user(user)
-    except Exception:
-        return create_err_response(
-            "Received invalid user data\n\nanswer.text: {}\n\ndata: {}".format(
-                answer.text, data), 401)
+    session[SessionKeys.CREDENTIALS] = identity.credentials_json
+    session[SessionKeys.GPLUS_ID] = identity.auth_source_id
+
+    # Everything checks out.  Create a new user record if this is the
+    # first time they've logged in, then set them as active in the session.
+    user = dal.get_or_create_user(
+        identity.username, identity.auth_source, identity.auth_source_id)
+    set_active_user(user)
     generate_nonce()
     return "Authentication successful"
 
@@ -445,6 +715,5 @@ if __name__ == '__main__':
     # frequently:
     #app.secret_key = "not_so_secret"
 
-    app.config["SESSION_TYPE"] = "filesystem"
     print "Starting catalogifier web service; press ctrl-c to exit."
     app.run(host = '0.0.0.0', port = 5000)
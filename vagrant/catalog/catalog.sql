@@ -1,21 +1,17 @@
--- Enforce foreign key constraints --
+-- Initial schema for the catalog app.
+-- This is the first step of our schema migrations (see migrations.py),
+-- which record the applied version in PRAGMA user_version.  Don't edit it
+-- to change the schema of an existing database; add a new migration instead.
+-- Everything here is IF NOT EXISTS, so running it never touches existing data.
+
 -- (Note that we use cascading deletes below -- this is just
 --  to make the project code simpler.  In production more
 --  robust controls would be added to the business logic
---  layer instead.)
-PRAGMA foreign_keys=ON;
-
--- Wipe any existing data --
-DROP TABLE IF EXISTS items;
-DROP TABLE IF EXISTS categories;
-DROP TABLE IF EXISTS users;
-DROP TABLE IF EXISTS pictures;
-DROP VIEW IF EXISTS pretty_categories;
-DROP VIEW IF EXISTS pretty_items;
-DROP VIEW IF EXISTS pretty_items_light;
+--  layer instead.  Foreign keys are switched on for every
+--  connection by db_pool.py.)
 
 -- Create tables --
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     -- The user's unique ID within our own system
     user_id INTEGER PRIMARY KEY,
     -- The user's name as displayed by their auth source (e.g. user@example.com)
@@ -26,7 +22,7 @@ CREATE TABLE users (
     auth_source_id TEXT NOT NULL
     );
 
-CREATE TABLE categories (
+CREATE TABLE IF NOT EXISTS categories (
     cat_id INTEGER PRIMARY KEY,
     name TEXT NOT NULL,
     -- The user that owns this category
@@ -34,7 +30,7 @@ CREATE TABLE categories (
     FOREIGN KEY(creator_id) REFERENCES users(user_id) ON DELETE CASCADE
     );
 
-CREATE TABLE items (
+CREATE TABLE IF NOT EXISTS items (
     item_id INTEGER PRIMARY KEY,
     name TEXT NOT NULL,
     description TEXT NOT NULL,
@@ -51,32 +47,30 @@ CREATE TABLE items (
     FOREIGN KEY(pic_id) REFERENCES pictures(pic_id) ON DELETE CASCADE
     );
 
--- SQLite has trouble operating on rows that contain large blobs,
--- moving pictures into their own table as a workaround.
--- 1:1 mapping between items and pictures in this implementation,
--- but it would be possible to add in caching if many users were
--- expected to share the same image.
-CREATE TABLE pictures (
+-- The picture files themselves live on disk in a content-addressed store
+-- (see picture_store.py); this table only records their hashes.
+-- Identical uploads share a single row (and a single file).
+CREATE TABLE IF NOT EXISTS pictures (
     pic_id INTEGER PRIMARY KEY,
-    --Binary JPEG data, base64 encoded
-    pic BLOB NOT NULL
+    -- SHA-256 hex digest of the raw JPEG data
+    pic_hash TEXT NOT NULL UNIQUE
     );
 
 
 
 -- Create views --
 -- These are used by the DAL to pull all related info on an item/cat with a single query
-CREATE VIEW pretty_categories AS
+CREATE VIEW IF NOT EXISTS pretty_categories AS
     SELECT c.cat_id, c.name, c.creator_id,
         u.username AS creator_name
     FROM categories AS c JOIN users AS u ON (c.creator_id = u.user_id)
     ;
 
-CREATE VIEW pretty_items AS
+CREATE VIEW IF NOT EXISTS pretty_items AS
     SELECT i.item_id, i.name, i.description, i.pic_id, i.cat_id, i.creator_id, i.changed,
         u.username AS creator_name,
         c.name AS cat_name,
-        p.pic
+        p.pic_hash
     FROM items AS i
         JOIN users AS u ON (i.creator_id = u.user_id)
         JOIN categories AS c ON (i.cat_id = c.cat_id)
@@ -86,7 +80,7 @@ CREATE VIEW pretty_items AS
 -- Same as above, but without the picture payloads
 -- (Primarily used to build sidebar menus, where the extra overhead
 --  was causing load time problems)
-CREATE VIEW pretty_items_light AS
+CREATE VIEW IF NOT EXISTS pretty_items_light AS
     SELECT i.item_id, i.name, i.description, i.pic_id, i.cat_id, i.creator_id, i.changed,
         u.username AS creator_name,
         c.name AS cat_name
@@ -0,0 +1,939 @@
+#!/usr/bin/env python
+#
+# Test cases for the catalog's data layer.
+# Run from the catalog project directory; uses a throwaway database
+# (catalog.db and the pictures/ directory are never touched).
+
+import base64
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import dal
+import entities
+import fragment_utils
+import item_import
+import loadtest
+import metrics
+import oauth_utils
+import migrations
+import thumbnails
+from cache_utils import MISSING, GenerationalCache, LRUCache, SqliteGeneration
+from db_pool import ConnectionPool, PoolTimeoutError
+from picture_store import PictureStore
+from session_store import (
+    MemorySessionStore,
+    ServerSideSessionInterface,
+    SqliteSessionStore,
+    )
+
+
+WORKDIR = tempfile.mkdtemp(prefix="catalog_test_")
+PICTURE_DIR = os.path.join(WORKDIR, "pictures")
+
+
+def freshDatabase(name):
+    """ Points the DAL at a new, fully migrated database and returns its path. """
+    db_path = os.path.join(WORKDIR, name + ".db")
+    dal.configure_pool(db_path=db_path)
+    dal.configure_picture_store(PICTURE_DIR)
+    migrations.migrate(db_path, PictureStore(PICTURE_DIR))
+    dal.invalidate_catalog_cache()
+    return db_path
+
+
+def queryPlan(db_path, sql, args):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, args)]
+    finally:
+        conn.close()
+
+
+def assertUsesIndex(db_path, sql, args, index_name):
+    """
+    Raises a ValueError unless the query is answered through index_name
+    without any full table scans or temporary sort b-trees.
+    """
+    plan = queryPlan(db_path, sql, args)
+    if not any("INDEX {}".format(index_name) in step for step in plan):
+        raise ValueError("Expected {} to use index {}, got plan: {}".format(
+            sql, index_name, plan))
+    for step in plan:
+        if "TEMP B-TREE" in step or (step.startswith("SCAN") and "INDEX" not in step):
+            raise ValueError("Query {} has a full scan or sort: {}".format(sql, plan))
+
+
+def testMigrateFreshDatabase():
+    db_path = freshDatabase("fresh")
+    conn = sqlite3.connect(db_path)
+    version = migrations.get_schema_version(conn)
+    conn.close()
+    if version != migrations.latest_version():
+        raise ValueError("A new database should be migrated to the latest " +
+            "version (found {}, expected {})".format(version, migrations.latest_version()))
+    print "1. New databases are migrated to the latest schema version."
+
+
+def testMigrationsKeepData():
+    db_path = freshDatabase("keep")
+    user_id = dal.get_or_create_user("keep@example.com", "test", 1).user_id
+    dal.create_category("Kept", user_id)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA user_version = 0")
+    conn.close()
+    migrations.migrate(db_path, PictureStore(PICTURE_DIR))
+    dal.initial_db_setup()
+    if [c.name for c in dal.get_categories()] != ["Kept"]:
+        raise ValueError("Re-running migrations should not remove existing data.")
+    print "2. Migrations and initial_db_setup() leave existing data alone."
+
+
+def testMigrateLegacyPictures():
+    db_path = os.path.join(WORKDIR, "legacy.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT NOT NULL,
+            auth_source TEXT NOT NULL, auth_source_id TEXT NOT NULL);
+        CREATE TABLE categories (cat_id INTEGER PRIMARY KEY, name TEXT NOT NULL,
+            creator_id INTEGER NOT NULL);
+        CREATE TABLE items (item_id INTEGER PRIMARY KEY, name TEXT NOT NULL,
+            description TEXT NOT NULL, pic_id INTEGER NOT NULL, cat_id INTEGER NOT NULL,
+            creator_id INTEGER NOT NULL, changed DATETIME NOT NULL,
+            FOREIGN KEY(pic_id) REFERENCES pictures(pic_id) ON DELETE CASCADE);
+        CREATE TABLE pictures (pic_id INTEGER PRIMARY KEY, pic BLOB NOT NULL);
+        INSERT INTO users VALUES (1, 'legacy@example.com', 'test', '1');
+        INSERT INTO categories VALUES (1, 'Legacy', 1);
+        """)
+    for i in range(4):
+        # Two distinct pictures, each used by two items
+        pic = base64.b64encode("legacy picture {}".format(i % 2))
+        conn.execute("INSERT INTO pictures VALUES (?, ?)", (i + 1, sqlite3.Binary(pic)))
+        conn.execute("INSERT INTO items VALUES (?, ?, 'desc', ?, 1, 1, DATETIME('now'))",
+            (i + 1, "Item {}".format(i), i + 1))
+    conn.commit()
+    conn.close()
+
+    migrations.migrate(db_path, PictureStore(PICTURE_DIR))
+    dal.configure_pool(db_path=db_path)
+    dal.invalidate_catalog_cache()
+    items = dal.get_items()
+    if len(items) != 4:
+        raise ValueError("Migrating pictures should keep every item.")
+    if len(set(i.pic_hash for i in items)) != 2:
+        raise ValueError("Items with identical pictures should share a hash.")
+    if dal.read_picture(items[1].pic_hash) != "legacy picture 1":
+        raise ValueError("Migrated pictures should be stored decoded.")
+    print "3. Legacy pictures are moved into the picture store."
+
+
+def testLookupsUseIndexes():
+    db_path = freshDatabase("plans")
+    assertUsesIndex(db_path,
+        "SELECT * FROM pretty_categories WHERE name = ? LIMIT 1", ("x",),
+        "categories_by_name")
+    assertUsesIndex(db_path,
+        "SELECT * FROM pretty_items_light WHERE cat_id = ? AND name = ?", (1, "x"),
+        "items_by_cat_name")
+    assertUsesIndex(db_path,
+        "SELECT * FROM pretty_items_light WHERE cat_id = ? ORDER BY name, item_id", (1,),
+        "items_by_cat_name")
+    assertUsesIndex(db_path,
+        "SELECT * FROM pretty_items_light ORDER BY changed DESC, item_id DESC " +
+        "LIMIT ? OFFSET ?", (10, 0),
+        "items_by_changed")
+    assertUsesIndex(db_path,
+        "SELECT * FROM users WHERE auth_source = ? AND auth_source_id = ?", ("a", "b"),
+        "users_by_auth_source")
+    print "4. Hot lookups are served by indexes instead of full scans."
+
+
+def testBulkImport():
+    freshDatabase("import")
+    user_id = dal.get_or_create_user("import@example.com", "test", 1).user_id
+    dal.create_category("Existing", user_id)
+    feed_dir = os.path.join(WORKDIR, "feed")
+    os.mkdir(feed_dir)
+    with open(os.path.join(feed_dir, "good.jpg"), "wb") as pic:
+        pic.write("\xff\xd8\xff\xe0\x00\x10JFIF\x00good")
+    with open(os.path.join(feed_dir, "bad.jpg"), "wb") as pic:
+        pic.write("not a picture")
+    with open(os.path.join(feed_dir, "big.jpg"), "wb") as pic:
+        pic.write("\xff\xd8\xff\xe0\x00\x10JFIF\x00" + "x" * 100)
+    feed_path = os.path.join(feed_dir, "feed.csv")
+    with open(feed_path, "wb") as feed:
+        feed.write("category,name,description,picture\n" +
+            "Existing,First,One,good.jpg\n" +
+            "Existing,Second,Two,bad.jpg\n" +
+            "New,,Three,good.jpg\n" +
+            "New,Fourth,,missing.jpg\n" +
+            "New,Fifth,Five,good.jpg\n" +
+            "Existing,First,Again,good.jpg\n" +
+            "New,Big,Too big,big.jpg\n")
+
+    dal.list_items_by_cat()  # Warm up the sidebar cache
+    max_picture_size = item_import.MAX_PICTURE_SIZE
+    item_import.MAX_PICTURE_SIZE = 100
+    try:
+        report = item_import.import_items(feed_path, user_id, batch_size=2, workers=2)
+    finally:
+        item_import.MAX_PICTURE_SIZE = max_picture_size
+    if report.imported != 2 or report.categories_created != 1:
+        raise ValueError("Expected 2 items and 1 new category to be imported, got {}".format(
+            report.to_dict()))
+    if [line for line, _ in report.errors] != [3, 4, 5, 7, 8]:
+        raise ValueError("Rejected rows should be reported by line, got {}".format(
+            report.errors))
+    names = sorted((i.cat_name, i.name) for i in dal.get_items())
+    if names != [("Existing", "First"), ("New", "Fifth")]:
+        raise ValueError("Unexpected items after import: {}".format(names))
+    if [len(items) for _, items in dal.list_items_by_cat()] != [1, 1]:
+        raise ValueError("Imports should invalidate the cached sidebar.")
+    rerun = dict(item_import.import_items(feed_path, user_id).errors)
+    if "already has an item named First" not in rerun[2] or "Fifth" not in rerun[6]:
+        raise ValueError("Re-importing a feed shouldn't duplicate its items: {}".format(
+            rerun))
+    print "5. Bulk imports create valid rows and report the rest."
+
+
+def testLazyPictures():
+    freshDatabase("lazy")
+    user_id = dal.get_or_create_user("lazy@example.com", "test", 1).user_id
+    cat_id = dal.create_category("Lazy", user_id)
+    item_id = dal.create_item("Sloth", cat_id, user_id, "sloth picture")
+    expected_hash = PictureStore.hash_of("sloth picture")
+
+    item = dal.get_item_by_name(cat_id, "Sloth")
+    if item._pic_hash is not None or "pic_hash" in item.to_dict():
+        raise ValueError("Items should be loaded without their picture by default.")
+    if item.pic_hash != expected_hash or item.pic != "sloth picture":
+        raise ValueError("Pictures should be loaded on first access.")
+    item = dal.get_item(item_id, with_picture=True)
+    if item.to_dict().get("pic_hash") != expected_hash or item._pic is not None:
+        raise ValueError("with_picture=True should load just the picture hash up front.")
+    print "6. Item pictures are only loaded when they're needed."
+
+
+def testUpdateItem():
+    freshDatabase("update")
+    user_id = dal.get_or_create_user("update@example.com", "test", 1).user_id
+    cat1 = dal.create_category("Before", user_id)
+    cat2 = dal.create_category("After", user_id)
+    item_id = dal.create_item("Original", cat1, user_id, "old picture", "Old")
+    version = dal.get_item(item_id).version
+
+    item = dal.update_item(item_id, name="Renamed", pic="new picture", cat_id=cat2,
+        expected_version=version)
+    if (item.name, item.description, item.cat_name) != ("Renamed", "Old", "After"):
+        raise ValueError("update_item() should return the updated item.")
+    if item.version != version + 1 or item.pic != "new picture":
+        raise ValueError("update_item() should bump the version and replace the picture.")
+    try:
+        dal.update_item(item_id, description="Stale", pic="stale picture",
+            expected_version=version)
+        raise ValueError("Updating from a stale version should fail.")
+    except dal.UpdateConflictError:
+        pass
+    if dal.get_item(item_id).description != "Old":
+        raise ValueError("A conflicting update should not change anything.")
+    with dal.get_cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM pictures")
+        picture_count = cursor.fetchone()[0]
+    if picture_count != 2 or dal.get_picture_path(PictureStore.hash_of("stale picture")):
+        raise ValueError("A conflicting update should not store its picture.")
+    if dal.update_item(item_id + 1, name="Nobody") is not None:
+        raise ValueError("Updating a missing item should return None.")
+
+    # Updates by name look the item up and check its owner themselves
+    other_id = dal.get_or_create_user("other@example.com", "test", 2).user_id
+    try:
+        dal.update_item_by_name("After", "Renamed", other_id, name="Stolen")
+        raise ValueError("Only an item's creator should be able to update it.")
+    except dal.UpdateForbiddenError:
+        pass
+    item = dal.update_item_by_name("After", "Renamed", user_id, new_cat_name="Nowhere",
+        description="Kept")
+    if (item.cat_name, item.description) != ("After", "Kept"):
+        raise ValueError("Unknown new categories should leave the item where it is.")
+    item = dal.update_item_by_name("After", "Renamed", user_id, new_cat_name="Before",
+        expected_version=item.version)
+    if (item.item_id, item.cat_name) != (item_id, "Before"):
+        raise ValueError("update_item_by_name() should move the item.")
+    if dal.update_item_by_name("After", "Renamed", user_id, name="Gone") is not None:
+        raise ValueError("Updating a missing item by name should return None.")
+    print "7. Item updates are atomic and detect conflicting edits."
+
+
+def sessionTestApp(store):
+    """ A minimal Flask app that counts visits in a server-side session. """
+    from flask import Flask, session
+    app = Flask("session_test")
+    app.session_interface = ServerSideSessionInterface(store)
+
+    @app.route("/visit")
+    def visit():
+        session["visits"] = session.get("visits", 0) + 1
+        return str(session["visits"])
+
+    @app.route("/logout")
+    def logout():
+        session.clear()
+        return ""
+    return app
+
+
+def testServerSideSessions():
+    sqlite_path = os.path.join(WORKDIR, "sessions.db")
+    for store in (MemorySessionStore(), SqliteSessionStore(sqlite_path)):
+        app = sessionTestApp(store)
+        client = app.test_client()
+        first = client.get("/visit")
+        cookie = first.headers.get("Set-Cookie")
+        if not cookie or len(cookie.split(";")[0]) > 100:
+            raise ValueError("The session cookie should only hold a short ID: {}".format(cookie))
+        second = client.get("/visit")
+        if second.data != "2" or second.headers.get("Set-Cookie"):
+            raise ValueError("Sessions should persist without resending the cookie.")
+        client.get("/logout")
+        if client.get("/visit").data != "1":
+            raise ValueError("Clearing a session should discard its data.")
+        stats = app.session_interface.get_stats()
+        if stats["hits"] != 2 or stats["saves"] != 3:
+            raise ValueError("Unexpected session stats: {}".format(stats))
+
+    # Another worker sharing the same SQLite file sees the same sessions
+    client = sessionTestApp(SqliteSessionStore(sqlite_path)).test_client()
+    client.get("/visit")
+    other_worker = sessionTestApp(SqliteSessionStore(sqlite_path))
+    client.application = other_worker
+    if client.get("/visit").data != "2":
+        raise ValueError("SQLite sessions should be shared between processes.")
+    print "8. Sessions are stored server-side behind an opaque ID."
+
+
+class MismatchedProvider(oauth_utils.StubProvider):
+    """ Hands out tokens that belong to somebody else. """
+    def fetch_token_info(self, access_token):
+        return {"user_id": "somebody else"}
+
+
+class HangingProvider(oauth_utils.StubProvider):
+    """ Never answers userinfo requests in time. """
+    def fetch_user_info(self, access_token):
+        time.sleep(1)
+
+
+def testLoginPipeline():
+    latency = 0.1
+    provider = oauth_utils.StubProvider(latency=latency)
+    start = time.time()
+    identity = provider.login("alice")
+    elapsed = time.time() - start
+    if (identity.auth_source_id, identity.username) != ("alice", "alice@stub.invalid"):
+        raise ValueError("Unexpected identity: {}".format(identity.__dict__))
+    if elapsed >= 2.8 * latency:
+        raise ValueError("Token and user info should be fetched concurrently " +
+            "(took {:.2f}s)".format(elapsed))
+    # Logging in again only takes the code exchange
+    start = time.time()
+    provider.login("alice")
+    if time.time() - start >= 1.8 * latency:
+        raise ValueError("Verified users should be cached.")
+
+    for bad_provider, status in ((MismatchedProvider(), 401),
+            (HangingProvider(lookup_timeout=0.2), 504)):
+        # Failed logins aren't cached, so they fail every time
+        for _ in range(2):
+            try:
+                bad_provider.login("mallory")
+                raise ValueError("{} should fail to log in".format(type(bad_provider).__name__))
+            except oauth_utils.LoginError as e:
+                if e.status != status:
+                    raise ValueError("Expected a {} error, got {}: {}".format(
+                        status, e.status, e))
+    print "9. Logins verify tokens concurrently and cache verified users."
+
+
+def testFragments():
+    sections = fragment_utils.compile_fragment(
+        "<a<!--#if cat=R&amp;D--> class='in'<!--#endif-->>" +
+        "<!--#if owner=7-->[edit]<!--#endif--><!--#if user-->[new]<!--#endif--></a>")
+    expected = [
+        ({}, "<a></a>"),
+        ({"user_id": 3}, "<a>[new]</a>"),
+        ({"user_id": 7, "active_cat": "R&D"}, "<a class='in'>[edit][new]</a>"),
+        ]
+    for viewer, html in expected:
+        rendered = fragment_utils.render_fragment(sections, **viewer)
+        if rendered != html:
+            raise ValueError("Expected {} for {}, got {}".format(html, viewer, rendered))
+    print "10. Cached fragments are assembled correctly for each viewer."
+
+
+
+def testSearch():
+    db_path = freshDatabase("search")
+    user_id = dal.get_or_create_user("search@example.com", "test", 1).user_id
+    food = dal.create_category("Food", user_id)
+    drinks = dal.create_category("Drinks", user_id)
+    gagh = dal.create_item("Gagh", food, user_id, "pic", "Serpent worms, best served live")
+    dal.create_item("Worm stew", food, user_id, "pic", "Hearty")
+    dal.create_item("Bloodwine", drinks, user_id, "pic", "Goes well with gagh")
+
+    def names(query, count=10, offset=0):
+        return [item.name for item in dal.search_items(query, count, offset)]
+
+    if names("gagh") != ["Gagh", "Bloodwine"]:
+        raise ValueError("Name matches should rank above description matches: {}".format(
+            names("gagh")))
+    if names("wor") != ["Worm stew", "Gagh"] or names("serpent wor") != ["Gagh"]:
+        raise ValueError("The last search term should match as a prefix.")
+    if names("drinks") != ["Bloodwine"] or names("AND (") != [] or names("") != []:
+        raise ValueError("Category names should be searchable and operators ignored.")
+    if names("gagh", 1, 1) != ["Bloodwine"]:
+        raise ValueError("Search results should be paginated.")
+
+    dal.update_item(gagh, name="Racht")
+    dal.update_category(drinks, "Beverages")
+    if names("gagh") != ["Bloodwine"] or names("racht") != ["Racht"]:
+        raise ValueError("Updated items should be reindexed.")
+    if names("beverages") != ["Bloodwine"] or names("drinks") != []:
+        raise ValueError("Renamed categories should be reindexed.")
+    dal.delete_category(drinks)
+    if names("bloodwine") != []:
+        raise ValueError("Deleted items should be removed from the index.")
+
+    plan = queryPlan(db_path, "SELECT i.* FROM items_search AS s " +
+        "JOIN pretty_items_light AS i ON (i.item_id = s.rowid) " +
+        "WHERE items_search MATCH ? ORDER BY s.rank, i.item_id LIMIT ? OFFSET ?",
+        ("x", 10, 0))
+    # (Sorting by rank always needs a temporary b-tree, but only over the matches)
+    if not any("VIRTUAL TABLE INDEX" in step for step in plan) or any(
+            step.startswith("SCAN") and "VIRTUAL TABLE" not in step for step in plan):
+        raise ValueError("Searches should go through the full-text index: {}".format(plan))
+    print "11. Full-text search ranks, pages and stays in sync with the catalog."
+
+
+
+def testKeysetPaging():
+    db_path = freshDatabase("paging")
+    user_id = dal.get_or_create_user("paging@example.com", "test", 1).user_id
+    cat_id = dal.create_category("Paged", user_id)
+    other_id = dal.create_category("Other", user_id)
+    names = ["Item {:02d}".format(i) for i in range(7)]
+    dal.create_items([(name, "", PictureStore.hash_of("pic"), cat_id, user_id)
+        for name in reversed(names)] +
+        [("Item 03", "", PictureStore.hash_of("pic"), other_id, user_id)])
+    dal.create_item("Item 03", cat_id, user_id, "pic")  # Duplicate sort key
+
+    for order in dal.ItemOrders.ALL:
+        expected = [item.item_id for item in sorted(dal.get_items_by_cat(cat_id),
+            key=lambda i: dal.item_page_key(i, order),
+            reverse=(order == dal.ItemOrders.RECENT))]
+        seen = []
+        after = None
+        while True:
+            page = dal.get_items_page(3, after, cat_id, order)
+            seen.extend(item.item_id for item in page)
+            if len(page) < 3:
+                break
+            after = dal.item_page_key(page[-1], order)
+        if seen != expected:
+            raise ValueError("Paging by {} should visit every item once, in order: {} != {}".format(
+                order, seen, expected))
+    cats = dal.get_categories_page(1, dal.category_page_key(dal.get_category(other_id)))
+    if [cat.cat_id for cat in cats] != [cat_id]:
+        raise ValueError("Category pages should continue after the given key.")
+
+    for order, index in ((dal.ItemOrders.NAME, "items_by_cat_name"),
+            (dal.ItemOrders.RECENT, "items_by_cat_changed")):
+        column = "name" if order == dal.ItemOrders.NAME else "changed"
+        direction, comparison = ("ASC", ">") if order == dal.ItemOrders.NAME else ("DESC", "<")
+        assertUsesIndex(db_path,
+            "SELECT * FROM pretty_items_light WHERE cat_id = ? AND {c} {x}= ? AND "
+            "({c} {x} ? OR item_id {x} ?) ORDER BY {c} {d}, item_id {d} LIMIT ?".format(
+                c=column, x=comparison, d=direction),
+            (cat_id, "x", "x", 1, 10), index)
+    assertUsesIndex(db_path,
+        "SELECT * FROM pretty_categories WHERE name >= ? AND (name > ? OR cat_id > ?) " +
+        "ORDER BY name, cat_id LIMIT ?", ("x", "x", 1, 10), "categories_by_name")
+    print "12. Keyset paging visits every entry once, with index range scans."
+
+
+
+def testThumbnails():
+    if not thumbnails.scaling_available():
+        print "13. (Skipped thumbnail tests: Pillow isn't installed.)"
+        return
+    import io
+    from PIL import Image
+    freshDatabase("thumbnails")
+    user_id = dal.get_or_create_user("thumbs@example.com", "test", 1).user_id
+    cat_id = dal.create_category("Thumbs", user_id)
+    def jpeg(size):
+        output = io.BytesIO()
+        Image.new("RGB", size, (200, 30, 30)).save(output, "JPEG")
+        return output.getvalue()
+    big = dal.create_item("Big", cat_id, user_id, jpeg((1600, 1200)))
+    small = dal.create_item("Small", cat_id, user_id, jpeg((40, 20)))
+    dal.wait_for_thumbnails()
+
+    big_hash = dal.get_item(big).pic_hash
+    for rendition, expected in (("list", (96, 72)), ("detail", (640, 480))):
+        path, is_rendition = dal.get_rendition_path(big_hash, rendition)
+        if not is_rendition or Image.open(path).size != expected:
+            raise ValueError("The {} rendition should be scaled to {}.".format(
+                rendition, expected))
+    small_hash = dal.get_item(small).pic_hash
+    path, _ = dal.get_rendition_path(small_hash, "detail")
+    if open(path, "rb").read() != dal.read_picture(small_hash):
+        raise ValueError("Small pictures should be their own rendition.")
+
+    # Renditions that are missing (e.g. for older pictures) are made on demand
+    os.remove(path)
+    if dal.get_rendition_path(small_hash, "detail") != (path, True):
+        raise ValueError("Missing renditions should be generated on request.")
+    if (dal.get_rendition_path(big_hash, "huge") is not None or
+            dal.get_rendition_path("0" * 64, "list") is not None):
+        raise ValueError("Unknown renditions and pictures should not be found.")
+    print "13. Pictures are scaled down to thumbnails in the background."
+
+
+
+def testStreamingUploads():
+    import io
+    import catalog
+    from werkzeug.datastructures import FileStorage
+    freshDatabase("uploads")
+    picture = "\xff\xd8\xff\xe0\x00\x10JFIF\x00" + "x" * 100000
+    store = PictureStore(PICTURE_DIR)
+    if store.save_file(io.BytesIO(picture), chunk_size=4096) != PictureStore.hash_of(picture):
+        raise ValueError("Streamed pictures should be hashed like any other.")
+    if store.read(PictureStore.hash_of(picture)) != picture:
+        raise ValueError("Streamed pictures should be stored intact.")
+
+    upload = FileStorage(io.BytesIO(picture), filename="pic.jpg")
+    stream = catalog.validate_picture(upload)
+    if stream.tell() != 0 or dal.store_picture(stream) != PictureStore.hash_of(picture):
+        raise ValueError("Validated uploads should be streamed into the picture store.")
+    for bad in ("not a picture" * 10, ""):
+        try:
+            catalog.validate_picture(FileStorage(io.BytesIO(bad), filename="pic.jpg"))
+            raise ValueError("Uploads that aren't JPEG files should be rejected.")
+        except catalog.InvalidPictureError:
+            pass
+
+    client = catalog.app.test_client()
+    response = client.post("/catalog/create-item/", data={"state": "x",
+        "item_create_pic": (io.BytesIO("x" * (catalog.MAX_UPLOAD_SIZE + 1)), "pic.jpg")})
+    if response.status_code != 413:
+        raise ValueError("Oversized uploads should be rejected with a 413, got {}".format(
+            response.status_code))
+    print "14. Uploads are validated and stored without reading them into memory."
+
+
+
+def testMetrics():
+    import catalog
+    freshDatabase("metrics")
+    user_id = dal.get_or_create_user("metrics@example.com", "test", 1).user_id
+    cat_id = dal.create_category("Metered", user_id)
+    for i in range(3):
+        dal.create_item("Item {}".format(i), cat_id, user_id, "picture {}".format(i))
+
+    profile_dir = os.path.join(WORKDIR, "profiles")
+    metrics.configure_profiling(1.0, profile_dir)
+    try:
+        client = catalog.app.test_client()
+        response = client.get("/catalog.json?pictures=inline")
+        response.data
+        response.close()
+    finally:
+        metrics.configure_profiling(0.0)
+    if client.get("/metrics").status_code != 404:
+        raise ValueError("/metrics should be hidden unless it's turned on.")
+    catalog.app.config["EXPOSE_METRICS"] = True
+    try:
+        text = client.get("/metrics").data
+    finally:
+        catalog.app.config["EXPOSE_METRICS"] = False
+    route = '{route="/catalog.json"}'
+    expected = ["catalog_request_queries_sum" + route + " 2.0",
+        "catalog_request_rows_sum" + route + " 4.0",
+        "catalog_request_picture_bytes_sum" + route + " 27.0",
+        'catalog_request_duration_seconds{route="/catalog.json",quantile="0.99"}',
+        'catalog_dal_duration_seconds_count{function="read_picture"} ',
+        "catalog_db_pool_checkouts "]
+    for line in expected:
+        if line not in text:
+            raise ValueError("Expected {} in /metrics output:\n{}".format(line, text))
+    if len(os.listdir(profile_dir)) != 1:
+        raise ValueError("Sampled requests should be profiled.")
+
+    summary = metrics.Summary(window=100)
+    for value in range(1, 1001):
+        summary.observe(value)
+    if summary.quantiles() != [(0.5, 951), (0.95, 996), (0.99, 1000)]:
+        raise ValueError("Percentiles should cover the most recent observations: {}".format(
+            summary.quantiles()))
+    print "15. Requests and DAL calls are timed and exported for Prometheus."
+
+
+def testLoadTest():
+    import catalog
+    freshDatabase("load")
+    catalog.app.secret_key = "test"
+    oauth_utils.configure_provider(oauth_utils.StubProvider())
+    # The synthetic pictures can't be scaled
+    logging.getLogger("thumbnails").setLevel(logging.ERROR)
+    built = loadtest.build_catalog(2, 3, 4, 1)
+    if len(built["items"]) != 12 or len(dal.get_categories()) != 3:
+        raise ValueError("Expected a catalog of 12 items, got {}".format(built["items"]))
+
+    server = loadtest.start_server(catalog.app)
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+    try:
+        for label, make_driver in (("client", lambda: loadtest.ClientDriver(catalog.app)),
+                ("http", lambda: loadtest.HttpDriver(base_url))):
+            results, elapsed = loadtest.run_load(make_driver, built, threads=3,
+                requests_per_thread=15, label=label)
+            summary = loadtest.summarize(results, elapsed)["all"]
+            if summary["requests"] < 45 or summary["errors"]:
+                raise ValueError("Load test via {} failed: {}".format(label, summary))
+    finally:
+        server.shutdown()
+    print "16. Virtual users can browse and edit the catalog concurrently."
+
+
+def testAtomFeed():
+    import catalog
+    freshDatabase("feed")
+    user_id = dal.get_or_create_user("feed@example.com", "test", 1).user_id
+    cat_id = dal.create_category("Syndicated", user_id)
+    item_ids = [dal.create_item("Item {}".format(i), cat_id, user_id, "picture")
+        for i in range(3)]
+    client = catalog.app.test_client()
+
+    first_page = client.get("/catalog.atom?limit=2")
+    if 'rel="next" href="http://localhost/catalog.atom?limit=2&amp;page=2"' not in first_page.data:
+        raise ValueError("A partial feed should link to the next page:\n" +
+            first_page.data)
+    if 'rel="next"' in client.get("/catalog.atom?limit=2&page=2").data:
+        raise ValueError("The last page of the feed shouldn't link to a next page.")
+
+    feed = client.get("/catalog.atom")
+    etag = feed.headers.get("ETag")
+    if feed.status_code != 200 or not etag:
+        raise ValueError("The feed should have an ETag")
+    unchanged = client.get("/catalog.atom", headers={"If-None-Match": etag})
+    if unchanged.status_code != 304 or unchanged.data:
+        raise ValueError("Expected a 304 for an unchanged feed, got {}".format(
+            unchanged.status_code))
+
+    # Deleting an item leaves the newest entry's date as it was, so
+    # clients that only send If-Modified-Since mustn't get a 304
+    dal.delete_item(item_ids[1])
+    changed = client.get("/catalog.atom",
+        headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    if changed.status_code != 200 or "Item 1" in changed.data:
+        raise ValueError("Expected the updated feed after a delete, got {}".format(
+            changed.status_code))
+    print "17. The Atom feed pages and answers conditional requests correctly."
+
+
+def testCatalogJson():
+    import catalog
+    db_path = freshDatabase("json")
+    user_id = dal.get_or_create_user("json@example.com", "test", 1).user_id
+    for c in range(3):
+        cat_id = dal.create_category("Category {}".format(c), user_id)
+        for i in range(c):
+            dal.create_item("Item {}".format(i), cat_id, user_id, "picture {}".format(c))
+    client = catalog.app.test_client()
+
+    def fetch(mode):
+        response = client.get("/catalog.json?pictures=" + mode)
+        data = response.data
+        response.close()
+        return response.status_code, data
+    for mode in ("none", "url", "inline"):
+        status, data = fetch(mode)
+        catalog_json = json.loads(data)
+        if status != 200 or [len(cat["items"]) for cat in catalog_json] != [0, 1, 2]:
+            raise ValueError("Unexpected /catalog.json output: {}".format(data))
+        item = catalog_json[2]["items"][1]
+        pic = {"none": None,
+            "url": "/pictures/{}.jpg".format(PictureStore.hash_of("picture 2")),
+            "inline": base64.b64encode("picture 2")}[mode]
+        if item.get("pic_url" if mode == "url" else "pic") != pic or (
+                mode == "none" and "pic_url" in item):
+            raise ValueError("Unexpected item for pictures={}: {}".format(mode, item))
+    default = client.get("/catalog.json")
+    if json.loads(default.data)[2]["items"][1].get("pic") != base64.b64encode("picture 2"):
+        raise ValueError("/catalog.json should inline pictures unless asked not to")
+    default.close()
+    if fetch("thumbnail")[0] != 400:
+        raise ValueError("Unknown picture modes should be rejected")
+
+    # A slow client mustn't keep a pooled connection checked out
+    dal.configure_pool(db_path=db_path, size=1, timeout=0.5)
+    try:
+        stream = catalog.generate_catalog_json("url")
+        for _ in range(3):
+            next(stream)
+        dal.get_categories()
+        chunks = list(dal.iter_catalog(page_size=1))
+        if len(chunks) != 4 or chunks[0][1] is not None:
+            raise ValueError("Paged catalog walk went wrong: {}".format(chunks))
+        stream.close()
+    finally:
+        dal.configure_pool(db_path=db_path)
+
+    # Deleting a category mid-walk mustn't lose the categories after it
+    last_cat_id = dal.create_category("Category 3", user_id)
+    dal.create_item("Last item", last_cat_id, user_id, "picture 3")
+    walk = dal.iter_catalog(page_size=2)
+    walked = [next(walk)]
+    dal.delete_category(dal.get_category_by_name("Category 2").cat_id)
+    walked.extend(walk)
+    names = [(cat.name, item and item.name) for cat, item in walked]
+    if names != [("Category 0", None), ("Category 1", "Item 0"),
+            ("Category 3", "Last item")]:
+        raise ValueError("Catalog walk lost rows after a delete: {}".format(names))
+    print "18. /catalog.json includes pictures as asked, without hogging the pool."
+
+
+def testConnectionPool():
+    pool = ConnectionPool(os.path.join(WORKDIR, "pool.db"), size=1, timeout=0.2)
+    conn = pool.checkout()
+    try:
+        pool.checkout()
+        raise ValueError("Checking out of an exhausted pool should time out")
+    except PoolTimeoutError:
+        pass
+    stats = pool.get_stats()
+    if (stats["timeouts"], stats["waits"], stats["in_use"]) != (1, 1, 1):
+        raise ValueError("Timeouts should be counted: {}".format(stats))
+
+    # A waiting checkout gets the connection as soon as it's returned
+    returner = threading.Timer(0.05, pool.checkin, (conn,))
+    returner.start()
+    if pool.checkout() is not conn:
+        raise ValueError("Returned connections should be reused")
+    returner.join()
+    pool.checkin(conn)
+
+    # Connections that stopped working are replaced
+    conn.close()
+    fresh = pool.checkout()
+    if fresh is conn or fresh.execute("SELECT 1").fetchone()[0] != 1:
+        raise ValueError("Unhealthy connections should be discarded")
+    pool.checkin(fresh)
+
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE things (name TEXT)")
+        conn.execute("INSERT INTO things VALUES ('kept')")
+    try:
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO things VALUES ('lost')")
+            raise RuntimeError("Boom")
+    except RuntimeError:
+        pass
+    with pool.connection() as conn:
+        names = [row[0] for row in conn.execute("SELECT name FROM things")]
+    if names != ["kept"]:
+        raise ValueError("Failed blocks should be rolled back, found {}".format(names))
+
+    stats = pool.get_stats()
+    expected = {"checkouts": 6, "waits": 2, "timeouts": 1, "creations": 2,
+        "discards": 1, "size": 1, "open": 1, "idle": 1, "in_use": 0}
+    for name, value in expected.items():
+        if stats[name] != value:
+            raise ValueError("Expected {} {}, got {}".format(value, name, stats))
+    if stats["wait_time"] <= 0:
+        raise ValueError("Time spent waiting should be counted: {}".format(stats))
+    pool.close_all()
+    print "19. The connection pool is bounded, self-healing and transactional."
+
+
+def testEntities():
+    convert = entities.Item.row_converter(("item_id", "name", "pic_hash", "unknown"))
+    item = convert((1L, u"Caf\xe9 \"table\"", "abc123", "ignored"))
+    if (item.item_id, item.pic_hash, item.description) != (1L, "abc123", None):
+        raise ValueError("Rows should be converted by column name.")
+    if hasattr(item, "__dict__") or convert is not entities.Item.row_converter(
+            ["item_id", "name", "pic_hash", "unknown"]):
+        raise ValueError("Items should be slotted, with one converter per column list.")
+
+    item.pic_id = 7
+    item.changed = 1.5
+    item.pic = buffer("picture data")
+    expected = {"item_id": 1, "name": u"Caf\xe9 \"table\"", "pic_hash": "abc123",
+        "pic_id": 7, "changed": 1.5, "pic": "picture data"}
+    if item.to_dict() != dict(expected, pic=item.pic):
+        raise ValueError("to_dict() should skip unset fields: {}".format(item.to_dict()))
+    encoded = entities.to_json(item)
+    if json.loads(encoded) != expected or encoded != item.to_json():
+        raise ValueError("Unexpected JSON for an item: {}".format(encoded))
+    cat = entities.Category(cat_id=2, name="Tables")
+    nested = entities.to_json({"items": [item], "category": cat})
+    if json.loads(nested) != {"items": [expected], "category": {"cat_id": 2, "name": "Tables"}}:
+        raise ValueError("Entities nested in lists and dicts should be encoded: {}".format(nested))
+    try:
+        entities.to_json([object()])
+        raise ValueError("Only entities and plain JSON values should be encoded.")
+    except TypeError:
+        pass
+    print "20. Entities are compact, and convert to and from rows, dicts and JSON."
+
+
+def testSidebar():
+    freshDatabase("sidebar")
+    user_id = dal.get_or_create_user("sidebar@example.com", "test", 1).user_id
+
+    def countSidebarQueries():
+        dal.invalidate_catalog_cache()
+        stats = metrics.start_request()
+        try:
+            sidebar = dal.list_items_by_cat()
+        finally:
+            metrics.finish_request("sidebar test")
+        return stats.queries, [(cat.name, sorted(item.name for item in items))
+            for cat, items in sidebar]
+
+    dal.create_category("Empty", user_id)
+    few_queries, _ = countSidebarQueries()
+    for c in range(5):
+        cat_id = dal.create_category("Category {}".format(c), user_id)
+        for i in range(c):
+            dal.create_item("Item {}.{}".format(c, i), cat_id, user_id, "picture")
+    queries, sidebar = countSidebarQueries()
+    if queries != few_queries:
+        raise ValueError("The sidebar should take {} queries no matter how many "
+            "categories there are, took {}".format(few_queries, queries))
+    expected = [("Empty", [])] + [("Category {}".format(c),
+        ["Item {}.{}".format(c, i) for i in range(c)]) for c in range(5)]
+    if sorted(sidebar) != sorted(expected):
+        raise ValueError("Items should be grouped under their categories: {}".format(sidebar))
+    print "21. The sidebar is built with a fixed number of queries."
+
+
+def testCacheGenerations():
+    lru = LRUCache(max_entries=2, ttl=0.05)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    if (lru.get("a"), lru.get("b")) != (1, MISSING):
+        raise ValueError("The least recently used entry should be evicted first.")
+    time.sleep(0.1)
+    if lru.get("a") is not MISSING:
+        raise ValueError("Entries should expire after their TTL.")
+
+    # Two workers, each with its own store, sharing one generation file
+    path = os.path.join(WORKDIR, "generations.db")
+    first = GenerationalCache(LRUCache(), SqliteGeneration(path))
+    second = GenerationalCache(LRUCache(), SqliteGeneration(path))
+    first.get_or_load("tree", lambda: "first v1")
+    second.get_or_load("tree", lambda: "second v1")
+    if (first.get_or_load("tree", lambda: "reloaded"),
+            second.get_or_load("tree", lambda: "reloaded")) != ("first v1", "second v1"):
+        raise ValueError("Cached values should be reused until invalidated.")
+    first.invalidate()
+    if second.get_or_load("tree", lambda: "second v2") != "second v2":
+        raise ValueError("An invalidation in one worker should reach the others.")
+    invalidator = threading.Thread(target=second.invalidate)
+    invalidator.start()
+    invalidator.join()
+    if first.get_or_load("tree", lambda: "first v2") != "first v2":
+        raise ValueError("Invalidations from other threads should be seen too.")
+
+    # The DAL bumps a shared generation on every write
+    freshDatabase("generations")
+    dal.configure_cache(generation=SqliteGeneration(path))
+    try:
+        before = SqliteGeneration(path).current()
+        dal.create_category("Shared", dal.get_or_create_user("gen@example.com", "test", 1).user_id)
+        if SqliteGeneration(path).current() <= before:
+            raise ValueError("DAL writes should bump the shared generation.")
+    finally:
+        dal.configure_cache()
+    print "22. Cached catalog data is invalidated across workers."
+
+
+def testPictureStore():
+    import catalog
+    freshDatabase("store")
+    store = PictureStore(os.path.join(WORKDIR, "store"))
+    pic_hash = store.save("picture data")
+    if store.path_for(pic_hash) != os.path.join(WORKDIR, "store", pic_hash[:2],
+            pic_hash + ".jpg") or store.read(pic_hash) != "picture data":
+        raise ValueError("Pictures should be stored under their hash.")
+    if store.save("picture data") != pic_hash or len(os.listdir(
+            os.path.join(WORKDIR, "store", pic_hash[:2]))) != 1:
+        raise ValueError("Identical pictures should share a file.")
+    for bad in ("../../etc/passwd", pic_hash.upper(), pic_hash[:-1], None):
+        if store.exists(bad):
+            raise ValueError("Malformed hashes should never be found: {!r}".format(bad))
+        try:
+            store.path_for(bad)
+            raise ValueError("Malformed hashes should be rejected: {!r}".format(bad))
+        except ValueError as e:
+            if "Invalid picture hash" not in str(e):
+                raise
+
+    user_id = dal.get_or_create_user("store@example.com", "test", 1).user_id
+    cat_id = dal.create_category("Pictures", user_id)
+    first = dal.get_item(dal.create_item("First", cat_id, user_id, "shared"), with_picture=True)
+    second = dal.get_item(dal.create_item("Second", cat_id, user_id, "shared"), with_picture=True)
+    if (first.pic_id, first.pic) != (second.pic_id, "shared"):
+        raise ValueError("Items with identical pictures should share a pictures row.")
+
+    client = catalog.app.test_client()
+    response = client.get("/pictures/{}.jpg".format(first.pic_hash))
+    if response.data != "shared" or "immutable" not in response.headers["Cache-Control"]:
+        raise ValueError("Pictures should be served with far-future caching.")
+    response.close()
+    cached = client.get("/pictures/{}.jpg".format(first.pic_hash),
+        headers={"If-None-Match": '"{}"'.format(first.pic_hash)})
+    if cached.status_code != 304:
+        raise ValueError("Pictures should be revalidated by their hash.")
+    if client.get("/pictures/{}.jpg".format(pic_hash[:-1])).status_code != 404:
+        raise ValueError("Malformed picture hashes should be answered with a 404.")
+    print "23. Pictures are stored once per content and served by their hash."
+
+
+if __name__ == '__main__':
+    try:
+        testMigrateFreshDatabase()
+        testMigrationsKeepData()
+        testMigrateLegacyPictures()
+        testLookupsUseIndexes()
+        testBulkImport()
+        testLazyPictures()
+        testUpdateItem()
+        testServerSideSessions()
+        testLoginPipeline()
+        testFragments()
+        testSearch()
+        testKeysetPaging()
+        testThumbnails()
+        testStreamingUploads()
+        testMetrics()
+        testLoadTest()
+        testAtomFeed()
+        testCatalogJson()
+        testConnectionPool()
+        testEntities()
+        testSidebar()
+        testCacheGenerations()
+        testPictureStore()
+        print "Success!  All tests pass!"
+    finally:
+        dal.wait_for_thumbnails()
+        shutil.rmtree(WORKDIR)
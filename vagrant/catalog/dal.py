@@ -15,15 +15,184 @@ are properly passed to the DB using parameterized queries.
     control in its own module.)
 """
 
+import base64
 import contextlib
+import re
 import sqlite3
 
 import logging
 logger = logging.getLogger(__name__)
 
+import metrics
+import migrations
+from cache_utils import GenerationalCache, LRUCache
+from db_pool import ConnectionPool
+import entities
 from entities import AuthSource, User, Category, Item
+from picture_store import PictureStore
+from thumbnails import ThumbnailPipeline, THUMBNAIL_WORKERS
 
 
+# Default location of our database file, relative to the project directory
+DB_PATH = "catalog.db"
+# Default directory for item picture files (see picture_store.py)
+PICTURE_DIR = "pictures"
+# Default number of pooled connections; should be at least the number of
+# request threads a single web worker runs concurrently.
+DB_POOL_SIZE = 5
+# Rows fetched per pooled connection checkout by iter_catalog()
+CATALOG_PAGE_SIZE = 500
+
+__pool = ConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+
+def configure_pool(db_path=DB_PATH, size=DB_POOL_SIZE, timeout=10.0):
+    """
+    Replaces the connection pool used by get_cursor().  Connections idling in
+    the old pool are closed.  Call this once at startup (before serving any
+    requests) to point the DAL at a different database or resize the pool.
+    """
+    global __pool
+    old_pool = __pool
+    __pool = ConnectionPool(db_path, size=size, timeout=timeout)
+    old_pool.close_all()
+
+def get_pool_stats():
+    """
+    Returns a dict of connection pool usage counters (checkouts, waits,
+    creations, etc; see db_pool.PoolStats) for sizing the pool in production.
+    """
+    return __pool.get_stats()
+
+
+__picture_store = PictureStore(PICTURE_DIR)
+__thumbnails = ThumbnailPipeline(__picture_store)
+
+def configure_picture_store(root=PICTURE_DIR, thumbnail_workers=THUMBNAIL_WORKERS):
+    """
+    Points the DAL at a different picture directory.  Renditions still
+    queued for the old one are finished first.
+    """
+    global __picture_store, __thumbnails
+    old_thumbnails = __thumbnails
+    __picture_store = PictureStore(root)
+    __thumbnails = ThumbnailPipeline(__picture_store, workers=thumbnail_workers)
+    old_thumbnails.wait()
+
+def get_picture_path(pic_hash):
+    """
+    Returns the on-disk path of a stored picture, or None if pic_hash
+    is malformed or doesn't refer to a stored picture.
+    """
+    if not __picture_store.exists(pic_hash):
+        return None
+    return __picture_store.path_for(pic_hash)
+
+@metrics.timed
+def get_rendition_path(pic_hash, rendition):
+    """
+    Returns a (path, is_rendition) tuple for serving a scaled-down rendition
+    of a stored picture (see thumbnails.py), or None if there is no such
+    picture or rendition.  is_rendition is False when the original
+    picture had to be used instead.
+    """
+    return __thumbnails.get_path(pic_hash, rendition)
+
+def wait_for_thumbnails():
+    """ Blocks until the renditions of every picture stored so far have been generated. """
+    __thumbnails.wait()
+
+@metrics.timed
+def read_picture(pic_hash):
+    """ Returns the raw data for a stored picture. """
+    pic = __picture_store.read(pic_hash)
+    metrics.count_picture_bytes(len(pic))
+    return pic
+
+@metrics.timed
+def get_picture_hash(pic_id):
+    """ Returns the hash of a stored picture given its pic_id, or None if there is no such picture. """
+    with get_cursor() as cursor:
+        cursor.execute("SELECT pic_hash FROM pictures WHERE pic_id = ?", (pic_id,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+@metrics.timed
+def store_picture(pic):
+    """
+    Writes a picture to the picture store and returns its hash, without
+    touching the database (see create_items()).  pic is either the raw
+    picture data or a file object to stream it from (like an upload).
+    Its renditions are generated in the background.  Safe to call from
+    several threads at once.
+    """
+    if hasattr(pic, "read"):
+        pic_hash = __picture_store.save_file(pic)
+    else:
+        pic_hash = __picture_store.save(pic)
+    __thumbnails.submit(pic_hash)
+    return pic_hash
+
+def __save_picture(cursor, pic):
+    """
+    Writes a picture (see store_picture()) to the picture store and returns
+    the pic_id of its (possibly pre-existing) record in the pictures table.
+    """
+    pic_hash = store_picture(pic)
+    cursor.execute("INSERT OR IGNORE INTO pictures VALUES (null, ?)", (pic_hash,))
+    cursor.execute("SELECT pic_id FROM pictures WHERE pic_hash = ?", (pic_hash,))
+    return cursor.fetchone()[0]
+
+
+# Items loaded without their picture fetch it on first access
+entities.set_picture_loaders(get_picture_hash, read_picture)
+
+
+# Caches values derived from the category/item tree (like the sidebar).
+# Every function that changes categories or items must call
+# invalidate_catalog_cache() once its transaction has committed.
+__catalog_cache = GenerationalCache(LRUCache(max_entries=16, ttl=300))
+
+def configure_cache(store=None, generation=None):
+    """
+    Replaces the catalog cache.  For a single process, the defaults
+    (an in-memory LRU and a local generation counter) are fine.
+    When running several web workers, share the generation so that a write
+    in one worker invalidates the others:
+        dal.configure_cache(generation=cache_utils.SqliteGeneration("cache.db"))
+    """
+    global __catalog_cache
+    __catalog_cache = GenerationalCache(
+        store if store is not None else LRUCache(max_entries=16, ttl=300),
+        generation)
+
+def get_cache_stats():
+    """ Returns a dict of catalog cache hit/miss counters. """
+    return __catalog_cache.get_stats()
+
+def get_catalog_generation():
+    """
+    Returns a number that changes every time a category or item is created,
+    updated or deleted.  Useful as a cache key for anything built on top of
+    the catalog.
+    """
+    return __catalog_cache.current_generation()
+
+def get_or_build_cached(key, loader):
+    """
+    Returns a value derived from the catalog (like a rendered template
+    fragment) from the catalog cache, calling loader() to build it if it
+    isn't cached or the catalog has changed since.  Cached values are
+    shared between callers and must not be modified.
+    """
+    return __catalog_cache.get_or_load(key, loader)
+
+def invalidate_catalog_cache():
+    """
+    Marks all cached catalog data as stale.  Called automatically by the
+    DAL's own write functions; call it manually after changing the
+    database by any other means.
+    """
+    __catalog_cache.invalidate()
 
 @contextlib.contextmanager
 def get_cursor():
@@ -31,48 +200,50 @@ def get_cursor():
     (This function was adapted from the code review for FSND project 2)
 
     Helper function that provides a DB cursor scoped to a with block.
+    The underlying connection is borrowed from our connection pool, and
+    the transaction is committed (or rolled back on error) when the block exits.
 
     Sample call:
         with with_cursor() as cursor:
             cursor.execute("delete from matches;")
     """
-    conn = sqlite3.connect("data source=catalog.db; foreign keys=true;")
-    # This Row wrapper adds the ability to access a row's fields by column name,
-    # allowing us to auto-convert them to entities as long as the field names
-    # match (see entity_from_row()).
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    try:
-        yield c
-    except:
-        raise
-    else:
-        conn.commit()
-    finally:
-        conn.close()
+    with __pool.connection() as conn:
+        # Counts queries and rows towards the current request, if any (see metrics.py)
+        c = metrics.instrument_cursor(conn.cursor())
+        try:
+            yield c
+        finally:
+            c.close()
 
 def entity_from_row(entity_class, row):
     """
     Converts a database row into a new instance of type entity_class.
-    Assumes that every column in the row corresponds to a field in
-    entity_class that has the same spelling and can be copied verbatim.
+    Assumes that every column in the row that corresponds to a field in
+    entity_class has the same spelling and can be copied verbatim
+    (see Entity.row_converter()).
 
     Note that this will only work for very simple entities; anything
     more complex should have its own converter.
 
-    Throws a TypeError if entity_class isn't a class with a no-args constructor.
-
     Returns an entity_class instance if the row was valid, or None if it wasn't.
     """
     if not row:
         return None
-    try:
-        entity = entity_class()
-        for field in row.keys():
-            setattr(entity, field, row[field])
-        return entity
-    except KeyError:
-        return None
+    return entity_class.row_converter(row.keys())(row)
+
+def entities_from_rows(entity_class, rows):
+    """
+    Converts a list of database rows from the same query into entity_class
+    instances.  The row converter is only looked up once, for the first row.
+    """
+    if not rows:
+        return []
+    convert = entity_class.row_converter(rows[0].keys())
+    return [convert(row) for row in rows]
+
+def __converter_for(cursor, entity_class):
+    """ Returns a row converter matching the columns of the cursor's current query. """
+    return entity_class.row_converter([column[0] for column in cursor.description])
 
 def __simple_get_all(UNSAFE_table_name, UNSAFE_entity_class):
     """
@@ -81,13 +252,10 @@ def __simple_get_all(UNSAFE_table_name, UNSAFE_entity_class):
 
     Gets all entities of type entity_class from the given table.
     """
-    output = []
     with get_cursor() as cursor:
         cursor.execute('SELECT * FROM {}'.format(UNSAFE_table_name))
         result = cursor.fetchall()
-    for row in result:
-        output.append(entity_from_row(UNSAFE_entity_class, row))
-    return output
+    return entities_from_rows(UNSAFE_entity_class, result)
 
 def __simple_get(UNSAFE_table_name, UNSAFE_entity_class, UNSAFE_search_field, search_text):
     """
@@ -113,16 +281,34 @@ def __simple_delete(UNSAFE_table_name, UNSAFE_entity_class, UNSAFE_search_field,
     column search_field matches search_text.
     """
     with get_cursor() as cursor:
-        cursor.execute('PRAGMA foreign_keys = ON')
         cursor.execute('DELETE FROM {} WHERE {} = ?'.format(
             UNSAFE_table_name, UNSAFE_search_field), (search_text,))
 
+def __after_key(UNSAFE_key_columns, UNSAFE_comparison, key):
+    """
+    UNSAFE fields may be processed through simple string formatting;
+    *do not* send user input to these fields.
+
+    Returns a (WHERE condition, args) pair matching the rows whose one or two
+    key columns come after <key>, comparing with ">" (or "<" for descending
+    keys).  This does what a row value comparison like (a, b) > (?, ?) would,
+    but those need SQLite 3.15, and the VM ships 3.8.2.  The first column is
+    also bounded on its own, so that the condition is an index range scan.
+    """
+    if len(UNSAFE_key_columns) == 1:
+        return "{} {} ?".format(UNSAFE_key_columns[0], UNSAFE_comparison), [key[0]]
+    first, second = UNSAFE_key_columns
+    return ("{a} {c}= ? AND ({a} {c} ? OR {b} {c} ?)".format(
+        a=first, b=second, c=UNSAFE_comparison), [key[0], key[0], key[1]])
+
 
 
+@metrics.timed
 def get_users():
     """ Returns a list of all users who have ever logged in. """
     return __simple_get_all("users", User)
 
+@metrics.timed
 def get_user(user_id):
     """
     Returns a User instance if the user_id corresponds to someone who has
@@ -130,6 +316,7 @@ def get_user(user_id):
     """
     return __simple_get("users", User, "user_id", user_id)
 
+@metrics.timed
 def get_or_create_user(username, auth_source, auth_source_id):
     """
     Returns a User instance containing the referenced user's data if it exists
@@ -150,6 +337,7 @@ def get_or_create_user(username, auth_source, auth_source_id):
         user_id = create_user(username, auth_source, auth_source_id)
         return get_user(user_id)
 
+@metrics.timed
 def create_user(username, auth_source, auth_source_id):
     """ Creates a new database record and returns its ID number. """
     id = None
@@ -162,18 +350,44 @@ def create_user(username, auth_source, auth_source_id):
 
 
 
+@metrics.timed
 def get_categories():
     """ Get a list of all categories that currently exist. """
     return __simple_get_all("pretty_categories", Category)
 
+@metrics.timed
+def get_categories_page(count, after=None):
+    """
+    Get a list of up to <count> categories in name order, starting after the
+    category whose (name, cat_id) is <after> (or at the start if that's None).
+    Each page is a single index range scan, no matter how deep into the list it is.
+    """
+    args = []
+    where = ""
+    if after is not None:
+        condition, args = __after_key(("name", "cat_id"), ">", after)
+        where = "WHERE " + condition + " "
+    with get_cursor() as cursor:
+        cursor.execute("SELECT * FROM pretty_categories " + where +
+            "ORDER BY name, cat_id LIMIT ?", args + [count])
+        result = cursor.fetchall()
+    return entities_from_rows(Category, result)
+
+def category_page_key(cat):
+    """ Returns the value to pass as get_categories_page(after=...) to continue after cat. """
+    return (cat.name, cat.cat_id)
+
+@metrics.timed
 def get_category(cat_id):
     """ Get a particular category if it exists, or None if it doesn't. """
     return __simple_get("pretty_categories", Category, "cat_id", cat_id)
 
+@metrics.timed
 def get_category_by_name(cat_name):
     """ Get a particular category if it exists, or None if it doesn't. """
     return __simple_get("pretty_categories", Category, "name", cat_name)
 
+@metrics.timed
 def create_category(name, creator_id):
     """ Creates a new category record and returns its ID number. """
     id = None
@@ -182,141 +396,427 @@ def create_category(name, creator_id):
             name, creator_id))
         cursor.execute('SELECT last_insert_rowid()')
         id = cursor.fetchone()[0]
+    invalidate_catalog_cache()
     return id
 
+@metrics.timed
 def delete_category(cat_id):
     """ Delete a particular category if it exists. """
     __simple_delete("categories", Category, "cat_id", cat_id)
+    invalidate_catalog_cache()
 
+@metrics.timed
 def update_category(cat_id, name):
     """ Update the DB record for a particular category. """
     with get_cursor() as cursor:
         cursor.execute('UPDATE categories SET name=? WHERE cat_id=?', (name, cat_id))
+    invalidate_catalog_cache()
 
 
 
-def get_items():
+# Item lookups skip the pictures table unless asked for with_picture=True;
+# the returned items then fetch their pic_hash (and pic) on first access.
+# Pass with_picture=True when the picture is definitely going to be used.
+
+def __items_view(with_picture):
+    return "pretty_items" if with_picture else "pretty_items_light"
+
+@metrics.timed
+def get_items(with_picture=False):
     """ Get a list of all items that exist. """
-    return __simple_get_all("pretty_items", Item)
+    return __simple_get_all(__items_view(with_picture), Item)
 
-def get_item(item_id):
+@metrics.timed
+def get_item(item_id, with_picture=False):
     """ Get a particular item if it exists, or None if it doesn't. """
-    return __simple_get("pretty_items", Item, "item_id", item_id)
+    return __simple_get(__items_view(with_picture), Item, "item_id", item_id)
 
-def get_items_by_cat(cat_id, lightweight=False):
+@metrics.timed
+def get_items_by_cat(cat_id, with_picture=False):
+    """ Get a list of all items that belong to a particular category, in name order. """
+    with get_cursor() as cursor:
+        cursor.execute('SELECT * FROM {} WHERE cat_id = ? ORDER BY name, item_id'.format(
+            __items_view(with_picture)), (cat_id,))
+        result = cursor.fetchall()
+    return entities_from_rows(Item, result)
+
+class ItemOrders(object):
+    """ Enum listing the orders get_items_page() can list items in. """
+    NAME = "name"
+    RECENT = "recent"
+    ALL = (NAME, RECENT)
+
+# Sort column, direction and keyset comparison for each of ItemOrders;
+# item_id breaks ties, so every key is unique.
+__ITEM_ORDERS = {
+    ItemOrders.NAME: ("name", "ASC", ">"),
+    ItemOrders.RECENT: ("changed", "DESC", "<"),
+    }
+
+@metrics.timed
+def get_items_page(count, after=None, cat_id=None, order=ItemOrders.NAME,
+        with_picture=False):
     """
-    Get a list of all items that belong to a particular category.
-    If lightweight, some bulky information like binary picture data
-    may be missing from the item instances.
+    Get a list of up to <count> items (from one category, or from all of them
+    if cat_id is None), in the given order, starting after the item whose
+    key (see item_page_key()) is <after>.  Unlike LIMIT/OFFSET paging, every
+    page costs the same: it's a single range scan over an index.
     """
-    output = []
+    UNSAFE_column, UNSAFE_direction, UNSAFE_comparison = __ITEM_ORDERS[order]
+    conditions = []
+    args = []
+    if cat_id is not None:
+        conditions.append("cat_id = ?")
+        args.append(cat_id)
+    if after is not None:
+        condition, after_args = __after_key((UNSAFE_column, "item_id"), UNSAFE_comparison, after)
+        conditions.append(condition)
+        args.extend(after_args)
+    where = "WHERE " + " AND ".join(conditions) + " " if conditions else ""
     with get_cursor() as cursor:
-        if lightweight:
-            cursor.execute('SELECT * FROM pretty_items_light WHERE cat_id = ?', (cat_id,))
-        else:
-            cursor.execute('SELECT * FROM pretty_items WHERE cat_id = ?', (cat_id,))
+        cursor.execute("SELECT * FROM {} {}ORDER BY {} {d}, item_id {d} LIMIT ?".format(
+            __items_view(with_picture), where, UNSAFE_column, d=UNSAFE_direction),
+            args + [count])
         result = cursor.fetchall()
-    for row in result:
-        output.append(entity_from_row(Item, row))
-    return output
+    return entities_from_rows(Item, result)
+
+def item_page_key(item, order=ItemOrders.NAME):
+    """ Returns the value to pass as get_items_page(after=...) to continue after item. """
+    return (getattr(item, __ITEM_ORDERS[order][0]), item.item_id)
 
-def get_item_by_name(cat_id, item_name):
+@metrics.timed
+def get_item_by_name(cat_id, item_name, with_picture=False):
     """ Get a particular item if it exists, or None if it doesn't. """
     output = None
     with get_cursor() as cursor:
-        cursor.execute('SELECT * FROM pretty_items WHERE cat_id = ? AND name = ?',
-            (cat_id, item_name,))
+        cursor.execute('SELECT * FROM {} WHERE cat_id = ? AND name = ?'.format(
+            __items_view(with_picture)), (cat_id, item_name,))
         output = entity_from_row(Item, cursor.fetchone())
     return output
 
-def get_recent_items(count):
-    """ Get a list of the <count> most recent items that have been created or changed. """
-    output = []
+@metrics.timed
+def get_recent_items(count, offset=0, with_picture=False):
+    """
+    Get a list of the <count> most recent items that have been created or changed,
+    skipping the first <offset> of them.
+    """
     with get_cursor() as cursor:
-        cursor.execute('SELECT * FROM pretty_items ORDER BY changed DESC LIMIT ?', (count,))
+        cursor.execute('SELECT * FROM {} ORDER BY changed DESC, item_id DESC '.format(
+            __items_view(with_picture)) + 'LIMIT ? OFFSET ?', (count, offset))
         result = cursor.fetchall()
-    for row in result:
-        output.append(entity_from_row(Item, row))
-    return output
+    return entities_from_rows(Item, result)
+
+# Words in a search query; everything else (including FTS operators) is ignored
+__SEARCH_TERM = re.compile(r"\w+", re.UNICODE)
+
+def build_search_query(text):
+    """
+    Turns free text typed by a user into an FTS5 query that matches items
+    containing every word, where the last word may be a prefix (so that
+    results can show up while typing).  Returns None if there's nothing to search for.
+    """
+    terms = __SEARCH_TERM.findall(text or u"")
+    if not terms:
+        return None
+    # Quoting each term keeps words like AND/NEAR from being read as operators
+    quoted = [u'"{}"'.format(term) for term in terms]
+    quoted[-1] += u"*"
+    return u" ".join(quoted)
+
+@metrics.timed
+def search_items(text, count, offset=0, with_picture=False):
+    """
+    Full-text search over item names, descriptions and category names
+    (see the items_search table in migrations.py).  Returns up to <count>
+    items, best matches first, skipping the first <offset> of them.
+    """
+    query = build_search_query(text)
+    if query is None:
+        return []
+    with get_cursor() as cursor:
+        cursor.execute('SELECT i.* FROM items_search AS s ' +
+            'JOIN {} AS i ON (i.item_id = s.rowid) '.format(__items_view(with_picture)) +
+            'WHERE items_search MATCH ? ORDER BY s.rank, i.item_id LIMIT ? OFFSET ?',
+            (query, count, offset))
+        result = cursor.fetchall()
+    return entities_from_rows(Item, result)
 
+@metrics.timed
 def list_items_by_cat():
     """
     Returns a list of sorted tuples:
         Item 0: A category instance
         Item 1: An array containing all item instances in that category
-    This is used to build the dashboard sidebar; in production, a
-    caching solution or AJAX would be tacked on for performance reasons.
+    This is used to build the dashboard sidebar, so the result is cached
+    until the next category or item change.  The returned instances
+    are shared between callers and must not be modified.
     """
+    return __catalog_cache.get_or_load("items_by_cat", __load_items_by_cat)
+
+def __load_items_by_cat():
+    """
+    Uncached version of list_items_by_cat().  Runs a fixed number of queries
+    (one for categories, one for the lightweight items in every category)
+    no matter how many categories exist, and groups the items in Python.
+    """
+    with get_cursor() as cursor:
+        cursor.execute('SELECT * FROM pretty_categories')
+        cat_rows = cursor.fetchall()
+        cursor.execute('SELECT * FROM pretty_items_light')
+        item_rows = cursor.fetchall()
+
+    items_by_cat_id = {}
+    for item in entities_from_rows(Item, item_rows):
+        items_by_cat_id.setdefault(item.cat_id, []).append(item)
     output = []
-    for cat in get_categories():
-        items = get_items_by_cat(cat.cat_id, lightweight=True)
-        output.append((cat, items))
+    for cat in entities_from_rows(Category, cat_rows):
+        output.append((cat, items_by_cat_id.get(cat.cat_id, [])))
     return output
 
+def iter_catalog(lightweight=False, page_size=CATALOG_PAGE_SIZE):
+    """
+    Generator that walks the whole catalog without loading it into memory.
+    Yields a (Category, Item) pair for every item, ordered by category; a
+    category that has no items is yielded once as (Category, None).
+    If lightweight, the items won't carry their pic_hash (it's fetched
+    separately for each item on first access).
+
+    Rows are fetched page_size at a time, and a pooled connection is only
+    checked out while a page is being fetched, so slow consumers (e.g. a
+    client downloading /catalog.json) don't tie up the pool.  Pages are
+    read separately, so writes made during the walk may or may not show up;
+    items whose category can't be found (because it was deleted, or created,
+    after its page was read) are skipped and logged.
+    """
+    view = "pretty_items_light" if lightweight else "pretty_items"
+    categories = __iter_pages("pretty_categories", Category, ("cat_id",), page_size)
+    items = __iter_pages(view, Item, ("cat_id", "item_id"), page_size)
+    item = next(items, None)
+    for cat in categories:
+        while item is not None and item.cat_id < cat.cat_id:
+            logger.info("Skipping item {} of vanished category {} in catalog walk".format(
+                item.item_id, item.cat_id))
+            item = next(items, None)
+        found_items = False
+        while item is not None and item.cat_id == cat.cat_id:
+            found_items = True
+            yield cat, item
+            item = next(items, None)
+        if not found_items:
+            yield cat, None
+    while item is not None:
+        logger.info("Skipping item {} of unknown category {} in catalog walk".format(
+            item.item_id, item.cat_id))
+        item = next(items, None)
+
+def __iter_pages(UNSAFE_view, entity_class, key_columns, page_size):
+    """
+    UNSAFE fields may be processed through simple string formatting;
+    *do not* send user input to these fields.
+
+    Generator yielding every row of the view as an entity_class instance,
+    ordered by the (unique) key columns.  Each page of rows is fetched by a
+    keyset query over its own pooled connection checkout.
+    """
+    columns = ", ".join(key_columns)
+    after = None
+    while True:
+        with get_cursor() as cursor:
+            if after is None:
+                cursor.execute("SELECT * FROM {} ORDER BY {} LIMIT ?".format(
+                    UNSAFE_view, columns), (page_size,))
+            else:
+                condition, args = __after_key(key_columns, ">", after)
+                cursor.execute("SELECT * FROM {} WHERE {} ORDER BY {} LIMIT ?".format(
+                    UNSAFE_view, condition, columns), args + [page_size])
+            to_entity = __converter_for(cursor, entity_class)
+            page = [to_entity(row) for row in cursor.fetchall()]
+        for entity in page:
+            yield entity
+        if len(page) < page_size:
+            return
+        after = tuple(getattr(page[-1], column) for column in key_columns)
+
+@metrics.timed
 def create_item(name, category_id, creator_id, pic, description=None):
-    """ Creates a new Item instance and returns its item_id. """
+    """
+    Creates a new Item instance and returns its item_id.
+    pic should contain the raw (not base64-encoded) JPEG data, or be a
+    file object to stream it from.
+    """
     id = None
     if description is None:
         description = "Placeholder item description"
     with get_cursor() as cursor:
-        # First, create the picture and get its new ID number
-        cursor.execute("INSERT INTO pictures VALUES (null, ?)",
-            (sqlite3.Binary(pic),))
-        cursor.execute('SELECT last_insert_rowid()')
-        pic_id = cursor.fetchone()[0]
+        # First, store the picture and get its ID number
+        pic_id = __save_picture(cursor, pic)
 
         # Now create the actual item and return its ID
-        cursor.execute("INSERT INTO items VALUES (null,?,?,?,?,?,(DATETIME('now')))",
+        cursor.execute("INSERT INTO items (name, description, pic_id, cat_id, creator_id, changed) " +
+            "VALUES (?,?,?,?,?,(DATETIME('now')))",
             (name, description, pic_id, category_id, creator_id))
         cursor.execute('SELECT last_insert_rowid()')
         id = cursor.fetchone()[0]
+    invalidate_catalog_cache()
     return id
 
+@metrics.timed
+def create_items(rows):
+    """
+    Creates many items at once, for bulk imports (see item_import.py).
+    rows is a list of (name, description, pic_hash, cat_id, creator_id) tuples,
+    whose pictures must already have been saved with store_picture().
+
+    Each statement is run once for the whole list through executemany(),
+    and everything is committed in a single transaction: either every row
+    is created or, if any of them is rejected by the database, none are.
+    Returns the number of items created.
+    """
+    if not rows:
+        return 0
+    with get_cursor() as cursor:
+        cursor.executemany("INSERT OR IGNORE INTO pictures VALUES (null, ?)",
+            [(pic_hash,) for pic_hash in set(row[2] for row in rows)])
+        cursor.executemany("INSERT INTO items (name, description, pic_id, cat_id, creator_id, changed) " +
+            "VALUES (?, ?, " +
+            "(SELECT pic_id FROM pictures WHERE pic_hash = ?), ?, ?, (DATETIME('now')))",
+            rows)
+    invalidate_catalog_cache()
+    return len(rows)
+
+class UpdateConflictError(Exception):
+    """ Raised when an item has been changed by someone else since it was read. """
+    pass
+
+class UpdateForbiddenError(Exception):
+    """ Raised when a user tries to update an item they don't own. """
+    pass
+
+@metrics.timed
 def delete_item(item_id):
     """ Deletes a particular item. """
     __simple_delete("items", Item, "item_id", item_id)
+    invalidate_catalog_cache()
 
-def update_item(item_id, name=None, description=None, pic_id=None, pic=None, cat_id=None):
+@metrics.timed
+def update_item(item_id, name=None, description=None, pic=None, cat_id=None,
+        expected_version=None):
     """
     Selectively updates the DB fields for a particular item.  Any fields that are left as
-    None will retain their existing values.
+    None will retain their existing values.  If pic (raw binary picture data, or a file
+    object to stream it from) is not None, the item is pointed at the stored copy of that picture.
 
-    If pic (binary picture data) is not none, a pic_id must also be provided.
-    """
+    Everything is done in a single transaction: one UPDATE statement (plus a second one
+    to point the item at its new picture, if any), and the updated Item is returned
+    (or None if there is no such item).
 
-    # It would probably be more efficient to smash everything into a single SQL statement;
-    # going to keep it simple for this project though.  Item updates should be fairly
-    # uncommon anyway.
+    If expected_version is given, the update is only applied if the item's version
+    still matches it; if someone else got there first, throws an UpdateConflictError.
+    """
+    assignments = []
+    args = []
+    if cat_id is not None:
+        assignments.append("cat_id=?")
+        args.append(cat_id)
     with get_cursor() as cursor:
-        if name is not None:
-            cursor.execute("UPDATE items SET name=? WHERE item_id=?", (name, item_id))
-
-        if description is not None:
-            cursor.execute("UPDATE items SET description=? WHERE item_id=?", (description, item_id))
+        output = __update_item(cursor, item_id, name, description, pic,
+            assignments, args, expected_version)
+    if output is not None:
+        invalidate_catalog_cache()
+    return output
 
-        if pic is not None:
-            if pic_id is None:
-                raise ValueError("Received updated picture data, but no pic_id")
-            cursor.execute("UPDATE pictures SET pic=? WHERE pic_id=?", (sqlite3.Binary(pic), pic_id))
+@metrics.timed
+def update_item_by_name(cat_name, item_name, editor_id, name=None, description=None,
+        pic=None, new_cat_name=None, expected_version=None):
+    """
+    As update_item(), but finds the item by its category's name and its own, and
+    moves it to the category called new_cat_name (if there is one).  Only the
+    item's creator may update it: throws an UpdateForbiddenError if editor_id
+    is anyone else.
 
-        if cat_id is not None:
-            cursor.execute("UPDATE items SET cat_id=? WHERE item_id=?", (cat_id, item_id))
+    The item is looked up, checked and updated in one transaction, so callers
+    don't need to look up the categories or the item beforehand.
+    """
+    with get_cursor() as cursor:
+        cursor.execute("SELECT item_id, creator_id FROM pretty_items_light " +
+            "WHERE cat_name = ? AND name = ? LIMIT 1", (cat_name, item_name))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        item_id, creator_id = row
+        if creator_id != editor_id:
+            raise UpdateForbiddenError("User {} doesn't own item {}".format(editor_id, item_id))
+        assignments = []
+        args = []
+        if new_cat_name is not None:
+            # Categories that don't exist leave the item where it is
+            assignments.append(
+                "cat_id=COALESCE((SELECT cat_id FROM categories WHERE name=?), cat_id)")
+            args.append(new_cat_name)
+        output = __update_item(cursor, item_id, name, description, pic,
+            assignments, args, expected_version)
+    if output is not None:
+        invalidate_catalog_cache()
+    return output
 
-        cursor.execute("UPDATE items SET changed=DATETIME('now') WHERE item_id=?", (item_id,))
+def __update_item(cursor, item_id, name, description, pic, assignments, args,
+        expected_version):
+    """
+    Runs an update for update_item() or update_item_by_name() on cursor, adding
+    the name and description to the given "column=?" assignments and their args.
+    Returns the updated Item, or None if there is no such item.  The caller
+    invalidates the catalog cache once the transaction has committed.
+    """
+    assignments = ["changed=DATETIME('now')", "version=version+1"] + assignments
+    args = list(args)
+    if name is not None:
+        assignments.append("name=?")
+        args.append(name)
+    if description is not None:
+        assignments.append("description=?")
+        args.append(description)
+    conditions = "item_id=?"
+    args.append(item_id)
+    if expected_version is not None:
+        conditions += " AND version=?"
+        args.append(expected_version)
+
+    cursor.execute("UPDATE items SET {} WHERE {}".format(
+        ", ".join(assignments), conditions), args)
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT version FROM items WHERE item_id = ?", (item_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        raise UpdateConflictError("Item {} is at version {}, expected {}".format(
+            item_id, row[0], expected_version))
+
+    if pic is not None:
+        # Only stored once the update is known to apply, so that conflicting edits
+        # don't leave unused pictures behind.  Pictures may be shared between items,
+        # so never overwrite one in place.  (The file is written within the
+        # transaction, but it's content-addressed, so a copy left over from a
+        # rolled back update is harmless.)
+        pic_hash = store_picture(pic)
+        cursor.execute("INSERT OR IGNORE INTO pictures VALUES (null, ?)", (pic_hash,))
+        cursor.execute("UPDATE items SET pic_id=(SELECT pic_id FROM pictures WHERE pic_hash=?) " +
+            "WHERE item_id=?", (pic_hash, item_id))
+    cursor.execute("SELECT * FROM pretty_items_light WHERE item_id = ?", (item_id,))
+    return entity_from_row(Item, cursor.fetchone())
 
 
 
 def initial_db_setup():
     """
-    Executes our database setup script (this will wipe any existing data).
-    Uses a code snippet from http://stackoverflow.com/questions/2380553/sqlite-run-multi-line-sql-script-from-file
+    Creates the database if it doesn't exist yet, and upgrades its schema to
+    the latest version if it does (see migrations.py).  Existing data is kept.
     """
-    print(" - Clearing existing data")
-    print(" - Creating tables and views")
-    qry = open("catalog.sql", "r").read()
-    with get_cursor() as cursor:
-        cursor.executescript(qry)
-    print(" - DB initial setup complete")
+    print(" - Applying schema migrations")
+    applied = migrations.migrate(__pool.db_path, __picture_store)
+    for migration in applied:
+        print("   - {}: {}".format(migration.version, migration.description))
+    invalidate_catalog_cache()
+    print(" - DB setup complete")
 
 def load_dummy_data():
     """
@@ -327,7 +827,7 @@ def load_dummy_data():
     cat1 = create_category("Food", user1)
     cat2 = create_category("Explosives", user2)
     # Just a dummy base64-encoded JPEG file
-    pic = "/9j/4AAQSkZJRgABAQEAYABgAAD/4QBmRXhpZgAATU0AKgAAAAgABgESAAMAAAABAAEAAAMBAAUAAAABAAAAVgMDAAEAAAABAAAAAFEQAAEAAAABAQAAAFERAAQAAAABAAAOw1ESAAQAAAABAAAOwwAAAAAAAYagAACxj//bAEMAAgEBAgEBAgICAgICAgIDBQMDAwMDBgQEAwUHBgcHBwYHBwgJCwkICAoIBwcKDQoKCwwMDAwHCQ4PDQwOCwwMDP/bAEMBAgICAwMDBgMDBgwIBwgMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDP/AABEIAGQAbwMBIgACEQEDEQH/xAAfAAABBQEBAQEBAQAAAAAAAAAAAQIDBAUGBwgJCgv/xAC1EAACAQMDAgQDBQUEBAAAAX0BAgMABBEFEiExQQYTUWEHInEUMoGRoQgjQrHBFVLR8CQzYnKCCQoWFxgZGiUmJygpKjQ1Njc4OTpDREVGR0hJSlNUVVZXWFlaY2RlZmdoaWpzdHV2d3h5eoOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4eLj5OXm5+jp6vHy8/T19vf4+fr/xAAfAQADAQEBAQEBAQEBAAAAAAAAAQIDBAUGBwgJCgv/xAC1EQACAQIEBAMEBwUEBAABAncAAQIDEQQFITEGEkFRB2FxEyIygQgUQpGhscEJIzNS8BVictEKFiQ04SXxFxgZGiYnKCkqNTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqCg4SFhoeIiYqSk5SVlpeYmZqio6Slpqeoqaqys7S1tre4ubrCw8TFxsfIycrS09TV1tfY2dri4+Tl5ufo6ery8/T19vf4+fr/2gAMAwEAAhEDEQA/APy3/Yw/Zd8OftH/AAu1bXtX0/8AtDVbTV5YEV7iZE8kRQsoZY3U7QXY5GOe56V6Yn7Jvwd0e++z614Nm06RTgMdRvXifnswlz09QB7966f/AII9/sq6z8c/2Vta1jw/rltZ6rYeKrmAWUjKGkVLSzfzF53jl8ZX057V7j8TPhF48+HulSf8Jl4R/wCEg0/OwzxIYp8DncC2dzd/vbjnnJGK461Ore6vY9eh7CVNLS/meZeCv2EP2efE7LGvh3TbiZl3CNNfvC5HrgXFdxZf8Et/gPcSBT4FB9R/bOocdv8AnvVDSdC8A/EbSpPstm0DJGPPms7Zla2w20/aLfkcHlnXJAIB29BHe3fij9mW6tdWsdUn8ReGY0y9o9y00JhA48ksx2nB424xgZyDx4uIhiVdwmz06dOkrc0V9x1Vv/wSf+ATS4bwD9f+J1qP/wAkV0Gj/wDBIb9ni8ZFf4f53H/oOal/8kV6noniaO+hV4pBIrAMjAjBB6Y/StHx18atE+Avw9vPFPiG48mzs8CKFSPOvZjnZDGO7sQR6ABicKrEeHVxmLt7s5X9T0KeGw7fwrz0OZ8J/wDBET9m25gkuL34c74wMKP7f1NQPU5FyKr6d/wSi/Yx1vXP7NsvC/h681HOz7Jb+M9QlmDehUXhIPavkv4+ftyeMPjSJJvF2sNofh6Ms1l4X007BJyu3zQOWb5VIaUkht5UIpK0fst/tBabrmka5b2unx6Tr1qBc2sqTbpnjBUqyv8AKRskVTgDOZAeduVUcHmU480q8k+13+JpKtg6b5FRT87H0X4r/wCCPv7OunXkywfDvy9rfKP7d1NsDt1uK8a+OH7BH7PPwdt7Zpfh/cXN1fCT7Naw6zqH73ZgsWYznaoLKDwTzwDg4+w/hl8cLP49eBk1BZIo9YslWDVbVQcwTEH94FJPySAFl5OMMuSVavnT9sHxFp+s/Fqytb6GS5sfC+lSTzpDMVeWa7cIkORyCPKVifSX2GYwOMxkqqpTm79dTsr5fhlS9tyLl0a03ufLfh/9iPwP8RvFDfY/CdrpOm7wkhiv7uRIscEKXmJdyewOOnQZI2PF37KnwN8LxLpemeDbrxRr6oOI9TvCin1dklAC/wC6Dkeh5Hr3xd8O6p8OfhctwotbXUNQt8JYwLgabblcbQRzvb+JjzjIz1ztfs5ab4g8T+At2gaP4RF5GgjmBZGulIzhmjZcK/q2QT1Oc5r6vDyqRfs7tvz1PCxFKlNc/Kkl8jwD4a/8EuNL+Icr3t3o9roemx5d2F3OyxjP3dzSYH1yfx6Vq/ED9iv4F/CzSdo0KfxFerIEJg1G8OTzn7jgHHc8DgDBzmvfPjF8JvEXgPwxN4h8fa4tjDFtW3gLKBcOR8qRq2xSRznYrcZ5rynw38P/ABx401WHVPC8MkxlVhG80cnlInJ5ZcqScjrjnoB0r1aacNNbngVpc75klyo84/4JFfEfVfB/w41Cztrj7Lb3WtzSQPFd+RP54htgcZ44XBGeCRj6fXfiH9r74leCrW4t59J/tbTbhNjrdpFeW8secZcLlT2B7/yr4T/4J6fs1698WvglfeINHlvAuk67NC0dqgaQkQWz5AzuP3h2xgV9HfC/9obWP2fPFq6fJYtrVwszbJtRBdbZj95doO5MHvxyTweaJN/DK4U9EnCzdtin4cOqfDz46Wviq30i48K6Pfn7WD9mmjsnYEB44jJyVILZXOACABjAHsPxK0jS/GBg1Dw3d7fCviaOa3v7Agf8S67I3gpkZCyMAcYwPmIxyF86+OqeKvjEY9b8d6k8i3RWK30m0Q7bKFiOFTorDqT8zfKMk4xTfgHPGmuapoH2meOKRJLe3EwKOZoWOzhudxwBnr859a4a0eR6dT2sLLnTi90bPgb4ux/Df4WrJqEk3maC4011UcnYP3ffoI9uSQMsDwTgH54+Jv7QHir9qj4j6dp1v5yBX8qwhjXf9nBIz5YOMMRjMhwx9UXCr2v7XlyuheFryaH/AEf/AISJYmVEU7BNCzrJj22ufyHtXjnwK8b6h4Q8f2+qWtwbXUEl+W6Mas0Ix8z4PHyDkKeCxHpXh42k6VOdSmk2lp6n0GS0YYnEQhWfuNq/yOy8cfsn6t4E186XqFt5eofaorR5JLyPZC7sB+8clRyCG3ZVcDsCDWBefCHWvBfhy38Vac62t/psssdxAFZZUCNsMrIwBKPnay84/iwGwP1a/wCCcv7J/wDw3T4k8M+MPF0LWvhXwjcW93a6dDGVjvJIn8yN7mR8tdSSSDfIXHI+cks5J88/4KQf8E6tL/ZQvr7xto+mtpPh/WLmR59JSeW4t7O0wyJ5kszEPcOT5mxW+U5A3KNzfN4bMMwWGjWrfFfXz8vmfeVsPkOIx8svpKy5bX7Pe/orfceA/sfftB2fg7xbo+rXgjtdB8XWT2GoO7BVs5o3DRSSNj7qSNNHuOwBWMhwAa0/CscfxQ+INxrd4x/4nmpvqiFjt/0aJNsGeOGWNcHIGCM+tfLnwu8RRprMOlwlVsLy5XUIoCdyJ5itHJHkjJPEYHQAB2OByPpTSPiBD8LfC139qWK6voLfyLGTZtb7OxKsWA6su5BuJyfM7lWLfV4TC01WeI2uldH5vj61SlTeETuk3ZnO/FPUtd8R+LmvtOW11B9JKXM9qxXLoc4AUnlQABtByQeK9DH7bWi3NvHqDeE7HwTq0Nuc3llcC3muSo42bQp45ADE9cccmvn6L4mx6Kup6hJp9nqQ1aV44DMCZLMooK9hyQwyQR90fSsG50fUiLO516FrjS7hTAuoIBIqb+d24d+pAOOjY716FOpaXNE82pT5oKmzsWh8Rftr+Lr/AFLWLzxDrEmmSYjMqtMYrYtkID0PHUDB5z1Nem+B4Na+EsUlr4X1y/06E8PbSKJoxj/YkGRj2INcT8N/G2tfsl+M2kkWC4s7xleK+tv3ltdqBkYcdOCDg4I9ua+pvBv7Qfgj49+HVutc0a3lurchXlFvude/3l9f5V20ZxlHV+8eTWw807RV4nwr/wAEpNavV/Z61zTV1a807TbjXppJltmEbO32a3By/XGABjp1/H6KufB/h/xpZLa6RDFY6bpLieW/VdzNOudgB53kHO71zjg4r45/4J4abDqHwl1Jbu6mgtf7WkLIrlVkzDDnIHXgV9leA/F2k6ZFZTX0f2LTtPIey01R8xYHieX3PVV7YDEZ24xlUftWnsepTw8FhYy+01sjj/Eur+NPhD4/s/7ft7K+t5oIpmktVaX7HA0oQuV9eqjqck9cjOJqEN14L+J39oRpeahbWcKajqJDDzLUvLIcfKf4VMee+GLEgHI9L8b/ABOVNO1LUr+1mZvEl1Bax2+3c8FpbgydB/ETlmGcDzfYmvC/jN8eFj8X6pqukWslrb7YIpIUALhFON74OAWfIJHA3qM52kzOpGSsmZU6MqcrtWOw/a5+KGi/Evwnoa6c1rNNdX7X/kQAsVnA2FecFd+7OCAQUHUV84fD60WW5mga4jhUCKOSZv8AlkGliy474GDzxxjpmvUf2fv2V/it+3B4ojk8F6G1n4fjlbz9avIRa6ZauMM5MmPmcfJ8qFmGVJxktXL/ABG+HEnwj+LvijwrqdxaX01rdS2L3tuP3dwCcxyx5HAfKHB5AY9K8nFN6r0PrcllTmvZw0lrr5Pr8j9p/wDgnf8ACj46fsi3fgnS9S1rQfEvw31oJp81hEtvG1tJOQLe8tLhB5siBERZI58Fdx2bvvL82/8ABVT4G+OtN/ZZuPif8RvH15rWtayxtzZR3E1xZoss0bRQwRLBHBZxwqiKVZnaVt8vmMwEdeDfCD/gqV8RD+zNa+BNJF5eeIPDGq2Wo6bfW90DNpvkSgnELQS/aYXB4GAV+XrtUNzn7Zn7dHij4r/speDfAHiiKa1uNPmmuzBLOJJ9QdpHJup1ZFaEDdIqIoQASAAbUIrllRm3bp2OHDVpUq/tJWTvbbXY+UtO0a+1zUrex0tvLuLiRWj+Yx7NpkAOc9MM5Psew4r7g+K3/BOT48fD34ZW8njLwnDqVrpbZuL3R9Qjuyke08sgwThtpPXOBgE9fk/4HeENS8RS6xf6bp91fXWmWWZFgj+W2tzjzpZeyosSnliAGk7nBH6saj/wVd0G88Df2L4RuNdm1C8sFS81jVEQw2zlctHDES2SuduWH8GejYHVVnKmk0c+O9+u7H5xaD8O7zUvHdv4d89rPTfEUbfvTHkhlBbGT/EroQR1OB6mu3+F9jrHwmv5vDPijTTNo90xSO7UedAGbJGcA/I/+1gg+xOM/wCOfx+0f4S+I7RNR0281q1upvtVpcW0vlujD7wOf+AsAMdWrrPB/wC094Z/aB8OGHT2ZbqH5J7eX/WRt8zDDcHOFLHHB5AJKvjpp1G486MP3cn7Ke502seErHRvCV1YrZrcaasbEQFd/kDGfl65GPx4HrXzjpfjuHwpqwXStWj0PxE08rSTylI7eSMog8p2ckFVKMVDKVBPB3Zr1r4tfFifwd4BvLfzYzcXMBtLdicbA2FbJHO0K3Bx8pZegJx8e6tJ/b2s3N08kjRs5EZcYYr2J9zmoqXrSjdtWd9D18AnhYVJcqlzK2vbe/k1ZalL9jzxpLoXgX7PCzKv9qStJtG35WhjH3sYJ44XOSQMDOK+qfhfGviC/jvLy/U28bfKA+5pH9Dzxj0PP8x8R/AWyFz4IuGVtsi3b9+nyJj+vXOa9O8OfEHUNCiEZkbYxwrCQxnjA2FgOmFACtlRztAJ52xC5arkvmYYKn7XCU+j5bXtvrs+x9e3HiWz1a4vDG/nLYwyKWX7uOC3PucD0+Qe9fN1pb6fqnj3VtN87fILWSUyOWaOVgimVJNoJ2bUmAKgFWYEttHGn4c+Ks2leF7iSeTzIrxHglTYqygsDz6Nyc8Vwslws0tusPmaf4l09jKhKskjLkn5unpnHoe2OcPaJ/AXPLqzjy1bXSuv71+z7+R+w/wj/bs+Hfw//ZU0HwHpfhPVD4f0Oyj05201BFMrlFLyhJmjkHms3m/vAHPmAkAkgflP+0lrFrqX7RPi6W3N02m313KYDcR7JRHz5auASAQu0HBPt2ra8G/tB3F3PNqEP2eHxG8MS6hHdBo11FELqx3q/l72R42LNGGLQb/M3SSrNzPxOX/hOdYvprXS54brS53W8cSLcRJhY8bWUlTjLA4JzjPY1Cw/vN9zkweIVKduv9aGL4U0e81Xxbbf2fePb6lcHybe4gkMbPN/CoKjO6T7oGcbyckDkGseGdQnstS1rVr64ee1uI7TfeF2muJ84eMBjn92m0t94ofLBA3rjDtkkgjljbzIZIDnywfugZIbPcjLYP07Gna74uvvEtpFHeTSutqq28UcpLLAi72EUYPAUMWO1cAZPAya6I9i8VeNWNRW1Z1/gOy1vW/Al5p9rc6kNFvbxJZ7OGQrFPNkrF5nOGOd4UHp8xwTwbnhnx/Iup6bokFw0FmhEjEHZJJjG3dg9MkkgEdO4r7A/YM/Z10/4xfCaSbWtQk0vQtN0+5jsPsVubiSO5ZWdZSqBS0zXEVu+9sq0EbKCfsu1PkT45fBz/hDfi9Yq2oW6wyW8l/cCwlS7ktFVyGidFcbZhgZhfayGRVYKaFT5tGzjxFdyu4rTT5+Z0n7THgO48V+AYrzRbe41C6aSLybVENxKzFsbUXBLFt2MAZJA9Rjk/gz8P8AVfgfqmm3WvxnQdQk1Atc2U25XkjMflxMw2kKsbPMG5GDKo5KsqeifsEfs1/HD/gqP8bNR+HPwavvD3hePwDPFrF94p1K+uba5tozIvkkqhbcyyJuCpFndks4ULt9w+M3/BED9lT9iz4h6X4H/aM/bkvdO8aX4jkl0fRfDU8i2BkzsM0itcLApGMNMsfBBwFOa6qGCmoWb0Z41bHRVXninofL/wC0R49HiLVfs8TfKoYR5PCoAd7DPTgkA9wVzgjA8gnvWeGNV/iUMxA9ecfhmv03/bh/4NMPHvwN+EF94+/Z++K9x8ULKxsG1BvDupWqxX19ahd+6zmjdorhypyE2xFhnazMwQ/lf4I8Rw+LdFS6ZTHIpKOo/gfvj6jn8acMG6Tu3c96nnFPEw9lTXLZdepkfs+2sg8LyTRyKv8ApjK6EffGxO/+fwyTXfyhYp1XK7ZSSQec9uv9fpXB/ABingyZs4X7Y3X/AHI67LX9DlvbW1WSJtszEISCpBwMHPTvxz2JIxgnKvTbrNnXl9aNLARtv0XfU277wzfeFrC3ul+zzWscg86PDbrc+mOpU46euRjJzWb4j1JrjxfDqy7meafzAVPqSNv07fnVvwf8Qb7TPLsNQl3bE8uOZxnzV6BWJ/ixjBPUd85ze1nS54LaS+sYo90Z3S2xG6N+2V9OnI79q86M3Gdqi16M9ipClWo8+Gbsmm09Wmuph+Kbi88O+M/tFpOYdysI2Bx8pzuX0IIJBHcEivSv2UPjzJ8PfGWsS3UiQ314VkDCAne3TKlHRk2sytgEqUMgKMSu3yTXtfk8RSQ7Ymimj6jrk561kagupWN4l/atJHLCRh0w20/Q8c85BBBB+orvpxap2Z8rjKlP6w6kNYt/gff37aHwZ+CvjDwJqHibwXrE2g69MftFja3QRIIoUhnkktpo4Y9wmkmFvDEgQRqZPMM3lgMPhW41e4vsRTt5dvb3jyRiQ4wCgUjjrnaB/k1LY/GbVdR0yaKOxtZLiPGWA2sVIx91s5wB9Rk49ayGlvNVvXF5MPNum3OFQblwBwuMDkcDHHJ4GMApxfUzr4iLadN3S28j37wT+034k8NfDu10SxvoVt9Nla7trqK3HmRHIIDSdGB2kHPGG54AFeeeKfiDp/iPxGrXD/6NHLLO0drF5ZHmbB5SsW/1YEaYbGQS3qGrzW8ggVWaO4naN3Y+SX+VxzzgfhwfQ10eguulaNJLc/YVjmG5pLlgg44GM88Y7VNSm2rs2wtaM5KEYrTXU9o/4Jt/8FX/ABr/AMEmfj18RPGXgfwH4c8RW/ja0isHi1a4lWO0ijk8xWVo3Xkk87q8H+NXxqvv2wfjR8SviV4zkTVPHHxG1eW6tNPtM3UvnTyERxRhckRxqUjRepCKBnABz/H3jvQT4R1C1ivLe5vLiPYmwFlBz0ULx68knp+Ffrd/wRN/bJ/4Jm/s9fD74WTeMPDun+H/AI6WFpE2q+JvEGj3t/aW+pgk+dHLI0sNvj5cSIkYQ8gr1r1KDlOCjtY8bGqnQxDmrTbv8r/5H67fsleNrP8A4J2/8EgfhXqfxq1ZPDP/AArv4e6THrz6gxMljLHaRL9lIG4tIjYiAXJJXiv5K9F1P/hPvE3ivxNa2jWVn4j1u6vre2/54JJIzhR9N23j+7X7/f8ABxj/AMEq/wBoz/go78Pv+E2+F3xYtvGHw70Wwj1fTfhpbWxs1vsRKxuYLiN2S+nYbnjEwTarFYyWbD/zYW/xP1zQ4WtbeZLGOI7TEsCjYRxj5gT27mtppvY4sFUp05OdS/yPSf2YvE8XhrwncynSrO+uPtUgjlnLnysxxgYUMBnqQSDg4616J46+K3iL4lbV1S+3QJI0scEFusMcZLyOMBccKZGCjPyjgDGAPJfgdIIvBU7MwVVu2yx4A+RK3NV+J+i6FBta+immx92E+Zj8uP1rjq0253SPpcDGisPGVWVrHTGzj1aBo51XzOcsPlwe5/Hr9TSHxVqHhW1a1kjaaOQbY5s4YD+v415tf/H63tG/0GymlbuZ2Cgn6DP865vVfjVrmoxNEk0NtCxzsjjHH4tk/rWKwU5O0ti62dUKavRk1Pa66rzPXF1aG+jkkIZGjBLZwM8e3T+dYr+MtJ0a1mnvNStZZLgYaGN95UDnG1cgHP0zwTzmvF7vVbi/fdNcTTFuu5y1Vjya6o4Tuzw5Zq+bm5U2ek618UdDjy9jb3n2rGN2QsePY5JH5Viv8YdQQjyY7eNl5V2G91PTjtyPauP2n0oraNGCOCpipzd9vQ1LnxVfXRbddSKCOiHYP0qg88krEtIzH3NRUVoopbGDnJ63PsL/AIJT/wDBFn4pf8Ffx48/4Vnr/gDQ/wDhXf8AZ/8AaX/CTX13a+d9t+1eV5P2e1n3Y+ySbt23GVxnJx8z/GX4Ta58BPi74o8D+JrX7D4g8H6rc6NqVvyRFcwStFIBkDI3IcHHI5719bf8EXf+C3Xij/gjX4g8cSaJ4I8P+ONJ+IX9nf2pbX13NZ3MX2L7V5fkTJuVci7k3bo3zhcYwc/Xn7Qn/BcD9gD9tT4sn4jfFr9jfxVqnjzbGZbyy10RJqLRgKn2kQz26T4RVXdLG52oq8qMVRPU/Y7/AIN5bzXL/wD4IwfAOTxB9p/tBtDmWNpw29rUXtyLU/MSdpt/JKnoVwRgEAfyZ/8ABQLxDoPi79vH41ap4VNq3hnUvHet3WktbMDA1o9/O0Jj2gDYUKkYAGCMV+jH/BQj/g7H8cftBfAy4+FXwO8A2HwQ8EzaeNGe7hvBcaotgI/KW3thGkcVnH5fyYQOwXGx0xX5FN97jpQBMJ3W2Cbm2ZJ254zx/n8KYOV+oyfzoooHzN7jm/h755qPO5qKKkuewOMGgnCr9KKKozHP8qL79fzP+FNkGG/AGiigBtFFFABRRRQAUUUUAf/Z"
+    pic = base64.b64decode("/9j/4AAQSkZJRgABAQEAYABgAAD/4QBmRXhpZgAATU0AKgAAAAgABgESAAMAAAABAAEAAAMBAAUAAAABAAAAVgMDAAEAAAABAAAAAFEQAAEAAAABAQAAAFERAAQAAAABAAAOw1ESAAQAAAABAAAOwwAAAAAAAYagAACxj//bAEMAAgEBAgEBAgICAgICAgIDBQMDAwMDBgQEAwUHBgcHBwYHBwgJCwkICAoIBwcKDQoKCwwMDAwHCQ4PDQwOCwwMDP/bAEMBAgICAwMDBgMDBgwIBwgMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDP/AABEIAGQAbwMBIgACEQEDEQH/xAAfAAABBQEBAQEBAQAAAAAAAAAAAQIDBAUGBwgJCgv/xAC1EAACAQMDAgQDBQUEBAAAAX0BAgMABBEFEiExQQYTUWEHInEUMoGRoQgjQrHBFVLR8CQzYnKCCQoWFxgZGiUmJygpKjQ1Njc4OTpDREVGR0hJSlNUVVZXWFlaY2RlZmdoaWpzdHV2d3h5eoOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4eLj5OXm5+jp6vHy8/T19vf4+fr/xAAfAQADAQEBAQEBAQEBAAAAAAAAAQIDBAUGBwgJCgv/xAC1EQACAQIEBAMEBwUEBAABAncAAQIDEQQFITEGEkFRB2FxEyIygQgUQpGhscEJIzNS8BVictEKFiQ04SXxFxgZGiYnKCkqNTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqCg4SFhoeIiYqSk5SVlpeYmZqio6Slpqeoqaqys7S1tre4ubrCw8TFxsfIycrS09TV1tfY2dri4+Tl5ufo6ery8/T19vf4+fr/2gAMAwEAAhEDEQA/APy3/Yw/Zd8OftH/AAu1bXtX0/8AtDVbTV5YEV7iZE8kRQsoZY3U7QXY5GOe56V6Yn7Jvwd0e++z614Nm06RTgMdRvXifnswlz09QB7966f/AII9/sq6z8c/2Vta1jw/rltZ6rYeKrmAWUjKGkVLSzfzF53jl8ZX057V7j8TPhF48+HulSf8Jl4R/wCEg0/OwzxIYp8DncC2dzd/vbjnnJGK461Ore6vY9eh7CVNLS/meZeCv2EP2efE7LGvh3TbiZl3CNNfvC5HrgXFdxZf8Et/gPcSBT4FB9R/bOocdv8AnvVDSdC8A/EbSpPstm0DJGPPms7Zla2w20/aLfkcHlnXJAIB29BHe3fij9mW6tdWsdUn8ReGY0y9o9y00JhA48ksx2nB424xgZyDx4uIhiVdwmz06dOkrc0V9x1Vv/wSf+ATS4bwD9f+J1qP/wAkV0Gj/wDBIb9ni8ZFf4f53H/oOal/8kV6noniaO+hV4pBIrAMjAjBB6Y/StHx18atE+Avw9vPFPiG48mzs8CKFSPOvZjnZDGO7sQR6ABicKrEeHVxmLt7s5X9T0KeGw7fwrz0OZ8J/wDBET9m25gkuL34c74wMKP7f1NQPU5FyKr6d/wSi/Yx1vXP7NsvC/h681HOz7Jb+M9QlmDehUXhIPavkv4+ftyeMPjSJJvF2sNofh6Ms1l4X007BJyu3zQOWb5VIaUkht5UIpK0fst/tBabrmka5b2unx6Tr1qBc2sqTbpnjBUqyv8AKRskVTgDOZAeduVUcHmU480q8k+13+JpKtg6b5FRT87H0X4r/wCCPv7OunXkywfDvy9rfKP7d1NsDt1uK8a+OH7BH7PPwdt7Zpfh/cXN1fCT7Naw6zqH73ZgsWYznaoLKDwTzwDg4+w/hl8cLP49eBk1BZIo9YslWDVbVQcwTEH94FJPySAFl5OMMuSVavnT9sHxFp+s/Fqytb6GS5sfC+lSTzpDMVeWa7cIkORyCPKVifSX2GYwOMxkqqpTm79dTsr5fhlS9tyLl0a03ufLfh/9iPwP8RvFDfY/CdrpOm7wkhiv7uRIscEKXmJdyewOOnQZI2PF37KnwN8LxLpemeDbrxRr6oOI9TvCin1dklAC/wC6Dkeh5Hr3xd8O6p8OfhctwotbXUNQt8JYwLgabblcbQRzvb+JjzjIz1ztfs5ab4g8T+At2gaP4RF5GgjmBZGulIzhmjZcK/q2QT1Oc5r6vDyqRfs7tvz1PCxFKlNc/Kkl8jwD4a/8EuNL+Icr3t3o9roemx5d2F3OyxjP3dzSYH1yfx6Vq/ED9iv4F/CzSdo0KfxFerIEJg1G8OTzn7jgHHc8DgDBzmvfPjF8JvEXgPwxN4h8fa4tjDFtW3gLKBcOR8qRq2xSRznYrcZ5rynw38P/ABx401WHVPC8MkxlVhG80cnlInJ5ZcqScjrjnoB0r1aacNNbngVpc75klyo84/4JFfEfVfB/w41Cztrj7Lb3WtzSQPFd+RP54htgcZ44XBGeCRj6fXfiH9r74leCrW4t59J/tbTbhNjrdpFeW8secZcLlT2B7/yr4T/4J6fs1698WvglfeINHlvAuk67NC0dqgaQkQWz5AzuP3h2xgV9HfC/9obWP2fPFq6fJYtrVwszbJtRBdbZj95doO5MHvxyTweaJN/DK4U9EnCzdtin4cOqfDz46Wviq30i48K6Pfn7WD9mmjsnYEB44jJyVILZXOACABjAHsPxK0jS/GBg1Dw3d7fCviaOa3v7Agf8S67I3gpkZCyMAcYwPmIxyF86+OqeKvjEY9b8d6k8i3RWK30m0Q7bKFiOFTorDqT8zfKMk4xTfgHPGmuapoH2meOKRJLe3EwKOZoWOzhudxwBnr859a4a0eR6dT2sLLnTi90bPgb4ux/Df4WrJqEk3maC4011UcnYP3ffoI9uSQMsDwTgH54+Jv7QHir9qj4j6dp1v5yBX8qwhjXf9nBIz5YOMMRjMhwx9UXCr2v7XlyuheFryaH/AEf/AISJYmVEU7BNCzrJj22ufyHtXjnwK8b6h4Q8f2+qWtwbXUEl+W6Mas0Ix8z4PHyDkKeCxHpXh42k6VOdSmk2lp6n0GS0YYnEQhWfuNq/yOy8cfsn6t4E186XqFt5eofaorR5JLyPZC7sB+8clRyCG3ZVcDsCDWBefCHWvBfhy38Vac62t/psssdxAFZZUCNsMrIwBKPnay84/iwGwP1a/wCCcv7J/wDw3T4k8M+MPF0LWvhXwjcW93a6dDGVjvJIn8yN7mR8tdSSSDfIXHI+cks5J88/4KQf8E6tL/ZQvr7xto+mtpPh/WLmR59JSeW4t7O0wyJ5kszEPcOT5mxW+U5A3KNzfN4bMMwWGjWrfFfXz8vmfeVsPkOIx8svpKy5bX7Pe/orfceA/sfftB2fg7xbo+rXgjtdB8XWT2GoO7BVs5o3DRSSNj7qSNNHuOwBWMhwAa0/CscfxQ+INxrd4x/4nmpvqiFjt/0aJNsGeOGWNcHIGCM+tfLnwu8RRprMOlwlVsLy5XUIoCdyJ5itHJHkjJPEYHQAB2OByPpTSPiBD8LfC139qWK6voLfyLGTZtb7OxKsWA6su5BuJyfM7lWLfV4TC01WeI2uldH5vj61SlTeETuk3ZnO/FPUtd8R+LmvtOW11B9JKXM9qxXLoc4AUnlQABtByQeK9DH7bWi3NvHqDeE7HwTq0Nuc3llcC3muSo42bQp45ADE9cccmvn6L4mx6Kup6hJp9nqQ1aV44DMCZLMooK9hyQwyQR90fSsG50fUiLO516FrjS7hTAuoIBIqb+d24d+pAOOjY716FOpaXNE82pT5oKmzsWh8Rftr+Lr/AFLWLzxDrEmmSYjMqtMYrYtkID0PHUDB5z1Nem+B4Na+EsUlr4X1y/06E8PbSKJoxj/YkGRj2INcT8N/G2tfsl+M2kkWC4s7xleK+tv3ltdqBkYcdOCDg4I9ua+pvBv7Qfgj49+HVutc0a3lurchXlFvude/3l9f5V20ZxlHV+8eTWw807RV4nwr/wAEpNavV/Z61zTV1a807TbjXppJltmEbO32a3By/XGABjp1/H6KufB/h/xpZLa6RDFY6bpLieW/VdzNOudgB53kHO71zjg4r45/4J4abDqHwl1Jbu6mgtf7WkLIrlVkzDDnIHXgV9leA/F2k6ZFZTX0f2LTtPIey01R8xYHieX3PVV7YDEZ24xlUftWnsepTw8FhYy+01sjj/Eur+NPhD4/s/7ft7K+t5oIpmktVaX7HA0oQuV9eqjqck9cjOJqEN14L+J39oRpeahbWcKajqJDDzLUvLIcfKf4VMee+GLEgHI9L8b/ABOVNO1LUr+1mZvEl1Bax2+3c8FpbgydB/ETlmGcDzfYmvC/jN8eFj8X6pqukWslrb7YIpIUALhFON74OAWfIJHA3qM52kzOpGSsmZU6MqcrtWOw/a5+KGi/Evwnoa6c1rNNdX7X/kQAsVnA2FecFd+7OCAQUHUV84fD60WW5mga4jhUCKOSZv8AlkGliy474GDzxxjpmvUf2fv2V/it+3B4ojk8F6G1n4fjlbz9avIRa6ZauMM5MmPmcfJ8qFmGVJxktXL/ABG+HEnwj+LvijwrqdxaX01rdS2L3tuP3dwCcxyx5HAfKHB5AY9K8nFN6r0PrcllTmvZw0lrr5Pr8j9p/wDgnf8ACj46fsi3fgnS9S1rQfEvw31oJp81hEtvG1tJOQLe8tLhB5siBERZI58Fdx2bvvL82/8ABVT4G+OtN/ZZuPif8RvH15rWtayxtzZR3E1xZoss0bRQwRLBHBZxwqiKVZnaVt8vmMwEdeDfCD/gqV8RD+zNa+BNJF5eeIPDGq2Wo6bfW90DNpvkSgnELQS/aYXB4GAV+XrtUNzn7Zn7dHij4r/speDfAHiiKa1uNPmmuzBLOJJ9QdpHJup1ZFaEDdIqIoQASAAbUIrllRm3bp2OHDVpUq/tJWTvbbXY+UtO0a+1zUrex0tvLuLiRWj+Yx7NpkAOc9MM5Psew4r7g+K3/BOT48fD34ZW8njLwnDqVrpbZuL3R9Qjuyke08sgwThtpPXOBgE9fk/4HeENS8RS6xf6bp91fXWmWWZFgj+W2tzjzpZeyosSnliAGk7nBH6saj/wVd0G88Df2L4RuNdm1C8sFS81jVEQw2zlctHDES2SuduWH8GejYHVVnKmk0c+O9+u7H5xaD8O7zUvHdv4d89rPTfEUbfvTHkhlBbGT/EroQR1OB6mu3+F9jrHwmv5vDPijTTNo90xSO7UedAGbJGcA/I/+1gg+xOM/wCOfx+0f4S+I7RNR0281q1upvtVpcW0vlujD7wOf+AsAMdWrrPB/wC094Z/aB8OGHT2ZbqH5J7eX/WRt8zDDcHOFLHHB5AJKvjpp1G486MP3cn7Ke502seErHRvCV1YrZrcaasbEQFd/kDGfl65GPx4HrXzjpfjuHwpqwXStWj0PxE08rSTylI7eSMog8p2ckFVKMVDKVBPB3Zr1r4tfFifwd4BvLfzYzcXMBtLdicbA2FbJHO0K3Bx8pZegJx8e6tJ/b2s3N08kjRs5EZcYYr2J9zmoqXrSjdtWd9D18AnhYVJcqlzK2vbe/k1ZalL9jzxpLoXgX7PCzKv9qStJtG35WhjH3sYJ44XOSQMDOK+qfhfGviC/jvLy/U28bfKA+5pH9Dzxj0PP8x8R/AWyFz4IuGVtsi3b9+nyJj+vXOa9O8OfEHUNCiEZkbYxwrCQxnjA2FgOmFACtlRztAJ52xC5arkvmYYKn7XCU+j5bXtvrs+x9e3HiWz1a4vDG/nLYwyKWX7uOC3PucD0+Qe9fN1pb6fqnj3VtN87fILWSUyOWaOVgimVJNoJ2bUmAKgFWYEttHGn4c+Ks2leF7iSeTzIrxHglTYqygsDz6Nyc8Vwslws0tusPmaf4l09jKhKskjLkn5unpnHoe2OcPaJ/AXPLqzjy1bXSuv71+z7+R+w/wj/bs+Hfw//ZU0HwHpfhPVD4f0Oyj05201BFMrlFLyhJmjkHms3m/vAHPmAkAkgflP+0lrFrqX7RPi6W3N02m313KYDcR7JRHz5auASAQu0HBPt2ra8G/tB3F3PNqEP2eHxG8MS6hHdBo11FELqx3q/l72R42LNGGLQb/M3SSrNzPxOX/hOdYvprXS54brS53W8cSLcRJhY8bWUlTjLA4JzjPY1Cw/vN9zkweIVKduv9aGL4U0e81Xxbbf2fePb6lcHybe4gkMbPN/CoKjO6T7oGcbyckDkGseGdQnstS1rVr64ee1uI7TfeF2muJ84eMBjn92m0t94ofLBA3rjDtkkgjljbzIZIDnywfugZIbPcjLYP07Gna74uvvEtpFHeTSutqq28UcpLLAi72EUYPAUMWO1cAZPAya6I9i8VeNWNRW1Z1/gOy1vW/Al5p9rc6kNFvbxJZ7OGQrFPNkrF5nOGOd4UHp8xwTwbnhnx/Iup6bokFw0FmhEjEHZJJjG3dg9MkkgEdO4r7A/YM/Z10/4xfCaSbWtQk0vQtN0+5jsPsVubiSO5ZWdZSqBS0zXEVu+9sq0EbKCfsu1PkT45fBz/hDfi9Yq2oW6wyW8l/cCwlS7ktFVyGidFcbZhgZhfayGRVYKaFT5tGzjxFdyu4rTT5+Z0n7THgO48V+AYrzRbe41C6aSLybVENxKzFsbUXBLFt2MAZJA9Rjk/gz8P8AVfgfqmm3WvxnQdQk1Atc2U25XkjMflxMw2kKsbPMG5GDKo5KsqeifsEfs1/HD/gqP8bNR+HPwavvD3hePwDPFrF94p1K+uba5tozIvkkqhbcyyJuCpFndks4ULt9w+M3/BED9lT9iz4h6X4H/aM/bkvdO8aX4jkl0fRfDU8i2BkzsM0itcLApGMNMsfBBwFOa6qGCmoWb0Z41bHRVXninofL/wC0R49HiLVfs8TfKoYR5PCoAd7DPTgkA9wVzgjA8gnvWeGNV/iUMxA9ecfhmv03/bh/4NMPHvwN+EF94+/Z++K9x8ULKxsG1BvDupWqxX19ahd+6zmjdorhypyE2xFhnazMwQ/lf4I8Rw+LdFS6ZTHIpKOo/gfvj6jn8acMG6Tu3c96nnFPEw9lTXLZdepkfs+2sg8LyTRyKv8ApjK6EffGxO/+fwyTXfyhYp1XK7ZSSQec9uv9fpXB/ABingyZs4X7Y3X/AHI67LX9DlvbW1WSJtszEISCpBwMHPTvxz2JIxgnKvTbrNnXl9aNLARtv0XfU277wzfeFrC3ul+zzWscg86PDbrc+mOpU46euRjJzWb4j1JrjxfDqy7meafzAVPqSNv07fnVvwf8Qb7TPLsNQl3bE8uOZxnzV6BWJ/ixjBPUd85ze1nS54LaS+sYo90Z3S2xG6N+2V9OnI79q86M3Gdqi16M9ipClWo8+Gbsmm09Wmuph+Kbi88O+M/tFpOYdysI2Bx8pzuX0IIJBHcEivSv2UPjzJ8PfGWsS3UiQ314VkDCAne3TKlHRk2sytgEqUMgKMSu3yTXtfk8RSQ7Ymimj6jrk561kagupWN4l/atJHLCRh0w20/Q8c85BBBB+orvpxap2Z8rjKlP6w6kNYt/gff37aHwZ+CvjDwJqHibwXrE2g69MftFja3QRIIoUhnkktpo4Y9wmkmFvDEgQRqZPMM3lgMPhW41e4vsRTt5dvb3jyRiQ4wCgUjjrnaB/k1LY/GbVdR0yaKOxtZLiPGWA2sVIx91s5wB9Rk49ayGlvNVvXF5MPNum3OFQblwBwuMDkcDHHJ4GMApxfUzr4iLadN3S28j37wT+034k8NfDu10SxvoVt9Nla7trqK3HmRHIIDSdGB2kHPGG54AFeeeKfiDp/iPxGrXD/6NHLLO0drF5ZHmbB5SsW/1YEaYbGQS3qGrzW8ggVWaO4naN3Y+SX+VxzzgfhwfQ10eguulaNJLc/YVjmG5pLlgg44GM88Y7VNSm2rs2wtaM5KEYrTXU9o/4Jt/8FX/ABr/AMEmfj18RPGXgfwH4c8RW/ja0isHi1a4lWO0ijk8xWVo3Xkk87q8H+NXxqvv2wfjR8SviV4zkTVPHHxG1eW6tNPtM3UvnTyERxRhckRxqUjRepCKBnABz/H3jvQT4R1C1ivLe5vLiPYmwFlBz0ULx68knp+Ffrd/wRN/bJ/4Jm/s9fD74WTeMPDun+H/AI6WFpE2q+JvEGj3t/aW+pgk+dHLI0sNvj5cSIkYQ8gr1r1KDlOCjtY8bGqnQxDmrTbv8r/5H67fsleNrP8A4J2/8EgfhXqfxq1ZPDP/AArv4e6THrz6gxMljLHaRL9lIG4tIjYiAXJJXiv5K9F1P/hPvE3ivxNa2jWVn4j1u6vre2/54JJIzhR9N23j+7X7/f8ABxj/AMEq/wBoz/go78Pv+E2+F3xYtvGHw70Wwj1fTfhpbWxs1vsRKxuYLiN2S+nYbnjEwTarFYyWbD/zYW/xP1zQ4WtbeZLGOI7TEsCjYRxj5gT27mtppvY4sFUp05OdS/yPSf2YvE8XhrwncynSrO+uPtUgjlnLnysxxgYUMBnqQSDg4616J46+K3iL4lbV1S+3QJI0scEFusMcZLyOMBccKZGCjPyjgDGAPJfgdIIvBU7MwVVu2yx4A+RK3NV+J+i6FBta+immx92E+Zj8uP1rjq0253SPpcDGisPGVWVrHTGzj1aBo51XzOcsPlwe5/Hr9TSHxVqHhW1a1kjaaOQbY5s4YD+v415tf/H63tG/0GymlbuZ2Cgn6DP865vVfjVrmoxNEk0NtCxzsjjHH4tk/rWKwU5O0ti62dUKavRk1Pa66rzPXF1aG+jkkIZGjBLZwM8e3T+dYr+MtJ0a1mnvNStZZLgYaGN95UDnG1cgHP0zwTzmvF7vVbi/fdNcTTFuu5y1Vjya6o4Tuzw5Zq+bm5U2ek618UdDjy9jb3n2rGN2QsePY5JH5Viv8YdQQjyY7eNl5V2G91PTjtyPauP2n0oraNGCOCpipzd9vQ1LnxVfXRbddSKCOiHYP0qg88krEtIzH3NRUVoopbGDnJ63PsL/AIJT/wDBFn4pf8Ffx48/4Vnr/gDQ/wDhXf8AZ/8AaX/CTX13a+d9t+1eV5P2e1n3Y+ySbt23GVxnJx8z/GX4Ta58BPi74o8D+JrX7D4g8H6rc6NqVvyRFcwStFIBkDI3IcHHI5719bf8EXf+C3Xij/gjX4g8cSaJ4I8P+ONJ+IX9nf2pbX13NZ3MX2L7V5fkTJuVci7k3bo3zhcYwc/Xn7Qn/BcD9gD9tT4sn4jfFr9jfxVqnjzbGZbyy10RJqLRgKn2kQz26T4RVXdLG52oq8qMVRPU/Y7/AIN5bzXL/wD4IwfAOTxB9p/tBtDmWNpw29rUXtyLU/MSdpt/JKnoVwRgEAfyZ/8ABQLxDoPi79vH41ap4VNq3hnUvHet3WktbMDA1o9/O0Jj2gDYUKkYAGCMV+jH/BQj/g7H8cftBfAy4+FXwO8A2HwQ8EzaeNGe7hvBcaotgI/KW3thGkcVnH5fyYQOwXGx0xX5FN97jpQBMJ3W2Cbm2ZJ254zx/n8KYOV+oyfzoooHzN7jm/h755qPO5qKKkuewOMGgnCr9KKKozHP8qL79fzP+FNkGG/AGiigBtFFFABRRRQAUUUUAf/Z")
     item1_1 = create_item("Gagh", cat1, user1, pic, "Very fresh")
     item1_2 = create_item("Roasted Tauntaun", cat1, user2, pic, "Also smells bad on the inside")
     item2_1 = create_item("Red Matter", cat2, user1, pic, "For destroying planets")
@@ -338,5 +838,6 @@ def load_dummy_data():
 if __name__ == '__main__':
     print("Setting up DB")
     initial_db_setup()
-    print("Creating dummy records")
-    load_dummy_data()
+    if not get_categories():
+        print("Creating dummy records")
+        load_dummy_data()
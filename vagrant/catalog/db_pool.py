@@ -0,0 +1,215 @@
+"""
+This file houses a small connection pool for our sqlite3 database.
+
+Opening a connection (and re-applying our pragmas to it) used to happen on
+every single DAL call, which dominated request latency once the dashboard
+started issuing a query per category.  The pool keeps a bounded number of
+long-lived connections around and hands them out to one caller at a time.
+
+Connections are created lazily, configured exactly once (row factory,
+WAL journaling and friends), and health-checked before being handed out
+again.  Basic usage counters are tracked so the pool can be sized sensibly
+in production (see ConnectionPool.get_stats()).
+"""
+
+import contextlib
+import sqlite3
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Applied once to every new connection, in order.
+DEFAULT_PRAGMAS = (
+    # Enforce our ON DELETE CASCADE relationships (see catalog.sql)
+    ("foreign_keys", "ON"),
+    # Readers no longer block behind writers (and vice versa)
+    ("journal_mode", "WAL"),
+    # Safe in WAL mode, and saves an fsync on every commit
+    ("synchronous", "NORMAL"),
+    # Milliseconds to wait on a locked database before giving up
+    ("busy_timeout", "5000"),
+    )
+
+
+class PoolTimeoutError(Exception):
+    """ Raised when no connection became available within the pool's timeout. """
+    pass
+
+
+class PoolStats(object):
+    """ Running counters describing how a ConnectionPool has been used. """
+    def __init__(self):
+        # Number of times a connection was handed out
+        self.checkouts = 0
+        # Number of checkouts that had to block until a connection was returned
+        self.waits = 0
+        # Total seconds spent blocking in those waits
+        self.wait_time = 0.0
+        # Number of connections opened over the pool's lifetime
+        self.creations = 0
+        # Number of connections thrown away (failed health checks, errors)
+        self.discards = 0
+        # Number of checkouts that gave up after timing out
+        self.timeouts = 0
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of sqlite3 connections.
+
+    At most <size> connections exist at any given time; callers that arrive
+    while every connection is checked out block for up to <timeout> seconds.
+    Idle connections are reused most-recently-returned first, which keeps
+    the set of "warm" connections (and their page caches) small.
+    """
+    def __init__(self, db_path, size=5, timeout=10.0, pragmas=DEFAULT_PRAGMAS):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1, got {}".format(size))
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.stats = PoolStats()
+        self._idle = []
+        self._open_count = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _create_connection(self):
+        """ Opens and configures a brand new connection. """
+        # Connections are shared across threads, but only ever used by
+        # one thread at a time (the pool hands out exclusive checkouts).
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # This Row wrapper adds the ability to access a row's fields by column name,
+        # allowing us to auto-convert them to entities as long as the field names
+        # match (see dal.entity_from_row()).
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute("PRAGMA {} = {}".format(name, value))
+        return conn
+
+    def _is_healthy(self, conn):
+        """ Returns True if the connection can still talk to the database. """
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            logger.exception("Error while closing pooled connection")
+
+    def checkout(self):
+        """
+        Returns a connection for the caller's exclusive use.  Every checkout
+        must be paired with a checkin(), preferably via connection().
+
+        Throws a PoolTimeoutError if none became available in time.
+        """
+        with self._cond:
+            waited_since = None
+            while not self._idle and self._open_count >= self.size:
+                if waited_since is None:
+                    waited_since = time.time()
+                    self.stats.waits += 1
+                remaining = self.timeout - (time.time() - waited_since)
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    raise PoolTimeoutError(
+                        "No connection available after {}s".format(self.timeout))
+                self._cond.wait(remaining)
+            if waited_since is not None:
+                self.stats.wait_time += time.time() - waited_since
+            self.stats.checkouts += 1
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                # Reserve the slot now; the connection itself is opened
+                # below, outside of the lock.
+                self._open_count += 1
+
+        if conn is not None and not self._is_healthy(conn):
+            logger.warning("Discarding unhealthy pooled connection")
+            self._close_quietly(conn)
+            with self._cond:
+                self.stats.discards += 1
+            conn = None
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except:
+                with self._cond:
+                    self._open_count -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.stats.creations += 1
+        return conn
+
+    def checkin(self, conn, discard=False):
+        """
+        Returns a connection to the pool.  If discard is set, the connection
+        is closed instead of being reused (freeing its slot for a new one).
+        """
+        with self._cond:
+            if discard:
+                self._open_count -= 1
+                self.stats.discards += 1
+                reuse = False
+            else:
+                self._idle.append(conn)
+                reuse = True
+            self._cond.notify()
+        if not reuse:
+            self._close_quietly(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Provides a pooled connection scoped to a with block.  The
+        transaction is committed if the block succeeds and rolled back
+        if it raises, so no half-finished work leaks into the next checkout.
+        """
+        conn = self.checkout()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+            raise
+        finally:
+            self.checkin(conn, discard=discard)
+
+    def close_all(self):
+        """
+        Closes every idle connection.  Connections that are currently checked
+        out are left alone; the pool reopens connections on demand afterwards.
+        """
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._open_count -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def get_stats(self):
+        """ Returns a snapshot of the pool's usage counters as a dict. """
+        with self._cond:
+            output = self.stats.to_dict()
+            output["size"] = self.size
+            output["open"] = self._open_count
+            output["idle"] = len(self._idle)
+        output["in_use"] = output["open"] - output["idle"]
+        return output
@@ -6,17 +6,54 @@ Entities allow our application to have a consistent way of interacting
 with these objects even as they move across various media (perhaps by
 being serialized, or sent back and forth from the DAL).
 
+Entities declare their fields in __slots__ rather than carrying a
+per-instance __dict__, which keeps large listings compact.  Converting
+database rows into entities goes through row converters that are generated
+once per (entity class, column list) and then reused for every row.
+
+A slot whose name starts with an underscore backs a lazily-loaded property
+of the same name without the underscore (like Item.pic).  Row converters,
+to_dict() and to_json() use the public name, but never trigger a load:
+exports only include lazy fields that have already been loaded or assigned.
+
+to_json() also goes through a generated function per class, which writes
+each field's JSON straight into the output instead of building a dict
+and handing it to JSONEncoder.
+
 For more info on how these entities are persisted, see dal.py
 """
 
 import json
+from json.encoder import encode_basestring_ascii
 
 def jdefault(o):
     """ JSON encoder used to serialize Entities """
     if isinstance(o, buffer):
         # Special case for encoding binary picture data on items
         return str(o)
-    return o.__dict__
+    if isinstance(o, Entity):
+        return o.to_dict()
+    raise TypeError("{!r} is not JSON serializable".format(o))
+
+# Reused for every encode; json.dumps(default=...) builds a new encoder per call
+_encoder = json.JSONEncoder(default=jdefault)
+
+def to_json(obj):
+    """ Serializes an entity (or a list/dict containing entities) to JSON. """
+    if isinstance(obj, Entity):
+        return obj.to_json()
+    return _encoder.encode(obj)
+
+def _value_to_json(value):
+    """ Encodes a single field value the way _encoder would, taking shortcuts for common types. """
+    value_type = type(value)
+    if value_type is unicode or value_type is str:
+        return encode_basestring_ascii(value)
+    if value_type is int or value_type is long:
+        return str(value)
+    if value_type is buffer:
+        return encode_basestring_ascii(str(value))
+    return _encoder.encode(value)
 
 class AuthSource(object):
     """ Enum listing all authentication sources we currently support. """
@@ -26,44 +63,184 @@ class AuthSource(object):
 
 class Entity(object):
     """ Base class for all 'things' manipulated by our app that have a database footprint. """
-    def __init__(self):
-        pass
+    __slots__ = ()
 
     def __init__(self, **entries):
         """
         Reconstructs an Entity instance from a dict.  Useful when deserializing.
-        Uses code from:
-        http://stackoverflow.com/questions/3768895/python-how-to-make-a-class-json-serializable
+        Fields that aren't provided are set to None.
         """
-        self.__dict__.update(entries)
+        for field in self.__slots__:
+            setattr(self, field, None)
+        for field, value in entries.items():
+            setattr(self, field, value)
+
+    def to_dict(self):
+        """ Returns the entity's fields as a dict, leaving out any that are None. """
+        cls = type(self)
+        to_dict = _dict_converters.get(cls)
+        if to_dict is None:
+            to_dict = _compile_dict_converter(cls)
+            _dict_converters[cls] = to_dict
+        return to_dict(self)
 
     def to_json(self):
-        return json.dumps(self, default=jdefault)
+        """ Serializes the entity's fields to a JSON object, leaving out any that are None. """
+        cls = type(self)
+        to_json = _json_converters.get(cls)
+        if to_json is None:
+            to_json = _compile_json_converter(cls)
+            _json_converters[cls] = to_json
+        return to_json(self)
+
+    @classmethod
+    def row_converter(cls, columns):
+        """
+        Returns a function that turns a database row (anything indexable by
+        position, with values in the order given by columns) into a new
+        instance of this class.  Columns that don't match a field are ignored.
+
+        Converters are generated and compiled once per column list, so
+        converting a large result set costs one function call per row.
+        """
+        columns = tuple(columns)
+        key = (cls, columns)
+        converter = _row_converters.get(key)
+        if converter is None:
+            converter = _compile_row_converter(cls, columns)
+            _row_converters[key] = converter
+        return converter
+
+
+_row_converters = {}
+_dict_converters = {}
+_json_converters = {}
+
+def _compile(lines, namespace):
+    """ Compiles the generated function source in lines and returns the function. """
+    exec("\n".join(lines), namespace)
+    return namespace["convert"]
+
+def _compile_row_converter(cls, columns):
+    """
+    Generates the source for a row converter (in the spirit of
+    collections.namedtuple) so that every field is assigned directly,
+    without looping or looking up column names per row.
+    """
+    lines = ["def convert(row):", "    entity = _new(_cls)"]
+    for field in cls.__slots__:
+        column = field.lstrip("_")
+        if column in columns:
+            lines.append("    entity.{} = row[{}]".format(field, columns.index(column)))
+        else:
+            lines.append("    entity.{} = None".format(field))
+    lines.append("    return entity")
+    return _compile(lines, {"_new": cls.__new__, "_cls": cls})
+
+def _compile_dict_converter(cls):
+    """ As above, but generates the body of Entity.to_dict() for a class. """
+    lines = ["def convert(entity):", "    output = {}"]
+    for field in cls.__slots__:
+        lines.append("    value = entity.{}".format(field))
+        lines.append("    if value is not None:")
+        lines.append("        output[{!r}] = value".format(field.lstrip("_")))
+    lines.append("    return output")
+    return _compile(lines, {})
+
+def _compile_json_converter(cls):
+    """
+    As above, but generates the body of Entity.to_json() for a class, with
+    each field's '"name": ' prefix worked out ahead of time.
+    """
+    lines = ["def convert(entity):", "    parts = []"]
+    for field in cls.__slots__:
+        prefix = encode_basestring_ascii(field.lstrip("_")) + ": "
+        lines.append("    value = entity.{}".format(field))
+        lines.append("    if value is not None:")
+        # Strings and integers are by far the most common, so they're inlined
+        lines.append("        value_type = type(value)")
+        lines.append("        if value_type is unicode or value_type is str:")
+        lines.append("            parts.append({!r} + _encode_string(value))".format(prefix))
+        lines.append("        elif value_type is int:")
+        lines.append("            parts.append({!r} + str(value))".format(prefix))
+        lines.append("        else:")
+        lines.append("            parts.append({!r} + _value_to_json(value))".format(prefix))
+    lines.append("    return '{' + ', '.join(parts) + '}'")
+    return _compile(lines, {"_encode_string": encode_basestring_ascii,
+        "_value_to_json": _value_to_json})
 
 
 class User(Entity):
     """ An end-user account that authenticates with and uses our app """
-    user_id = None  # generated by DB
-    username = None
-    auth_source = None
-    auth_source_id = None
+    __slots__ = (
+        "user_id",  # generated by DB
+        "username",
+        "auth_source",
+        "auth_source_id",
+        )
 
 class Category(Entity):
     """ A category to which [0..n] items belong. """
-    cat_id = None # generated by DB
-    name = None
-    creator_id = None
-    creator_name = None
+    __slots__ = (
+        "cat_id",  # generated by DB
+        "name",
+        "creator_id",
+        "creator_name",
+        )
+
+# Set by the DAL (see set_picture_loaders()); functions that return
+# a picture's hash given its pic_id, and its raw data given its hash
+_pic_hash_loader = None
+_pic_loader = None
+
+def set_picture_loaders(pic_hash_loader, pic_loader):
+    """ Registers the functions Item uses to fetch its picture on first access. """
+    global _pic_hash_loader, _pic_loader
+    _pic_hash_loader = pic_hash_loader
+    _pic_loader = pic_loader
 
 class Item(Entity):
-    """ The 'things' that users create and look up in the app. """
-    item_id = None # generated by DB
-    name = None
-    description = None
-    cat_id = None
-    cat_name = None
-    creator_id = None
-    creator_name = None
-    changed = None
-    pic_id = None
-    pic = None
+    """
+    The 'things' that users create and look up in the app.
+
+    Most DAL lookups skip the pictures table entirely; pic_hash (and pic,
+    the raw picture data) are then fetched the first time they're read.
+    """
+    __slots__ = (
+        "item_id",  # generated by DB
+        "name",
+        "description",
+        "cat_id",
+        "cat_name",
+        "creator_id",
+        "creator_name",
+        "changed",
+        # Incremented on every update (see dal.update_item())
+        "version",
+        "pic_id",
+        # Hash of the item's picture within the picture store (see picture_store.py)
+        "_pic_hash",
+        # Only filled in when exporting pictures (see catalog.jsonEndpoint())
+        "pic_url",
+        "_pic",
+        )
+
+    @property
+    def pic_hash(self):
+        if self._pic_hash is None and self.pic_id is not None and _pic_hash_loader:
+            self._pic_hash = _pic_hash_loader(self.pic_id)
+        return self._pic_hash
+
+    @pic_hash.setter
+    def pic_hash(self, value):
+        self._pic_hash = value
+
+    @property
+    def pic(self):
+        if self._pic is None and self.pic_hash is not None and _pic_loader:
+            self._pic = _pic_loader(self.pic_hash)
+        return self._pic
+
+    @pic.setter
+    def pic(self, value):
+        self._pic = value
@@ -0,0 +1,77 @@
+"""
+This file builds and caches the Atom feed of recently changed items.
+
+Feed readers poll constantly, but the feed only changes when the catalog
+does.  Rendered pages of the feed are cached against the DAL's catalog
+generation (see dal.get_catalog_generation()), so between writes a poll
+costs a dictionary lookup, and the ETag computed here lets the handler
+answer most polls with a 304 and no body at all.
+
+There's deliberately no Last-Modified: the newest entry's date doesn't
+change when an item is deleted or a category renamed, so answering
+If-Modified-Since from it would hide those changes behind a stale 304.
+"""
+
+import hashlib
+
+from flask import render_template
+
+import dal
+from cache_utils import LRUCache, MISSING
+from handler_utils import date_to_atom_friendly
+
+
+# Number of entries per page when the client doesn't ask for a limit
+DEFAULT_FEED_LIMIT = 10
+# Largest page a client may request
+MAX_FEED_LIMIT = 100
+
+# Old generations are never looked up again and simply age out
+__feed_cache = LRUCache(max_entries=64)
+
+
+class Feed(object):
+    """ A rendered page of the Atom feed, plus the metadata needed to cache it. """
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def get_feed(base_url, limit=DEFAULT_FEED_LIMIT, page=1):
+    """
+    Returns the requested page of the feed as a Feed instance, rendering it
+    only if the catalog has changed since it was last built.
+
+    base_url is the application's root URL, used to build absolute links.
+    """
+    key = (dal.get_catalog_generation(), base_url, limit, page)
+    feed = __feed_cache.get(key)
+    if feed is MISSING:
+        feed = build_feed(base_url, limit, page)
+        __feed_cache.set(key, feed)
+    return feed
+
+
+def build_feed(base_url, limit, page):
+    """ Renders a page of the feed from the database (no caching). """
+    # Ask for one extra item to find out whether there's another page
+    items = dal.get_recent_items(limit + 1, offset=(page - 1) * limit)
+    has_next = len(items) > limit
+    items = items[:limit]
+
+    # Convert the dates to RFC-3339 format for Atom compatibility
+    for i in items:
+        i.changed = date_to_atom_friendly(i.changed)
+
+    feed_url = "{}catalog.atom".format(base_url)
+    next_url = None
+    if has_next:
+        next_url = "{}?limit={}&page={}".format(feed_url, limit, page + 1)
+    body = render_template("atom.xml",
+        base_url=base_url,
+        self_url="{}?limit={}&page={}".format(feed_url, limit, page),
+        next_url=next_url,
+        last_updated=items[0].changed if items else None,
+        items=items)
+    return Feed(body)
+
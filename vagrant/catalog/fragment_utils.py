@@ -0,0 +1,66 @@
+"""
+This file contains helpers for caching rendered template fragments.
+
+Some parts of a page (like the sidebar) are expensive to render but only
+differ between viewers in a few small places: whether a toolbox shows up
+next to the things a user owns, or which entry is highlighted.  Such a
+fragment is rendered once, with every variant of those places included
+and wrapped in a marker comment:
+
+    <!--#if user-->shown to anyone who is logged in<!--#endif-->
+    <!--#if owner=3-->shown to user 3<!--#endif-->
+    <!--#if cat=Food-->shown when the active category is Food<!--#endif-->
+    <!--#if item=Gagh-->shown when the active item is Gagh<!--#endif-->
+
+compile_fragment() splits the rendered HTML into literal text and
+conditional sections once, and render_fragment() then assembles the
+version for a particular viewer with nothing more than string joins.
+Markers can't be nested.  Because templates autoescape their content,
+user data can never produce a marker by accident.
+"""
+
+import re
+
+from jinja2 import escape
+
+
+MARKER = re.compile(r"<!--#if (\w+)(?:=(.*?))?-->(.*?)<!--#endif-->", re.DOTALL)
+
+
+def compile_fragment(html):
+    """
+    Returns a list of (literal text, condition kind, condition argument, body)
+    tuples covering html; the last tuple only holds trailing literal text.
+    """
+    sections = []
+    position = 0
+    for match in MARKER.finditer(html):
+        sections.append((html[position:match.start()],) + match.groups())
+        position = match.end()
+    sections.append((html[position:], None, None, None))
+    return sections
+
+
+def render_fragment(sections, user_id=None, active_cat=None, active_item=None):
+    """
+    Assembles a compiled fragment for a viewer.  user_id is None for
+    visitors who aren't logged in.
+    """
+    # Marker arguments were autoescaped when the fragment was rendered
+    context = {
+        "user": user_id is not None,
+        "owner": unicode(user_id) if user_id is not None else None,
+        "cat": unicode(escape(active_cat)) if active_cat is not None else None,
+        "item": unicode(escape(active_item)) if active_item is not None else None,
+        }
+    parts = []
+    for literal, kind, argument, body in sections:
+        parts.append(literal)
+        if kind is None:
+            continue
+        if kind == "user":
+            if context["user"]:
+                parts.append(body)
+        elif argument is not None and context.get(kind) == argument:
+            parts.append(body)
+    return u"".join(parts)
@@ -3,10 +3,14 @@ This file contains helper functions to make our web handler code
 cleaner.
 """
 
+import base64
 import time
 import datetime
+# datetime.strptime() imports this on first use, which fails when several
+# request threads get there at once (http://bugs.python.org/issue7980)
+import _strptime
 
-from flask import make_response, render_template
+from flask import Markup, Response, make_response, render_template
 import json
 from session_utils import get_active_user
 
@@ -16,8 +20,9 @@ import logging
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 
-from dal import list_items_by_cat
+from dal import get_or_build_cached, list_items_by_cat
 from entities import Entity
+from fragment_utils import compile_fragment, render_fragment
 from session_utils import get_current_nonce
 
 
@@ -32,6 +37,27 @@ def date_to_atom_friendly(date):
     return rfc3339(parsed)
 
 
+def encode_page_cursor(key):
+    """
+    Turns a keyset pagination key (like dal.item_page_key()) into an
+    opaque, URL-safe token that clients hand back to fetch the next page.
+    """
+    return base64.urlsafe_b64encode(json.dumps(key)).rstrip("=")
+
+def decode_page_cursor(cursor):
+    """ Reverses encode_page_cursor(); throws a ValueError if cursor is malformed. """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(cursor) + "=" * (-len(cursor) % 4)))
+    except (TypeError, UnicodeEncodeError):
+        raise ValueError("Malformed page cursor")
+    # A sort value followed by an ID; anything else would confuse the DAL
+    if (not isinstance(key, list) or len(key) != 2 or
+            not isinstance(key[0], (basestring, int, long, float)) or
+            not isinstance(key[1], (int, long))):
+        raise ValueError("Malformed page cursor")
+    return tuple(key)
+
+
 def __create_response(obj, content_type, http_status_code):
     """ Creates an HTTP response of the given content_type and status """
     response = make_response(obj, http_status_code)
@@ -42,6 +68,10 @@ def create_atom_response(obj, http_status_code=200):
     """Dumps the provided object into a response with MIME type set for an Atom feed."""
     return __create_response(obj, "application/atom+xml", http_status_code)
 
+def create_metrics_response(obj, http_status_code=200):
+    """ Creates a response in the Prometheus text exposition format. """
+    return __create_response(obj, "text/plain; version=0.0.4; charset=utf-8", http_status_code)
+
 def create_json_response(obj, http_status_code=200):
     """
     Dumps the provided object into a JSON response and returns a success code.
@@ -49,6 +79,13 @@ def create_json_response(obj, http_status_code=200):
     """
     return __create_response(obj, "application/json", http_status_code)
 
+def create_json_stream_response(chunks, http_status_code=200):
+    """
+    Creates a JSON response whose body is produced incrementally from an
+    iterable of already-encoded chunks (sent using chunked transfer encoding).
+    """
+    return Response(chunks, status=http_status_code, mimetype="application/json")
+
 def create_err_response(message, err_code):
     """
     Logs the error and creates a corresponding HTTP error response.
@@ -76,6 +113,12 @@ def not_found_error():
 def already_exists_error():
     return create_err_response("Unable to create -- that resource already exists", 400)
 
+def conflict_error():
+    return create_err_response("Someone else changed the resource since you loaded it", 409)
+
+def too_large_error():
+    return create_err_response("The uploaded file is too large", 413)
+
 def internal_error():
     return create_err_response("Internal server error", 500)
 
@@ -87,8 +130,23 @@ def render(filename, **kwargs):
     Passes along any provided kwargs after adding in a few fields
     required by our base template, like info on the logged in user
     and sidebar items.
+
+    The sidebar and category dropdowns are only rendered once per catalog
+    change (see fragment_utils.py); pass active_cat and active_item to
+    highlight entries in the sidebar.
     """
-    kwargs["current_user"] = get_active_user()
-    kwargs["items_by_cat"] = list_items_by_cat()
+    user = get_active_user()
+    kwargs["current_user"] = user
     kwargs["state"] = get_current_nonce()
+    kwargs["category_options"] = get_or_build_cached("category_options", __build_category_options)
+    kwargs["sidebar"] = Markup(render_fragment(get_or_build_cached("sidebar", __build_sidebar),
+        user_id=user.user_id if user is not None else None,
+        active_cat=kwargs.get("active_cat"),
+        active_item=kwargs.get("active_item")))
     return render_template(filename, **kwargs)
+
+def __build_category_options():
+    return Markup(render_template("category_options.html", items_by_cat=list_items_by_cat()))
+
+def __build_sidebar():
+    return compile_fragment(render_template("sidebar.html", items_by_cat=list_items_by_cat()))
@@ -0,0 +1,271 @@
+"""
+Bulk import of items into the catalog, e.g. from a supplier feed.
+
+Feeds are CSV files (with a header row) or JSON Lines files (one object
+per line), where every row has the fields:
+    category, name, description, picture
+picture is the path of a JPEG file; relative paths are resolved against
+the directory holding the feed.  Categories that don't exist yet are created.
+
+Pictures are read, validated and written to the picture store by a pool
+of worker threads (which also queue their thumbnails, see thumbnails.py),
+while the main thread inserts the prepared rows in batches (one
+executemany() transaction and a single commit per batch, see
+dal.create_items()).  Rows that can't be imported are reported with their
+line number instead of aborting the whole import, as are rows naming an
+item that already exists (in the catalog or earlier in the feed), so
+re-running a feed doesn't duplicate its items.
+
+Usage (from the catalog project directory):
+    python item_import.py feed.csv --user-id 1 [--batch-size 1000] [--workers 4]
+"""
+
+import argparse
+import csv
+import imghdr
+import itertools
+import json
+import os
+import sqlite3
+import time
+from multiprocessing.pool import ThreadPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+import dal
+
+
+# Number of rows inserted (and committed) at a time
+BATCH_SIZE = 1000
+# Number of threads reading and validating pictures
+WORKER_COUNT = 4
+# Largest picture we import, in bytes; the same cap catalog.py puts on uploads
+MAX_PICTURE_SIZE = 8 * 1024 * 1024
+
+FIELDS = ("category", "name", "description", "picture")
+
+
+class RowError(Exception):
+    """ Raised when a single row of a feed can't be imported. """
+    pass
+
+
+class ImportReport(object):
+    """ Summary of a bulk import: what was created, what failed, and how fast. """
+    def __init__(self):
+        self.imported = 0
+        self.categories_created = 0
+        # (line number, message) for every row that was rejected
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return (self.imported + len(self.errors)) / self.elapsed
+
+    def to_dict(self):
+        return {
+            "imported": self.imported,
+            "categories_created": self.categories_created,
+            "errors": self.errors,
+            "elapsed": self.elapsed,
+            "rows_per_second": self.rows_per_second,
+            }
+
+
+def read_csv(path):
+    """ Yields a (line number, row dict) pair for every data row of a CSV file. """
+    with open(path, "rb") as feed:
+        reader = csv.DictReader(feed)
+        for row in reader:
+            yield reader.line_num, row
+
+def read_jsonl(path):
+    """ Yields a (line number, row dict) pair for every non-blank line of a JSON Lines file. """
+    with open(path, "rb") as feed:
+        for line_num, line in enumerate(feed, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = e
+            yield line_num, row
+
+READERS = {
+    "csv": read_csv,
+    "jsonl": read_jsonl,
+    }
+
+def read_feed(path, feed_format=None):
+    """ Picks a reader by feed_format, or by the file's extension if that's None. """
+    if feed_format is None:
+        feed_format = os.path.splitext(path)[1].lstrip(".").lower()
+    if feed_format not in READERS:
+        raise ValueError("Unsupported feed format: {}".format(feed_format))
+    return READERS[feed_format](path)
+
+
+def prepare_row(row, base_dir):
+    """
+    Validates a single feed row and stores its picture.  Returns a
+    (category name, name, description, pic_hash) tuple, or throws a
+    descriptive RowError.  Runs on the worker threads.
+    """
+    if not isinstance(row, dict):
+        raise RowError("Malformed row: {}".format(row))
+    values = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if isinstance(value, str):
+            try:
+                value = value.decode("utf-8")
+            except UnicodeDecodeError:
+                raise RowError("{} is not valid UTF-8".format(field))
+        elif value is not None and not isinstance(value, unicode):
+            value = unicode(value)
+        value = value.strip() if value else value
+        if field != "description" and not value:
+            raise RowError("Missing {}".format(field))
+        values[field] = value
+    if not values["description"]:
+        values["description"] = "Placeholder item description"
+
+    pic_path = os.path.join(base_dir, values["picture"])
+    try:
+        with open(pic_path, "rb") as pic_file:
+            content = pic_file.read(MAX_PICTURE_SIZE + 1)
+    except IOError as e:
+        raise RowError("Can't read picture {}: {}".format(pic_path, e.strerror))
+    if len(content) > MAX_PICTURE_SIZE:
+        raise RowError("Picture {} is larger than {} bytes".format(pic_path, MAX_PICTURE_SIZE))
+    # Same check as catalog.validate_picture()
+    if not imghdr.what("", h=content) == 'jpeg':
+        raise RowError("Picture {} is not a JPEG file".format(pic_path))
+
+    pic_hash = dal.store_picture(content)
+    return values["category"], values["name"], values["description"], pic_hash
+
+def __prepare_task(task):
+    """ Wraps prepare_row() so that errors travel back to the main thread as values. """
+    line_num, row, base_dir = task
+    try:
+        return line_num, prepare_row(row, base_dir), None
+    except RowError as e:
+        return line_num, None, str(e)
+
+
+def import_items(path, creator_id, feed_format=None, batch_size=BATCH_SIZE,
+        workers=WORKER_COUNT):
+    """
+    Imports every row of the feed at path as an item owned by creator_id.
+    Returns an ImportReport.
+    """
+    if dal.get_user(creator_id) is None:
+        raise ValueError("No user with ID {}".format(creator_id))
+
+    report = ImportReport()
+    start = time.time()
+    cat_ids = dict((cat.name, cat.cat_id) for cat in dal.get_categories())
+    # (cat_id, name) of every item, mapped to the feed line that created it
+    # (or None for items that were already in the catalog)
+    item_lines = dict(((item.cat_id, item.name), None) for item in dal.get_items())
+    base_dir = os.path.dirname(os.path.abspath(path))
+    tasks = ((line_num, row, base_dir) for line_num, row in read_feed(path, feed_format))
+
+    pool = ThreadPool(workers)
+    try:
+        # imap() keeps the results in feed order
+        results = pool.imap(__prepare_task, tasks, chunksize=64)
+        while True:
+            chunk = list(itertools.islice(results, batch_size))
+            if not chunk:
+                break
+            batch = []
+            for line_num, prepared, error in chunk:
+                if error is not None:
+                    report.errors.append((line_num, error))
+                    continue
+                cat_name, name, description, pic_hash = prepared
+                if cat_name not in cat_ids:
+                    cat_ids[cat_name] = dal.create_category(cat_name, creator_id)
+                    report.categories_created += 1
+                key = (cat_ids[cat_name], name)
+                if key in item_lines:
+                    report.errors.append((line_num, __duplicate_error(
+                        cat_name, name, item_lines[key])))
+                    continue
+                item_lines[key] = line_num
+                batch.append((line_num,
+                    (name, description, pic_hash, cat_ids[cat_name], creator_id)))
+            __insert_batch(batch, report)
+            logger.info("Imported {} items so far ({} errors)".format(
+                report.imported, len(report.errors)))
+    finally:
+        pool.close()
+        pool.join()
+
+    report.elapsed = time.time() - start
+    return report
+
+def __duplicate_error(cat_name, name, line_num):
+    if line_num is None:
+        return u"Category {} already has an item named {}".format(cat_name, name)
+    return u"Same category and name as line {}".format(line_num)
+
+def __insert_batch(batch, report):
+    """
+    Inserts a batch of (line number, row) pairs with a single commit.  If the
+    database rejects the batch, it's retried a row at a time so that only
+    the offending rows are reported and skipped.
+    """
+    try:
+        report.imported += dal.create_items([row for _, row in batch])
+        return
+    except sqlite3.Error as e:
+        logger.warning("Batch rejected ({}); retrying row by row".format(e))
+    for line_num, row in batch:
+        try:
+            report.imported += dal.create_items([row])
+        except sqlite3.Error as e:
+            report.errors.append((line_num, str(e)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("feed", help="CSV or JSON Lines file to import")
+    parser.add_argument("--user-id", type=int, required=True,
+        help="the user that will own the imported items")
+    parser.add_argument("--format", choices=sorted(READERS), default=None,
+        help="feed format (guessed from the file extension by default)")
+    parser.add_argument("--db", default=dal.DB_PATH)
+    parser.add_argument("--pictures", default=dal.PICTURE_DIR)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKER_COUNT)
+    parser.add_argument("--json", action="store_true",
+        help="print the report as JSON")
+    args = parser.parse_args()
+
+    dal.configure_pool(db_path=args.db)
+    dal.configure_picture_store(args.pictures)
+    report = import_items(args.feed, args.user_id, args.format,
+        args.batch_size, args.workers)
+    # Thumbnails are generated in the background; don't quit halfway through
+    dal.wait_for_thumbnails()
+
+    if args.json:
+        print(json.dumps(report.to_dict()))
+        return
+    for line_num, error in report.errors:
+        print(" - Line {}: {}".format(line_num, error))
+    print("Imported {} items ({} new categories) in {:.2f}s, {:.0f} rows/s; {} rows failed".format(
+        report.imported, report.categories_created, report.elapsed,
+        report.rows_per_second, len(report.errors)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,472 @@
+"""
+Load tests for the catalog web app.
+
+Builds a synthetic catalog in a throwaway database (configurable numbers
+of users, categories and items, and picture sizes), then lets a number of
+concurrent virtual users loose on it.  Each virtual user logs in through
+the real /gconnect flow (against an oauth_utils.StubProvider), then keeps
+picking a scenario at random: browsing the dashboard, item pages, pictures
+and the JSON/Atom endpoints, or creating, updating and deleting its own
+items through the same POST forms a browser would use.
+
+The virtual users can drive the app through Flask's test client (no
+network, so it measures the app itself) or over HTTP against a local
+multi-threaded server (closer to production, including the WSGI layer).
+Results are written as JSON so that runs on different commits can be
+compared.  Run from the catalog project directory:
+
+    python loadtest.py run --threads 8 --duration 30 --output after.json
+    python loadtest.py compare before.json after.json
+
+(For micro-benchmarks of individual components, see benchmark.py.)
+"""
+
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+import dal
+import oauth_utils
+from benchmark import fresh_database
+from entities import AuthSource
+
+
+# Relative frequency of each scenario in the default mix
+DEFAULT_MIX = {
+    "dashboard": 20,
+    "item_page": 35,
+    "picture": 10,
+    "catalog_json": 3,
+    "catalog_atom": 7,
+    "create_item": 10,
+    "update_item": 10,
+    "delete_item": 5,
+    }
+DRIVERS = ("client", "http")
+# Pictures are shared between items, like re-used stock photos
+DISTINCT_PICTURES = 20
+# Items are inserted this many at a time while building the catalog
+INSERT_BATCH_SIZE = 1000
+
+# The form nonce, as found in our pages (see session_utils.generate_nonce())
+STATE_PATTERN = re.compile(r'(?:name="state" value="|/gconnect\?state=)(\w+)')
+# Just enough of a JFIF header for imghdr to accept a picture
+JPEG_HEADER = "\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+def build_catalog(users, categories, items_per_cat, picture_kb, seed=0):
+    """
+    Fills the DAL's (empty) database with a synthetic catalog.  Returns a
+    dict describing it: the (category name, item name) of every item and
+    the hash and contents of every picture.
+    """
+    rng = random.Random(seed)
+    user_ids = [dal.create_user("owner{}@loadtest.invalid".format(u), AuthSource.DUMMY,
+        "owner{}".format(u)) for u in range(users)]
+    pictures = []
+    for p in range(DISTINCT_PICTURES):
+        data = JPEG_HEADER + str(bytearray(rng.getrandbits(8)
+            for _ in range(max(0, picture_kb * 1024 - len(JPEG_HEADER)))))
+        pictures.append((dal.store_picture(data), data))
+
+    items = []
+    rows = []
+    for c in range(categories):
+        cat_name = "Category {}".format(c)
+        cat_id = dal.create_category(cat_name, user_ids[c % users])
+        for i in range(items_per_cat):
+            item_name = "Item {}".format(i)
+            items.append((cat_name, item_name))
+            rows.append((item_name, "Description of {} in {}".format(item_name, cat_name),
+                rng.choice(pictures)[0], cat_id, rng.choice(user_ids)))
+            if len(rows) == INSERT_BATCH_SIZE:
+                dal.create_items(rows)
+                rows = []
+    if rows:
+        dal.create_items(rows)
+    dal.wait_for_thumbnails()
+    return {
+        "categories": ["Category {}".format(c) for c in range(categories)],
+        "items": items,
+        "pictures": pictures,
+        }
+
+
+class ClientDriver(object):
+    """ Sends requests through Flask's test client, in-process. """
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, files=None, body=None):
+        """ Returns the (status code, body) of a request; files maps fields to (filename, data). """
+        data = body
+        if form is not None or files is not None:
+            data = dict(form or {})
+            for field, (filename, content) in (files or {}).items():
+                data[field] = (io.BytesIO(content), filename)
+        response = self.client.open(path, method=method, data=data)
+        # Reading and closing the body lets streamed responses run to completion
+        content = response.data
+        response.close()
+        return response.status_code, content
+
+
+class HttpDriver(object):
+    """ Sends requests over HTTP with a keep-alive session, like a browser would. """
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def request(self, method, path, form=None, files=None, body=None):
+        if files is not None:
+            files = dict((field, (filename, content, "image/jpeg"))
+                for field, (filename, content) in files.items())
+        response = self.session.request(method, self.base_url + path,
+            data=form if form is not None else body, files=files, allow_redirects=False)
+        return response.status_code, response.content
+
+
+class VirtualUser(object):
+    """ One simulated visitor, logged in as its own user, running scenarios one at a time. """
+    def __init__(self, driver, catalog, name, rng):
+        self.driver = driver
+        self.catalog = catalog
+        self.name = name
+        self.rng = rng
+        self.state = None
+        # (category name, item name) of the items this user created and still owns
+        self.own_items = []
+        self.counter = 0
+
+    def _request(self, method, path, **kwargs):
+        status, body = self.driver.request(method, path, **kwargs)
+        match = STATE_PATTERN.search(body) if method == "GET" else None
+        if match:
+            self.state = match.group(1)
+        elif method == "POST":
+            # Every accepted form post uses up the nonce; reload a page before the next one
+            self.state = None
+        return status
+
+    def log_in(self):
+        self._request("GET", "/login")
+        status = self._request("POST", "/gconnect?state={}".format(self.state), body=self.name)
+        if status != 200:
+            raise ValueError("Virtual user {} failed to log in ({})".format(self.name, status))
+
+    def run(self, scenario):
+        """
+        Runs a scenario and returns the (scenario, latency in seconds, succeeded)
+        of every request it made.  Scenarios that need something this user
+        doesn't have yet (an item to update, a nonce) make that first.
+        """
+        if scenario in ("update_item", "delete_item") and not self.own_items:
+            scenario = "create_item"
+        results = []
+        if scenario.endswith("_item") and self.state is None:
+            results.extend(self.run("dashboard"))
+        method, path, kwargs, expected, on_success = getattr(self, "_" + scenario)()
+        start = time.time()
+        status = self._request(method, path, **kwargs)
+        results.append((scenario, time.time() - start, status == expected))
+        if status == expected and on_success is not None:
+            on_success()
+        return results
+
+    def _new_name(self):
+        self.counter += 1
+        return "{} item {}".format(self.name, self.counter)
+
+    def _dashboard(self):
+        return "GET", "/", {}, 200, None
+
+    def _item_page(self):
+        return ("GET", "/catalog/{}/{}/".format(*self.rng.choice(self.catalog["items"])), {},
+            200, None)
+
+    def _picture(self):
+        rendition = self.rng.choice(("list", "detail"))
+        pic_hash = self.rng.choice(self.catalog["pictures"])[0]
+        return "GET", "/pictures/{}/{}.jpg".format(pic_hash, rendition), {}, 200, None
+
+    def _catalog_json(self):
+        return "GET", "/catalog.json?pictures=url", {}, 200, None
+
+    def _catalog_atom(self):
+        return "GET", "/catalog.atom", {}, 200, None
+
+    def _create_item(self):
+        cat_name = self.rng.choice(self.catalog["categories"])
+        item_name = self._new_name()
+        form = {"state": self.state, "item_create_parent": cat_name,
+            "item_create_name": item_name, "item_create_description": "Created under load"}
+        files = {"item_create_pic": ("pic.jpg", self.rng.choice(self.catalog["pictures"])[1])}
+        return ("POST", "/catalog/create-item/", {"form": form, "files": files}, 302,
+            lambda: self.own_items.append((cat_name, item_name)))
+
+    def _update_item(self):
+        index = self.rng.randrange(len(self.own_items))
+        cat_name, item_name = self.own_items[index]
+        new_name = self._new_name()
+        form = {"state": self.state, "item_update_old_parent": cat_name,
+            "item_update_old_name": item_name, "item_update_new_name": new_name,
+            "item_update_new_parent": cat_name, "item_update_description": "Updated under load"}
+        files = {"item_update_pic": ("", "")}
+        def renamed():
+            self.own_items[index] = (cat_name, new_name)
+        return ("POST", "/catalog/update-item/", {"form": form, "files": files}, 302,
+            renamed)
+
+    def _delete_item(self):
+        index = self.rng.randrange(len(self.own_items))
+        cat_name, item_name = self.own_items[index]
+        form = {"state": self.state, "item_delete_parent": cat_name,
+            "item_delete_name": item_name}
+        return ("POST", "/catalog/delete-item/", {"form": form}, 302,
+            lambda: self.own_items.pop(index))
+
+
+def run_load(make_driver, catalog, threads, duration=None, requests_per_thread=None,
+        mix=DEFAULT_MIX, seed=0, label="load"):
+    """
+    Runs threads virtual users (each with a driver from make_driver()) for
+    duration seconds, or until each has made requests_per_thread requests.
+    Virtual users are named after label, which must be unique per database.
+    Returns (list of (scenario, latency, succeeded), elapsed seconds).
+    """
+    scenarios = sorted(mix)
+    weights = [mix[s] for s in scenarios]
+    results = []
+    errors = []
+    lock = threading.Lock()
+    start = time.time()
+    deadline = start + duration if duration else None
+
+    def work(index):
+        rng = random.Random(seed * 1000 + index)
+        user = VirtualUser(make_driver(), catalog, "{}-user{}".format(label, index), rng)
+        own = []
+        try:
+            user.log_in()
+            while True:
+                if deadline is not None and time.time() >= deadline:
+                    break
+                if requests_per_thread is not None and len(own) >= requests_per_thread:
+                    break
+                own.extend(user.run(_weighted_choice(rng, scenarios, weights)))
+        except Exception as e:
+            errors.append(e)
+        with lock:
+            results.extend(own)
+
+    workers = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+    return results, time.time() - start
+
+def _weighted_choice(rng, choices, weights):
+    point = rng.uniform(0, sum(weights))
+    for choice, weight in zip(choices, weights):
+        point -= weight
+        if point <= 0:
+            return choice
+    return choices[-1]
+
+
+def summarize(results, elapsed):
+    """ Aggregates run_load() results into per-scenario (and overall) statistics. """
+    by_scenario = {}
+    for scenario, latency, succeeded in results:
+        by_scenario.setdefault(scenario, []).append((latency, succeeded))
+    by_scenario["all"] = [(latency, succeeded) for _, latency, succeeded in results]
+    summary = {}
+    for scenario, samples in by_scenario.items():
+        latencies = sorted(latency for latency, _ in samples)
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000.0
+        summary[scenario] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, succeeded in samples if not succeeded),
+            "rps": len(samples) / elapsed if elapsed else 0.0,
+            "mean_ms": sum(latencies) * 1000.0 / len(latencies),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            }
+    return summary
+
+
+def start_server(app):
+    """ Serves app over HTTP on a free local port from a background thread; returns the server. """
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    import catalog as catalog_app
+    app = catalog_app.app
+    app.secret_key = "loadtest"
+    oauth_utils.configure_provider(oauth_utils.StubProvider())
+    # Made-up pictures can't be scaled; that's expected here
+    logging.getLogger("thumbnails").setLevel(logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix="catalog_load_")
+    try:
+        fresh_database(workdir, "load")
+        start = time.time()
+        catalog = build_catalog(args.users, args.categories, args.items_per_cat,
+            args.picture_kb, args.seed)
+        print("Built a catalog of {} items in {:.1f}s".format(
+            len(catalog["items"]), time.time() - start))
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                },
+            "config": dict((k, v) for k, v in vars(args).items()
+                if k not in ("func", "output")),
+            "runs": {},
+            }
+        for driver in args.drivers:
+            server = None
+            if driver == "http":
+                server = start_server(app)
+                base_url = "http://127.0.0.1:{}".format(server.server_port)
+                make_driver = lambda: HttpDriver(base_url)
+            else:
+                make_driver = lambda: ClientDriver(app)
+            try:
+                results, elapsed = run_load(make_driver, catalog, args.threads,
+                    args.duration, args.requests, seed=args.seed, label=driver)
+            finally:
+                if server is not None:
+                    server.shutdown()
+            report["runs"][driver] = summarize(results, elapsed)
+            print_summary(driver, report["runs"][driver])
+    finally:
+        dal.wait_for_thumbnails()
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        print("Results written to {}".format(args.output))
+
+def print_summary(driver, summary):
+    print("\n{} driver".format(driver))
+    print("{:>14} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+        "scenario", "requests", "errors", "req/s", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+    for scenario in sorted(summary, key=lambda s: (s == "all", s)):
+        stats = summary[scenario]
+        print("{:>14} {:>9} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}".format(scenario,
+            stats["requests"], stats["errors"], stats["rps"],
+            stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+
+
+def compare(args):
+    """ Prints the change in throughput and latency between two result files. """
+    with open(args.before) as before_file:
+        before = json.load(before_file)
+    with open(args.after) as after_file:
+        after = json.load(after_file)
+    print("before: {} ({})".format(before["meta"]["commit"], before["meta"]["timestamp"]))
+    print("after:  {} ({})".format(after["meta"]["commit"], after["meta"]["timestamp"]))
+
+    regressions = []
+    for driver in sorted(set(before["runs"]) & set(after["runs"])):
+        print("\n{} driver".format(driver))
+        print("{:>14} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            "scenario", "req/s", "after", "change", "p95 (ms)", "after", "change"))
+        old_runs, new_runs = before["runs"][driver], after["runs"][driver]
+        for scenario in sorted(set(old_runs) & set(new_runs), key=lambda s: (s == "all", s)):
+            old, new = old_runs[scenario], new_runs[scenario]
+            rps_change = _change(old["rps"], new["rps"])
+            p95_change = _change(old["p95_ms"], new["p95_ms"])
+            flag = ""
+            if rps_change < -args.threshold or p95_change > args.threshold:
+                flag = "  <-- regression"
+                regressions.append((driver, scenario))
+            print("{:>14} {:>9.1f} {:>9.1f} {:>+8.0%} {:>9.2f} {:>9.2f} {:>+8.0%}{}".format(
+                scenario, old["rps"], new["rps"], rps_change,
+                old["p95_ms"], new["p95_ms"], p95_change, flag))
+    return 1 if regressions else 0
+
+def _change(old, new):
+    return (new - old) / old if old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers()
+
+    run_parser = commands.add_parser("run", help="build a catalog and load test it")
+    run_parser.set_defaults(func=run)
+    run_parser.add_argument("--users", type=int, default=10,
+        help="users owning the generated categories and items")
+    run_parser.add_argument("--categories", type=int, default=20)
+    run_parser.add_argument("--items-per-cat", type=int, default=25)
+    run_parser.add_argument("--picture-kb", type=int, default=50,
+        help="size of each generated picture")
+    run_parser.add_argument("--threads", type=int, default=4,
+        help="concurrent virtual users")
+    run_parser.add_argument("--duration", type=float, default=10.0,
+        help="seconds to run each driver for")
+    run_parser.add_argument("--requests", type=int, default=None,
+        help="stop after this many requests per virtual user instead")
+    run_parser.add_argument("--drivers", default=",".join(DRIVERS),
+        type=lambda s: s.split(","), help="comma-separated drivers: client, http")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="write the results to this JSON file")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.set_defaults(func=compare)
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+        help="relative change in req/s or p95 latency reported as a regression")
+
+    args = parser.parse_args()
+    if args.func is run:
+        for driver in args.drivers:
+            if driver not in DRIVERS:
+                parser.error("Unknown driver: {}".format(driver))
+        if args.requests is not None:
+            args.duration = None
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+This file houses our request profiling and query instrumentation.
+
+While a web request is being handled (between start_request() and
+finish_request(), see catalog.py), every DAL cursor is wrapped so that
+the request's queries, fetched rows and picture bytes are counted.
+Public DAL functions are timed with the @timed decorator whether or not
+a request is active.
+
+Aggregates are kept per route and per DAL function, and render_metrics()
+exports them in the Prometheus text format (served at /metrics) as
+summaries: a running count and sum, plus the 50th, 95th and 99th
+percentiles of the most recent SAMPLE_WINDOW observations.
+
+A fraction of requests can also be run under cProfile (see
+configure_profiling()); their stats are written to a directory for
+inspection with pstats or snakeviz.
+"""
+
+import collections
+import cProfile
+import functools
+import os
+import random
+import re
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Number of recent observations percentiles are computed from, per series
+SAMPLE_WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Summary(object):
+    """ A running count and sum, plus a sliding window of recent observations. """
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self._samples = collections.deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self._samples.append(value)
+
+    def quantiles(self):
+        """ Returns a list of (quantile, value) pairs over the window (nearest rank). """
+        samples = sorted(self._samples)
+        if not samples:
+            return [(q, 0.0) for q in QUANTILES]
+        return [(q, samples[min(len(samples) - 1, int(q * len(samples)))])
+            for q in QUANTILES]
+
+
+class SummaryFamily(object):
+    """ A set of summaries sharing a metric name, told apart by one label. """
+    def __init__(self, name, description, label):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            summary = self._summaries.get(label_value)
+            if summary is None:
+                summary = self._summaries[label_value] = Summary()
+            summary.observe(value)
+
+    def snapshot(self):
+        """ Returns a sorted list of (label value, count, sum, quantiles) tuples. """
+        with self._lock:
+            return sorted((label_value, s.count, s.total, s.quantiles())
+                for label_value, s in self._summaries.items())
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} summary".format(self.name)]
+        for label_value, count, total, quantiles in self.snapshot():
+            label = '{}="{}"'.format(self.label, _escape_label(label_value))
+            for q, value in quantiles:
+                lines.append('{}{{{},quantile="{}"}} {}'.format(self.name, label, q,
+                    _format_value(value)))
+            lines.append("{}_sum{{{}}} {}".format(self.name, label, _format_value(total)))
+            lines.append("{}_count{{{}}} {}".format(self.name, label, count))
+        return lines
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    return repr(float(value))
+
+
+REQUEST_SECONDS = SummaryFamily("catalog_request_duration_seconds",
+    "Wall time spent handling requests.", "route")
+REQUEST_QUERIES = SummaryFamily("catalog_request_queries",
+    "Database queries run per request.", "route")
+REQUEST_ROWS = SummaryFamily("catalog_request_rows",
+    "Database rows fetched per request.", "route")
+REQUEST_PICTURE_BYTES = SummaryFamily("catalog_request_picture_bytes",
+    "Bytes of picture data read through the DAL per request.", "route")
+DAL_SECONDS = SummaryFamily("catalog_dal_duration_seconds",
+    "Wall time spent in DAL functions.", "function")
+FAMILIES = (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_ROWS, REQUEST_PICTURE_BYTES,
+    DAL_SECONDS)
+
+
+class RequestStats(object):
+    """ Counters for the request being handled by the current thread. """
+    __slots__ = ("start", "queries", "rows", "picture_bytes", "profiler")
+
+    def __init__(self):
+        self.start = time.time()
+        self.queries = 0
+        self.rows = 0
+        self.picture_bytes = 0
+        self.profiler = None
+
+__local = threading.local()
+
+def current_request():
+    """ Returns the RequestStats of the current thread's request, or None outside of one. """
+    return getattr(__local, "stats", None)
+
+def start_request():
+    """ Starts counting for a new request on the current thread. """
+    stats = RequestStats()
+    if __profile_rate and random.random() < __profile_rate:
+        stats.profiler = cProfile.Profile()
+        stats.profiler.enable()
+    __local.stats = stats
+    return stats
+
+def finish_request(route):
+    """ Stops counting for the current thread's request and records it under route. """
+    stats = current_request()
+    if stats is None:
+        return
+    __local.stats = None
+    elapsed = time.time() - stats.start
+    if stats.profiler is not None:
+        stats.profiler.disable()
+        __save_profile(stats.profiler, route)
+    REQUEST_SECONDS.observe(route, elapsed)
+    REQUEST_QUERIES.observe(route, stats.queries)
+    REQUEST_ROWS.observe(route, stats.rows)
+    REQUEST_PICTURE_BYTES.observe(route, stats.picture_bytes)
+
+def count_picture_bytes(count):
+    stats = current_request()
+    if stats is not None:
+        stats.picture_bytes += count
+
+
+class InstrumentedCursor(object):
+    """ Wraps a DB-API cursor, counting queries and fetched rows towards a request. """
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def execute(self, *args):
+        self._stats.queries += 1
+        return self._cursor.execute(*args)
+
+    def executemany(self, *args):
+        self._stats.queries += 1
+        return self._cursor.executemany(*args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        stats = self._stats
+        for row in self._cursor:
+            stats.rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+def instrument_cursor(cursor):
+    """ Returns cursor wrapped in an InstrumentedCursor if a request is active, else as is. """
+    stats = current_request()
+    if stats is None:
+        return cursor
+    return InstrumentedCursor(cursor, stats)
+
+
+def timed(func):
+    """ Decorator recording the wall time of every call to a DAL function. """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DAL_SECONDS.observe(func.__name__, time.time() - start)
+    return wrapper
+
+
+__profile_rate = 0.0
+__profile_dir = None
+
+def configure_profiling(rate, directory="profiles"):
+    """
+    Runs a random fraction (0 to 1) of requests under cProfile and writes
+    their stats to directory, one <time>-<route>.prof file per request.
+    Profiling slows requests down a lot; keep the rate low in production.
+    """
+    global __profile_rate, __profile_dir
+    if rate and not os.path.isdir(directory):
+        os.makedirs(directory)
+    __profile_dir = directory
+    __profile_rate = rate
+
+def __save_profile(profiler, route):
+    name = "{:.6f}-{}.prof".format(time.time(), re.sub(r"[^\w.-]+", "_", route).strip("_"))
+    try:
+        profiler.dump_stats(os.path.join(__profile_dir, name))
+    except (IOError, OSError) as e:
+        logger.warning("Unable to save request profile: {}".format(e))
+
+
+def render_metrics(gauges=None):
+    """
+    Returns every metric in the Prometheus text exposition format.
+    gauges optionally maps extra metric names to current values
+    (e.g. connection pool counters).
+    """
+    lines = []
+    for family in FAMILIES:
+        lines.extend(family.render())
+    for name, value in sorted((gauges or {}).items()):
+        lines.append("# TYPE {} gauge".format(name))
+        lines.append("{} {}".format(name, _format_value(value)))
+    return "\n".join(lines) + "\n"
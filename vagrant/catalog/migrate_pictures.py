@@ -0,0 +1,97 @@
+"""
+Schema migration step that moves item pictures out of the database.
+
+Older databases kept every picture as base64 text in a "pic" BLOB column
+of the pictures table.  This step decodes each one, writes the raw JPEG
+into the content-addressed picture store (see picture_store.py), and
+rebuilds the pictures table so that it only records hashes.  Items that
+had identical pictures end up sharing a single pictures row.
+
+It's run by migrations.py as part of a normal upgrade; on a database that
+was created with the newer schema it does nothing.
+"""
+
+import base64
+import binascii
+
+
+# Rows are inserted into the rebuilt table this many at a time
+BATCH_SIZE = 500
+
+PRETTY_ITEMS_VIEW = """
+CREATE VIEW pretty_items AS
+    SELECT i.item_id, i.name, i.description, i.pic_id, i.cat_id, i.creator_id, i.changed,
+        u.username AS creator_name,
+        c.name AS cat_name,
+        p.pic_hash
+    FROM items AS i
+        JOIN users AS u ON (i.creator_id = u.user_id)
+        JOIN categories AS c ON (i.cat_id = c.cat_id)
+        JOIN pictures AS p ON (i.pic_id = p.pic_id)
+    """
+
+
+def decode_legacy_picture(pic):
+    """
+    Returns the raw JPEG data for a legacy pictures.pic value.  Those were
+    supposed to be base64 text, but anything that doesn't decode cleanly is
+    assumed to have been stored raw.
+    """
+    data = bytes(pic)
+    try:
+        return base64.b64decode(data)
+    except (TypeError, binascii.Error):
+        return data
+
+
+def needs_migration(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(pictures)")]
+    return "pic" in columns
+
+
+def convert_pictures(conn, store, batch_size=BATCH_SIZE):
+    """
+    Migrates every legacy picture row reachable through conn into store.
+    Must be run inside a transaction with foreign keys switched off
+    (dropping the old table would otherwise cascade into items); the
+    migration runner takes care of both.
+
+    Returns a dict of counters describing what was done.
+    """
+    stats = {"rows": 0, "unique": 0, "bytes": 0}
+    if not needs_migration(conn):
+        return stats
+
+    conn.execute("CREATE TABLE pictures_migrated (" +
+        "pic_id INTEGER PRIMARY KEY, pic_hash TEXT NOT NULL UNIQUE)")
+
+    pic_id_by_hash = {}
+    duplicates = []
+    batch = []
+    reader = conn.cursor()
+    writer = conn.cursor()
+    for pic_id, pic in reader.execute("SELECT pic_id, pic FROM pictures"):
+        data = decode_legacy_picture(pic)
+        pic_hash = store.save(data)
+        stats["rows"] += 1
+        stats["bytes"] += len(data)
+        if pic_hash in pic_id_by_hash:
+            duplicates.append((pic_id_by_hash[pic_hash], pic_id))
+            continue
+        pic_id_by_hash[pic_hash] = pic_id
+        batch.append((pic_id, pic_hash))
+        if len(batch) >= batch_size:
+            writer.executemany("INSERT INTO pictures_migrated VALUES (?, ?)", batch)
+            batch = []
+    if batch:
+        writer.executemany("INSERT INTO pictures_migrated VALUES (?, ?)", batch)
+    stats["unique"] = len(pic_id_by_hash)
+
+    # Point items with duplicate pictures at the surviving row
+    writer.executemany("UPDATE items SET pic_id = ? WHERE pic_id = ?", duplicates)
+
+    conn.execute("DROP VIEW IF EXISTS pretty_items")
+    conn.execute("DROP TABLE pictures")
+    conn.execute("ALTER TABLE pictures_migrated RENAME TO pictures")
+    conn.execute(PRETTY_ITEMS_VIEW)
+    return stats
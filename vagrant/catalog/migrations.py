@@ -0,0 +1,253 @@
+"""
+This file houses our versioned schema migrations.
+
+Each database records the last migration applied to it in SQLite's
+PRAGMA user_version (0 for a brand new or pre-migration database).
+migrate() applies every newer migration in order, each inside its own
+transaction, so a database can be upgraded in place without losing data.
+
+To change the schema, append a new Migration to MIGRATIONS with the next
+version number.  Never edit or reorder one that has already shipped.
+
+Usage (from the catalog project directory):
+    python migrations.py [--db catalog.db] [--pictures pictures] [--target N]
+"""
+
+import argparse
+import sqlite3
+
+import logging
+logger = logging.getLogger(__name__)
+
+import migrate_pictures
+from picture_store import PictureStore
+
+
+class Migration(object):
+    """
+    A single schema change, given as one of:
+        sql: a script of ;-separated statements
+        sql_file: the path of a file containing such a script
+        func: a function, called as func(conn, context)
+    A migration may also combine func with a script, which then runs after func.
+    """
+    def __init__(self, version, description, sql=None, sql_file=None, func=None):
+        self.version = version
+        self.description = description
+        self.sql = sql
+        self.sql_file = sql_file
+        self.func = func
+
+    def apply(self, conn, context):
+        if self.func is not None:
+            self.func(conn, context)
+        script = self.sql
+        if self.sql_file is not None:
+            with open(self.sql_file, "r") as sql_file:
+                script = sql_file.read()
+        if script is not None:
+            for statement in split_statements(script):
+                conn.execute(statement)
+
+
+class MigrationContext(object):
+    """ Resources that migrations may need beyond the database itself. """
+    def __init__(self, picture_store):
+        self.picture_store = picture_store
+
+
+def split_statements(script):
+    """
+    Splits a SQL script into individual statements.  (Connection.executescript()
+    can't be used here: it commits any open transaction before it starts.)
+    """
+    statements = []
+    pending = ""
+    for chunk in script.split(";"):
+        pending += chunk + ";"
+        if sqlite3.complete_statement(pending):
+            if pending.strip(" \t\r\n;"):
+                statements.append(pending)
+            pending = ""
+    return statements
+
+
+def _move_pictures_to_store(conn, context):
+    stats = migrate_pictures.convert_pictures(conn, context.picture_store)
+    if stats["rows"]:
+        logger.info("Moved {rows} pictures ({unique} unique, {bytes} bytes) "
+            "into the picture store".format(**stats))
+
+
+def _add_item_versions(conn, context):
+    # Bumped by every update_item(), so that concurrent editors can detect
+    # conflicts (changed only has a resolution of one second).  SQLite has
+    # no ADD COLUMN IF NOT EXISTS, so check for it first.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(items)")]
+    if "version" not in columns:
+        conn.execute("ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+
+MIGRATIONS = [
+    Migration(1, "Initial schema", sql_file="catalog.sql"),
+    Migration(2, "Move pictures into the content-addressed picture store",
+        func=_move_pictures_to_store),
+    Migration(3, "Index hot lookup and sort columns", sql="""
+        -- get_category_by_name()
+        CREATE INDEX IF NOT EXISTS categories_by_name ON categories(name);
+        -- get_item_by_name(), get_items_by_cat()
+        CREATE INDEX IF NOT EXISTS items_by_cat_name ON items(cat_id, name);
+        -- get_recent_items() (the rowid, item_id, is implicitly appended)
+        CREATE INDEX IF NOT EXISTS items_by_changed ON items(changed);
+        -- get_or_create_user()
+        CREATE INDEX IF NOT EXISTS users_by_auth_source
+            ON users(auth_source, auth_source_id);
+        """),
+    Migration(4, "Add a version counter to items for optimistic concurrency",
+        func=_add_item_versions, sql="""
+        DROP VIEW IF EXISTS pretty_items;
+        CREATE VIEW pretty_items AS
+            SELECT i.item_id, i.name, i.description, i.pic_id, i.cat_id, i.creator_id,
+                i.changed, i.version,
+                u.username AS creator_name,
+                c.name AS cat_name,
+                p.pic_hash
+            FROM items AS i
+                JOIN users AS u ON (i.creator_id = u.user_id)
+                JOIN categories AS c ON (i.cat_id = c.cat_id)
+                JOIN pictures AS p ON (i.pic_id = p.pic_id);
+        DROP VIEW IF EXISTS pretty_items_light;
+        CREATE VIEW pretty_items_light AS
+            SELECT i.item_id, i.name, i.description, i.pic_id, i.cat_id, i.creator_id,
+                i.changed, i.version,
+                u.username AS creator_name,
+                c.name AS cat_name
+            FROM items AS i
+                JOIN users AS u ON (i.creator_id = u.user_id)
+                JOIN categories AS c ON (i.cat_id = c.cat_id);
+        """),
+    Migration(5, "Add a full-text search index over items", sql="""
+        -- Full-text index for dal.search_items(), one row per item (rowid = item_id).
+        -- prefix='2 3' keeps short prefix queries ("ga*") on the fast path.
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_search USING fts5(
+            name, description, cat_name,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+            );
+        -- Matches in names count the most, then category names, then descriptions
+        INSERT INTO items_search(items_search, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0)');
+
+        -- Kept in sync by triggers, so that every write path (including bulk
+        -- imports and cascading deletes) updates the index.
+        CREATE TRIGGER IF NOT EXISTS items_search_insert AFTER INSERT ON items BEGIN
+            INSERT INTO items_search(rowid, name, description, cat_name)
+                SELECT new.item_id, new.name, new.description, c.name
+                FROM categories AS c WHERE c.cat_id = new.cat_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS items_search_update
+        AFTER UPDATE OF name, description, cat_id ON items BEGIN
+            DELETE FROM items_search WHERE rowid = old.item_id;
+            INSERT INTO items_search(rowid, name, description, cat_name)
+                SELECT new.item_id, new.name, new.description, c.name
+                FROM categories AS c WHERE c.cat_id = new.cat_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS items_search_delete AFTER DELETE ON items BEGIN
+            DELETE FROM items_search WHERE rowid = old.item_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS items_search_rename_category
+        AFTER UPDATE OF name ON categories BEGIN
+            UPDATE items_search SET cat_name = new.name
+                WHERE rowid IN (SELECT item_id FROM items WHERE cat_id = new.cat_id);
+        END;
+
+        -- Index everything that already exists
+        DELETE FROM items_search;
+        INSERT INTO items_search(rowid, name, description, cat_name)
+            SELECT i.item_id, i.name, i.description, c.name
+            FROM items AS i JOIN categories AS c ON (i.cat_id = c.cat_id);
+        """),
+    Migration(6, "Index the keys items are paged through", sql="""
+        -- get_items_page() by name across the whole catalog
+        -- (items_by_cat_name already covers a single category)
+        CREATE INDEX IF NOT EXISTS items_by_name ON items(name);
+        -- get_items_page() by most recent change within a category
+        CREATE INDEX IF NOT EXISTS items_by_cat_changed ON items(cat_id, changed);
+        """),
+    ]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1].version
+
+
+def migrate(db_path, picture_store, target=None):
+    """
+    Brings the database at db_path up to the target version (the latest,
+    by default) and returns the list of migrations that were applied.
+
+    Throws a ValueError if the database is already newer than the target,
+    since we don't support downgrades.
+    """
+    if target is None:
+        target = latest_version()
+    context = MigrationContext(picture_store)
+    applied = []
+    # Autocommit mode, so that we control the transactions (and so that DDL
+    # statements don't implicitly commit halfway through a migration).
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        current = get_schema_version(conn)
+        if current > target:
+            raise ValueError("Database is at version {}, newer than target {}".format(
+                current, target))
+        # Table rebuilds (the standard SQLite way of altering a table) would
+        # otherwise cascade deletes into dependent tables.  This has to be
+        # set outside of a transaction; integrity is re-checked before each commit.
+        conn.execute("PRAGMA foreign_keys = OFF")
+        for migration in MIGRATIONS:
+            if not current < migration.version <= target:
+                continue
+            logger.info("Applying migration {}: {}".format(
+                migration.version, migration.description))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migration.apply(conn, context)
+                problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if problems:
+                    raise sqlite3.IntegrityError(
+                        "Foreign key violations after migration {}: {}".format(
+                            migration.version, problems))
+                # PRAGMAs don't accept bound parameters
+                conn.execute("PRAGMA user_version = {:d}".format(migration.version))
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(migration)
+    finally:
+        conn.close()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="catalog.db")
+    parser.add_argument("--pictures", default="pictures")
+    parser.add_argument("--target", type=int, default=None)
+    args = parser.parse_args()
+
+    applied = migrate(args.db, PictureStore(args.pictures), args.target)
+    for migration in applied:
+        print(" - Applied {}: {}".format(migration.version, migration.description))
+    conn = sqlite3.connect(args.db)
+    print("Database is at schema version {}".format(get_schema_version(conn)))
+    conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
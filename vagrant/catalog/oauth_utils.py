@@ -0,0 +1,252 @@
+"""
+This file houses the OAuth login pipeline used by catalog.gconnect().
+
+Logging in takes three calls to the auth provider: exchanging the one-time
+authorization code for credentials, checking the access token (tokeninfo),
+and looking up who it belongs to (userinfo).  To keep logins from tying up
+web workers:
+ - Every outbound call goes through one pooled, keep-alive HTTP session
+   with connect/read timeouts.
+ - The tokeninfo and userinfo calls run concurrently on a small thread pool.
+ - Verified users are cached for a short while.  Every login brings a
+   fresh code and access token, so the cache is keyed on the provider's
+   user ID (from the ID token the code exchange returns, straight from the
+   provider): a user who logs in again within VERIFIED_USER_TTL (from
+   another tab or device, or retrying) costs one round trip, the code
+   exchange, instead of three.
+
+Providers share that pipeline and only implement the three calls.
+GoogleProvider talks to Google; StubProvider answers locally (with an
+optional simulated delay) so that the whole flow can be load-tested
+offline (see benchmark.py).  Swap providers with configure_provider().
+"""
+
+import abc
+import json
+import threading
+import time
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from oauth2client.client import flow_from_clientsecrets
+from oauth2client.client import FlowExchangeError
+
+import logging
+logger = logging.getLogger(__name__)
+
+from cache_utils import LRUCache, MISSING
+from entities import AuthSource
+
+
+# (connect, read) timeouts for each outbound call, in seconds
+HTTP_TIMEOUT = (3.05, 10)
+# Pooled connections kept open per provider host
+HTTP_POOL_SIZE = 10
+# Threads available for concurrent provider lookups, across all requests
+LOOKUP_THREADS = 8
+# How long a verified user's info is reused without asking the provider again
+VERIFIED_USER_TTL = 60
+
+
+class LoginError(Exception):
+    """ Raised when a login attempt fails; status is the HTTP status to report. """
+    def __init__(self, message, status=401):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class Identity(object):
+    """ The outcome of a successful login. """
+    def __init__(self, auth_source, auth_source_id, username, credentials_json):
+        self.auth_source = auth_source
+        self.auth_source_id = auth_source_id
+        self.username = username
+        # Serialized provider credentials, for storing in the session
+        self.credentials_json = credentials_json
+
+
+class PooledHttp(object):
+    """
+    A thread-safe HTTP client that reuses connections.  Also implements
+    the httplib2.Http.request() signature that oauth2client expects, so the
+    code exchange shares the same connection pool.
+    """
+    def __init__(self, timeout=HTTP_TIMEOUT, pool_size=HTTP_POOL_SIZE):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_json(self, url, params=None):
+        """ GETs url and returns the decoded JSON body (even for error statuses). """
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        return response.json()
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        response = self.session.request(method, uri, data=body, headers=headers,
+            timeout=self.timeout)
+        info = dict(response.headers)
+        info["status"] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+
+class OAuthProvider(object):
+    """
+    The login pipeline.  Subclasses implement exchange_code(),
+    fetch_token_info() and fetch_user_info().
+    """
+    __metaclass__ = abc.ABCMeta
+
+    auth_source = None
+
+    def __init__(self, verified_ttl=VERIFIED_USER_TTL, lookup_timeout=sum(HTTP_TIMEOUT)):
+        self.lookup_timeout = lookup_timeout
+        self._verified = LRUCache(max_entries=1024, ttl=verified_ttl)
+
+    @abc.abstractmethod
+    def exchange_code(self, code):
+        """
+        Upgrades a one-time authorization code.  Returns a tuple of
+        (access token, provider user ID from the ID token, serialized credentials).
+        """
+
+    @abc.abstractmethod
+    def fetch_token_info(self, access_token):
+        """ Returns the provider's tokeninfo dict (with user_id, or error). """
+
+    @abc.abstractmethod
+    def fetch_user_info(self, access_token):
+        """ Returns the provider's userinfo dict (with id and email). """
+
+    def login(self, code):
+        """ Runs the whole login flow for code and returns an Identity, or throws a LoginError. """
+        access_token, user_id, credentials_json = self.exchange_code(code)
+        user_info = self.verify(access_token, user_id)
+        try:
+            return Identity(self.auth_source, user_info["id"], user_info["email"],
+                credentials_json)
+        except (KeyError, TypeError):
+            raise LoginError("Received invalid user data: {}".format(user_info))
+
+    def verify(self, access_token, user_id):
+        """
+        Checks that access_token is valid and belongs to user_id (the user ID
+        from the ID token exchange_code() got), and returns the matching
+        userinfo dict.  Once a user has been verified, their userinfo is
+        reused for a short while without checking their new tokens.
+        """
+        cached = self._verified.get(user_id)
+        if cached is not MISSING:
+            return cached
+
+        # Both lookups only need the token, so run them side by side
+        pool = _lookup_pool()
+        token_lookup = pool.apply_async(self.fetch_token_info, (access_token,))
+        user_lookup = pool.apply_async(self.fetch_user_info, (access_token,))
+        try:
+            token_info = token_lookup.get(self.lookup_timeout)
+            user_info = user_lookup.get(self.lookup_timeout)
+        except TimeoutError:
+            raise LoginError("Timed out waiting for the auth provider", 504)
+        except (requests.RequestException, ValueError) as e:
+            raise LoginError("Unable to reach the auth provider: {}".format(e), 502)
+
+        if token_info.get("error") is not None:
+            raise LoginError(token_info.get("error"), 500)
+        if token_info.get("user_id") != user_id:
+            raise LoginError("Token's user ID doesn't match given user ID", 401)
+        self._verified.set(user_id, user_info)
+        return user_info
+
+
+class GoogleProvider(OAuthProvider):
+    """ Google sign-in (see templates/login.html). """
+    auth_source = AuthSource.GOOGLE_PLUS
+    TOKENINFO_URL = "https://www.googleapis.com/oauth2/v1/tokeninfo"
+    USERINFO_URL = "https://www.googleapis.com/oauth2/v1/userinfo"
+
+    def __init__(self, client_secrets="client_secrets.json", scope="email profile", **kwargs):
+        OAuthProvider.__init__(self, **kwargs)
+        self.http = PooledHttp()
+        # Parsing the client secrets once is enough; the flow itself is stateless
+        self.flow = flow_from_clientsecrets(client_secrets, scope=scope)
+        self.flow.redirect_uri = "postmessage"
+
+    def exchange_code(self, code):
+        try:
+            credentials = self.flow.step2_exchange(code, http=self.http)
+        except (FlowExchangeError, requests.RequestException):
+            raise LoginError("Failed to upgrade the authorization code", 401)
+        return (credentials.access_token, credentials.id_token["sub"],
+            credentials.to_json())
+
+    def fetch_token_info(self, access_token):
+        return self.http.get_json(self.TOKENINFO_URL, {"access_token": access_token})
+
+    def fetch_user_info(self, access_token):
+        return self.http.get_json(self.USERINFO_URL,
+            {"access_token": access_token, "alt": "json"})
+
+
+class StubProvider(OAuthProvider):
+    """
+    A fake provider for offline testing.  Any code is accepted, and logs in
+    as a user whose ID is the code itself.  Each call sleeps for latency
+    seconds to mimic a round trip to a real provider.
+
+    Never configure this outside of tests and benchmarks: anyone could log in as anyone.
+    """
+    auth_source = AuthSource.DUMMY
+
+    def __init__(self, latency=0.0, **kwargs):
+        OAuthProvider.__init__(self, **kwargs)
+        self.latency = latency
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def exchange_code(self, code):
+        self._round_trip()
+        if not code:
+            raise LoginError("Failed to upgrade the authorization code", 401)
+        access_token = "stub-token-" + code
+        return access_token, code, json.dumps({"access_token": access_token})
+
+    def fetch_token_info(self, access_token):
+        self._round_trip()
+        return {"user_id": access_token[len("stub-token-"):]}
+
+    def fetch_user_info(self, access_token):
+        self._round_trip()
+        user_id = access_token[len("stub-token-"):]
+        return {"id": user_id, "email": "{}@stub.invalid".format(user_id)}
+
+
+__provider = None
+__pool = None
+__lock = threading.Lock()
+
+def _lookup_pool():
+    global __pool
+    with __lock:
+        if __pool is None:
+            __pool = ThreadPool(LOOKUP_THREADS)
+        return __pool
+
+def configure_provider(provider):
+    """ Replaces the provider used by get_provider(), e.g. with a StubProvider. """
+    global __provider
+    __provider = provider
+
+def get_provider():
+    """ Returns the configured provider, creating a GoogleProvider on first use. """
+    global __provider
+    with __lock:
+        if __provider is None:
+            __provider = GoogleProvider()
+        return __provider
@@ -0,0 +1,142 @@
+"""
+This file houses our content-addressed picture store.
+
+Item pictures are kept on disk as raw JPEG files named after the SHA-256
+hash of their contents, instead of as base64 text inside the database.
+Identical uploads naturally collapse into a single file, and since a
+file's name never changes while its contents are fixed, it can be served
+with far-future caching headers.
+
+Files are fanned out into subdirectories by the first two characters of
+their hash to keep directory listings short:
+    <root>/ab/abcdef0123...jpg
+Scaled-down renditions of a picture (see thumbnails.py) are kept next to it:
+    <root>/ab/<hash>.detail.jpg
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+RENDITION_PATTERN = re.compile(r"^[a-z]+$")
+# Bytes copied at a time by save_file()
+CHUNK_SIZE = 64 * 1024
+
+
+class PictureStore(object):
+    """ Stores and looks up picture files by the hash of their contents. """
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def hash_of(data):
+        """ Returns the hex digest used to address the given picture data. """
+        return hashlib.sha256(data).hexdigest()
+
+    def path_for(self, pic_hash):
+        """
+        Returns the on-disk path for a picture hash (whether or not it exists).
+        Throws a ValueError if pic_hash isn't a well-formed hash, so that
+        user input can never be used to escape the store's root directory.
+        """
+        if not pic_hash or not HASH_PATTERN.match(pic_hash):
+            raise ValueError("Invalid picture hash: {!r}".format(pic_hash))
+        return os.path.join(self.root, pic_hash[:2], pic_hash + ".jpg")
+
+    def rendition_path_for(self, pic_hash, rendition):
+        """ Like path_for(), for the named rendition of a picture. """
+        if not rendition or not RENDITION_PATTERN.match(rendition):
+            raise ValueError("Invalid rendition name: {!r}".format(rendition))
+        return self.path_for(pic_hash)[:-len(".jpg")] + ".{}.jpg".format(rendition)
+
+    def exists(self, pic_hash):
+        try:
+            return os.path.isfile(self.path_for(pic_hash))
+        except ValueError:
+            return False
+
+    def save(self, data):
+        """
+        Writes the picture data to the store (if it isn't there already)
+        and returns its hash.
+        """
+        pic_hash = self.hash_of(data)
+        path = self.path_for(pic_hash)
+        if not os.path.isfile(path):
+            self._write(path, data)
+        return pic_hash
+
+    def save_file(self, pic_file, chunk_size=CHUNK_SIZE):
+        """
+        Like save(), but streams the picture from a file object a chunk at a
+        time (hashing it along the way), so memory use doesn't grow with the
+        size of the picture.
+        """
+        digest = hashlib.sha256()
+        self._make_dirs(self.root)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in iter(lambda: pic_file.read(chunk_size), b""):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            pic_hash = digest.hexdigest()
+            path = self.path_for(pic_hash)
+            if os.path.isfile(path):
+                os.remove(temp_path)
+            else:
+                self._make_dirs(os.path.dirname(path))
+                os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return pic_hash
+
+    def has_rendition(self, pic_hash, rendition):
+        try:
+            return os.path.isfile(self.rendition_path_for(pic_hash, rendition))
+        except ValueError:
+            return False
+
+    def save_rendition(self, pic_hash, rendition, data):
+        """ Writes (or replaces) the named rendition of a stored picture. """
+        self._write(self.rendition_path_for(pic_hash, rendition), data)
+
+    def _write(self, path, data):
+        """
+        Writes data to path under a temporary name and renames it into
+        place, so readers never see a partial picture.
+        """
+        directory = os.path.dirname(path)
+        self._make_dirs(directory)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(data)
+            os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def _make_dirs(directory):
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another worker may have created it in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+    def read(self, pic_hash):
+        """ Returns the raw data for a stored picture. """
+        with open(self.path_for(pic_hash), "rb") as pic_file:
+            return pic_file.read()
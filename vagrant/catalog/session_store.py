@@ -0,0 +1,217 @@
+"""
+This file houses our server-side session storage.
+
+Flask's default sessions keep everything (the logged in user, OAuth
+credentials, CSRF nonces) inside a signed cookie, which has to be decoded
+and verified on every request and re-signed and resent whenever anything
+in it changes.  Instead, the browser only gets a small, random, opaque
+session ID, and the session data itself lives in a pluggable store:
+ - MemorySessionStore, an in-process LRU; fine for a single web worker.
+ - SqliteSessionStore, a small SQLite file that several worker processes
+   can share.
+
+Usage (see catalog.py):
+    app.session_interface = ServerSideSessionInterface(MemorySessionStore())
+"""
+
+import binascii
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+from cache_utils import LRUCache, MISSING
+
+
+# Sessions that haven't been saved for this long are discarded (seconds)
+SESSION_TTL = 7 * 24 * 60 * 60
+# Number of random bytes in a session ID
+SESSION_ID_BYTES = 24
+
+
+def new_session_id():
+    return binascii.hexlify(os.urandom(SESSION_ID_BYTES))
+
+
+class MemorySessionStore(object):
+    """ Keeps sessions in this process's memory, evicting the least recently used. """
+    def __init__(self, max_entries=10000, ttl=SESSION_TTL):
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def load(self, sid):
+        """ Returns the data saved for sid as a dict, or None if there is none. """
+        data = self._cache.get(sid)
+        if data is MISSING:
+            return None
+        # Copy, so that changes to a session only stick once it's saved
+        return dict(data)
+
+    def save(self, sid, data):
+        self._cache.set(sid, dict(data))
+
+    def delete(self, sid):
+        self._cache.delete(sid)
+
+
+class SqliteSessionStore(object):
+    """
+    Keeps sessions as JSON in a shared SQLite file, so that every worker
+    process pointed at the same path sees the same sessions.  Expired
+    sessions are purged every so often as new ones are saved.
+    """
+    # On average, purge expired sessions once every this many saves
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, path, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (" +
+                "sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _connection(self):
+        # One connection per thread, as in cache_utils.SqliteGeneration
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA busy_timeout = 5000")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires > ?",
+            (sid, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (sid, json.dumps(data), now + self.ttl))
+            if random.randrange(self.PURGE_INTERVAL) == 0:
+                conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def delete(self, sid):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class SessionStats(object):
+    """ Counters describing how the session store is performing. """
+    def __init__(self):
+        self.loads = 0
+        self.hits = 0
+        self.load_time = 0.0
+        self.saves = 0
+        self.save_time = 0.0
+        self.deletes = 0
+
+    def to_dict(self):
+        return {
+            "loads": self.loads,
+            "hits": self.hits,
+            "misses": self.loads - self.hits,
+            "hit_rate": float(self.hits) / self.loads if self.loads else 0.0,
+            "mean_load_ms": self.load_time * 1000.0 / self.loads if self.loads else 0.0,
+            "saves": self.saves,
+            "mean_save_ms": self.save_time * 1000.0 / self.saves if self.saves else 0.0,
+            "deletes": self.deletes,
+            }
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """ A session whose data is kept in a session store, under the ID sid. """
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Set by regenerate(); the ID the data was loaded under
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """
+        Moves the session's data to a fresh ID.  Call this whenever a user
+        logs in, so that an ID handed out beforehand (and possibly planted
+        by someone else) can't be used to ride on the new login.
+        """
+        if self.replaced_sid is None and not self.new:
+            self.replaced_sid = self.sid
+        self.sid = new_session_id()
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """ Plugs a session store into Flask (see Flask.session_interface). """
+    def __init__(self, store):
+        self.store = store
+        self.stats = SessionStats()
+        self._stats_lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid:
+            return ServerSideSession(sid=new_session_id(), new=True)
+        start = time.time()
+        data = self.store.load(sid)
+        elapsed = time.time() - start
+        with self._stats_lock:
+            self.stats.loads += 1
+            self.stats.load_time += elapsed
+            if data is not None:
+                self.stats.hits += 1
+        if data is None:
+            # Unknown or expired; never reuse an ID we didn't hand out
+            return ServerSideSession(sid=new_session_id(), new=True)
+        return ServerSideSession(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.replaced_sid is not None:
+            self._delete(session.replaced_sid)
+        if not session:
+            # Cleared (e.g. on logout) or never used; don't keep anything around
+            if not session.new:
+                self._delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        start = time.time()
+        self.store.save(session.sid, dict(session))
+        elapsed = time.time() - start
+        with self._stats_lock:
+            self.stats.saves += 1
+            self.stats.save_time += elapsed
+        # The cookie only changes when the ID does
+        if session.new or session.replaced_sid is not None:
+            response.set_cookie(app.session_cookie_name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path, secure=self.get_cookie_secure(app))
+
+    def _delete(self, sid):
+        self.store.delete(sid)
+        with self._stats_lock:
+            self.stats.deletes += 1
+
+    def get_stats(self):
+        """ Returns a dict of session store hit rate and latency figures. """
+        with self._stats_lock:
+            return self.stats.to_dict()
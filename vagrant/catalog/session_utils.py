@@ -1,6 +1,8 @@
 """
 This file contains utilities to simplify interaction with Flask sessions,
 like checking the active user or serializing entities into a session variable.
+
+(The session data itself is kept server-side; see session_store.py.)
 """
 
 import random
@@ -9,7 +11,7 @@ import logging
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 
-from flask import session
+from flask import g, session
 import json
 
 from entities import User
@@ -77,17 +79,29 @@ def check_nonce(provided):
 def set_active_user(user):
     """
     Sets the given user as the active user for this session.
+    The session is moved to a new ID first, to guard against session fixation.
     """
+    if hasattr(session, "regenerate"):
+        session.regenerate()
     save_to_session(SessionKeys.CURRENT_USER, user)
+    g.active_user = user
 
 def get_active_user():
     """
     Inspects the session data to look up the currently logged in user.
     Returns a User instance if someone is logged in, or None otherwise.
+
+    The result is remembered for the rest of the request, since most
+    requests ask more than once (every render() does, for instance).
     """
+    try:
+        return g.active_user
+    except AttributeError:
+        pass
     try:
         user_dict = load_from_session(SessionKeys.CURRENT_USER)
         user = User(**user_dict)
-        return user
     except KeyError:
-        return None
+        user = None
+    g.active_user = user
+    return user
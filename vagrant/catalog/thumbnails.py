@@ -0,0 +1,146 @@
+"""
+This file houses our picture thumbnail pipeline.
+
+Uploaded pictures can be any size, but pages only ever show them at a few
+fixed sizes.  Whenever a new picture is stored, a small pool of worker
+threads scales it down to every size in RENDITIONS and stores the results
+next to the original (see picture_store.py), so that pages can link to
+the smallest picture that still looks sharp:
+    /pictures/<pic_hash>/<rendition>.jpg
+Renditions that don't exist yet (e.g. for pictures stored before this
+pipeline existed, or still waiting in the queue) are generated on first
+request instead.
+
+Scaling needs Pillow.  Without it, every rendition is served as the
+original picture.
+"""
+
+import io
+import threading
+from multiprocessing.pool import ThreadPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+from cache_utils import LRUCache, MISSING
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# Longest edge of each rendition, in pixels.  Renditions are cached forever
+# under their name, so give a rendition a new name when changing its size.
+RENDITIONS = {
+    # Thumbnails in lists of items (shown at 48px, with room for HiDPI screens)
+    "list": 96,
+    # The picture on an item's own page
+    "detail": 640,
+    }
+# JPEG quality of the scaled pictures
+RENDITION_QUALITY = 85
+# Number of threads scaling pictures in the background
+THUMBNAIL_WORKERS = 2
+
+
+def scaling_available():
+    """ Returns whether pictures can actually be scaled (i.e. Pillow is installed). """
+    return Image is not None
+
+def scale_picture(data, max_edge):
+    """
+    Returns JPEG data for the picture scaled down to fit within max_edge
+    pixels, or None if it already fits (or can't be decoded).
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        if max(image.size) <= max_edge:
+            return None
+        # Lets the JPEG decoder skip most of the work (it can decode at 1/2, 1/4 or 1/8 size)
+        image.draft("RGB", (max_edge, max_edge))
+        image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.ANTIALIAS)
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=RENDITION_QUALITY, optimize=True, progressive=True)
+        return output.getvalue()
+    except (IOError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Unable to scale picture: {}".format(e))
+        return None
+
+
+class ThumbnailPipeline(object):
+    """ Generates the renditions of pictures in a picture store. """
+    def __init__(self, store, workers=THUMBNAIL_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._pool = None
+        # Hashes queued or being processed, so that repeated uploads of
+        # the same picture don't queue duplicate work
+        self._pending = set()
+        # Recently finished hashes, so that re-uploads of popular pictures
+        # (or bulk imports reusing a few pictures) skip the queue entirely
+        self._done = LRUCache(max_entries=10000)
+        self._lock = threading.Lock()
+
+    def submit(self, pic_hash):
+        """ Queues the renditions of a stored picture to be generated in the background. """
+        if not scaling_available() or self._done.get(pic_hash) is not MISSING:
+            return
+        with self._lock:
+            if pic_hash in self._pending:
+                return
+            self._pending.add(pic_hash)
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            self._pool.apply_async(self._generate_queued, (pic_hash,))
+
+    def _generate_queued(self, pic_hash):
+        try:
+            self.generate(pic_hash)
+            self._done.set(pic_hash, True)
+        except Exception:
+            # Nobody is waiting on the result; renditions will be retried on first request
+            logger.exception("Failed to generate renditions of picture {}".format(pic_hash))
+        finally:
+            with self._lock:
+                self._pending.discard(pic_hash)
+
+    def generate(self, pic_hash, renditions=None):
+        """
+        Generates every missing rendition (or only the given ones) of a
+        stored picture right away.  A picture that's already small enough,
+        or that can't be decoded, is stored as its own rendition.
+        """
+        data = None
+        for rendition in renditions or RENDITIONS:
+            if self.store.has_rendition(pic_hash, rendition):
+                continue
+            if data is None:
+                data = self.store.read(pic_hash)
+            scaled = scale_picture(data, RENDITIONS[rendition])
+            self.store.save_rendition(pic_hash, rendition, scaled or data)
+
+    def get_path(self, pic_hash, rendition):
+        """
+        Returns a (path, is_rendition) tuple for serving the named rendition
+        of a picture, generating the rendition first if necessary.  Falls back
+        to the original picture (with is_rendition False) when pictures can't
+        be scaled.  Returns None if there is no such picture or rendition.
+        """
+        if rendition not in RENDITIONS or not self.store.exists(pic_hash):
+            return None
+        if self.store.has_rendition(pic_hash, rendition):
+            return self.store.rendition_path_for(pic_hash, rendition), True
+        if not scaling_available():
+            return self.store.path_for(pic_hash), False
+        self.generate(pic_hash, [rendition])
+        return self.store.rendition_path_for(pic_hash, rendition), True
+
+    def wait(self):
+        """ Blocks until every queued picture has been processed. """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -6,6 +6,7 @@ pip install bleach
 pip install oauth2client
 pip install requests
 pip install httplib2
+pip install Pillow
 pip install redis
 pip install passlib
 pip install itsdangerous
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+# pairing.py -- Swiss pairing engine
+#
+# Pairs a round from the standings and the list of matches already
+# played, entirely in memory.  Players are numbered by rank, so a pairing
+# is just an array of partner ranks and a player's past opponents are a
+# set of ranks.
+#
+# Going down the standings, each player is paired with the next-ranked
+# player they haven't played yet: players meet someone in their own score
+# group whenever possible, and the odd one out of a score group floats
+# down to the next one.  When the players left at the bottom can't all be
+# paired without a rematch, the search backtracks, re-pairing the players
+# just above them until everyone fits.  In the (rare) case that no
+# rematch-free pairing turns up within MAX_SEARCH_STEPS backtracks,
+# players are paired greedily instead, and whoever that leaves over is
+# fitted in along augmenting paths (Edmonds' blossom algorithm), which
+# re-pair as many players as it takes.  That finds a rematch-free pairing
+# whenever there is one; only if there isn't are the players left over
+# paired with someone they've already played.
+
+from collections import deque
+
+
+# Backtracks tried before falling back on augmenting paths
+MAX_SEARCH_STEPS = 100000
+
+
+def pairPlayers(players, played=(), max_steps=MAX_SEARCH_STEPS):
+    """
+    Pairs up every player for the next round.
+
+    Args:
+        players: the ids of the players to pair (an even number of them),
+          ordered by their standings, best first
+        played: (player id, opponent id) pairs of the matches played so
+          far; players not in the list are ignored
+        max_steps: the number of backtracks allowed before giving up on
+          avoiding rematches
+
+    Returns:
+        A list of (id1, id2) tuples, id1 being the higher-ranked player,
+        ordered by the rank of id1.
+    """
+    count = len(players)
+    if count % 2:
+        raise ValueError("Can't pair an odd number of players ({})".format(count))
+    rank = dict((player, i) for i, player in enumerate(players))
+    opponents = [set() for _ in xrange(count)]
+    for player, opp in played:
+        i = rank.get(player)
+        j = rank.get(opp)
+        if i is not None and j is not None:
+            opponents[i].add(j)
+            opponents[j].add(i)
+
+    partner = _search(opponents, max_steps)
+    if partner is None:
+        partner = _pairGreedily(opponents, allow_rematches=False)
+        for i in xrange(count):
+            if partner[i] == -1:
+                _augment(i, partner, opponents)
+        # Anyone still unpaired can't avoid a rematch
+        partner = _pairGreedily(opponents, partner)
+    return [(players[i], players[partner[i]])
+        for i in xrange(count) if i < partner[i]]
+
+
+def _search(opponents, max_steps):
+    """
+    Returns the partner of every rank in a rematch-free pairing, or None
+    if none was found within max_steps backtracks.
+    """
+    count = len(opponents)
+    partner = [-1] * count
+    # The pairs made so far, in the order they were made
+    made = []
+    i = 0
+    start = 0
+    steps = 0
+    while True:
+        while i < count and partner[i] != -1:
+            i += 1
+        if i == count:
+            return partner
+
+        played = opponents[i]
+        j = max(start, i + 1)
+        while j < count and (partner[j] != -1 or j in played):
+            j += 1
+        if j < count:
+            partner[i] = j
+            partner[j] = i
+            made.append((i, j))
+            start = 0
+            continue
+
+        # Nobody left for i: try the next candidate for the last pair made
+        steps += 1
+        if not made or steps > max_steps:
+            return None
+        i, j = made.pop()
+        partner[i] = partner[j] = -1
+        start = j + 1
+
+
+def _pairGreedily(opponents, partner=None, allow_rematches=True):
+    """
+    Pairs each unpaired rank with the next unpaired rank it hasn't played,
+    or failing that (if allow_rematches), with the next unpaired rank.
+    Ranks that are left unpaired have a partner of -1.
+    """
+    count = len(opponents)
+    if partner is None:
+        partner = [-1] * count
+    for i in xrange(count):
+        if partner[i] != -1:
+            continue
+        fallback = None
+        for j in xrange(i + 1, count):
+            if partner[j] != -1:
+                continue
+            if j not in opponents[i]:
+                break
+            if fallback is None and allow_rematches:
+                fallback = j
+        else:
+            j = fallback
+        if j is not None:
+            partner[i] = j
+            partner[j] = i
+    return partner
+
+
+def _augment(root, partner, opponents):
+    """
+    Pairs the unpaired rank root without any rematches, by looking for an
+    augmenting path (alternating between unpaired and paired edges, from
+    root to another unpaired rank) and swapping partners along it, with
+    Edmonds' blossom algorithm.  Returns whether a path was found.
+    """
+    count = len(opponents)
+    # Each rank's predecessor along the alternating paths, and the base of
+    # the (contracted) blossom it belongs to
+    parent = [-1] * count
+    base = range(count)
+    visited = [False] * count
+    visited[root] = True
+    queue = deque([root])
+    while queue:
+        v = queue.popleft()
+        played = opponents[v]
+        for w in xrange(count):
+            if w == v or w in played or base[v] == base[w] or partner[v] == w:
+                continue
+            if w == root or (partner[w] != -1 and parent[partner[w]] != -1):
+                # An odd cycle: contract it into a blossom around its base
+                blossom_base = _commonBase(v, w, parent, base, partner)
+                in_blossom = [False] * count
+                _markBlossom(v, blossom_base, w, parent, base, partner, in_blossom)
+                _markBlossom(w, blossom_base, v, parent, base, partner, in_blossom)
+                for i in xrange(count):
+                    if in_blossom[base[i]]:
+                        base[i] = blossom_base
+                        if not visited[i]:
+                            visited[i] = True
+                            queue.append(i)
+            elif parent[w] == -1:
+                parent[w] = v
+                if partner[w] == -1:
+                    # Found a path: swap partners along it, back to root
+                    while w != -1:
+                        v = parent[w]
+                        next_w = partner[v]
+                        partner[w] = v
+                        partner[v] = w
+                        w = next_w
+                    return True
+                visited[partner[w]] = True
+                queue.append(partner[w])
+    return False
+
+
+def _commonBase(v, w, parent, base, partner):
+    """ Returns the base of the blossom closed by the edge between v and w. """
+    on_path = set()
+    while True:
+        v = base[v]
+        on_path.add(v)
+        if partner[v] == -1:
+            break
+        v = parent[partner[v]]
+    while True:
+        w = base[w]
+        if w in on_path:
+            return w
+        w = parent[partner[w]]
+
+
+def _markBlossom(v, blossom_base, child, parent, base, partner, in_blossom):
+    """ Marks the ranks from v up to blossom_base as part of the new blossom. """
+    while base[v] != blossom_base:
+        in_blossom[base[v]] = in_blossom[base[partner[v]]] = True
+        parent[v] = child
+        child = partner[v]
+        v = parent[partner[v]]
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# pairing_benchmark.py -- simulates whole Swiss tournaments against the
+# pairing engine (pairing.py), without touching the database.
+#
+# Every simulated player has a hidden rating that decides their chances in
+# each match.  Each round, players are ranked the way player_standings
+# ranks them (match points, then opponents' match win percentage), the
+# lowest-ranked player without a bye gets one if the count is odd, and
+# the rest are paired by pairing.pairPlayers().  Prints, per tournament
+# size, how long pairing a round took along with how good the pairings
+# were (rematches, and pairs from different score groups).
+#
+# Usage:
+#     python pairing_benchmark.py [--players 100,1000,10000] [--rounds 14]
+
+import argparse
+import random
+import time
+
+from tournament import WIN_POINTS, DRAW_POINTS, LOSE_POINTS
+from pairing import pairPlayers
+
+
+def simulateTournament(player_count, rounds, draw_rate, rng):
+    """
+    Plays a whole tournament and returns a list of per-round statistics:
+    (seconds spent pairing, rematches, pairs from different score groups).
+    """
+    ratings = [rng.gauss(1500, 200) for _ in xrange(player_count)]
+    points = [0] * player_count
+    matches = [0] * player_count
+    opponents = [[] for _ in xrange(player_count)]
+    byes = set()
+    played = []
+    stats = []
+    for _ in xrange(rounds):
+        standings = rankPlayers(points, matches, opponents)
+        if len(standings) % 2:
+            bye = next((p for p in reversed(standings) if p not in byes), standings[-1])
+            byes.add(bye)
+            standings.remove(bye)
+            points[bye] += WIN_POINTS
+            matches[bye] += 1
+
+        start = time.time()
+        pairs = pairPlayers(standings, played)
+        elapsed = time.time() - start
+
+        rematches = 0
+        floats = 0
+        for a, b in pairs:
+            if b in opponents[a]:
+                rematches += 1
+            if points[a] != points[b]:
+                floats += 1
+            playMatch(a, b, ratings, points, draw_rate, rng)
+            matches[a] += 1
+            matches[b] += 1
+            opponents[a].append(b)
+            opponents[b].append(a)
+            played.append((a, b))
+        stats.append((elapsed, rematches, floats))
+    return stats
+
+
+def rankPlayers(points, matches, opponents):
+    """ Orders players by match points, then opponents' match win percentage. """
+    def omw(player):
+        opps = opponents[player]
+        played = sum(matches[opp] for opp in opps)
+        return float(sum(points[opp] for opp in opps)) / (3 * played) if played else -1
+    return sorted(xrange(len(points)),
+        key=lambda player: (-points[player], -omw(player), player))
+
+
+def playMatch(a, b, ratings, points, draw_rate, rng):
+    if rng.random() < draw_rate:
+        points[a] += DRAW_POINTS
+        points[b] += DRAW_POINTS
+        return
+    expected = 1.0 / (1 + 10 ** ((ratings[b] - ratings[a]) / 400.0))
+    winner, loser = (a, b) if rng.random() < expected else (b, a)
+    points[winner] += WIN_POINTS
+    points[loser] += LOSE_POINTS
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulates Swiss tournaments against the pairing engine.")
+    parser.add_argument("--players", default="100,1000,10000",
+        help="comma-separated tournament sizes")
+    parser.add_argument("--rounds", type=int, default=14)
+    parser.add_argument("--draw-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print "{:>8} {:>7} {:>10} {:>10} {:>10} {:>11}".format("players", "rounds",
+        "mean (ms)", "max (ms)", "rematches", "floats/rnd")
+    for count in [int(c) for c in args.players.split(",")]:
+        stats = simulateTournament(count, args.rounds, args.draw_rate,
+            random.Random(args.seed))
+        times = [elapsed for elapsed, _, _ in stats]
+        print "{:>8} {:>7} {:>10.1f} {:>10.1f} {:>10} {:>11.1f}".format(count,
+            len(stats), sum(times) * 1000 / len(times), max(times) * 1000,
+            sum(rematches for _, rematches, _ in stats),
+            float(sum(floats for _, _, floats in stats)) / len(stats))
+
+
+if __name__ == '__main__':
+    main()
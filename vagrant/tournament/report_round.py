@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# report_round.py -- records a whole round of results from a CSV file
+#
+# Each row holds an outcome followed by the ids of the players involved:
+#     win,<winner id>,<loser id>
+#     draw,<player id>,<player id>
+#     bye,<player id>
+# A header row (starting with "outcome"), blank rows and rows starting
+# with "#" are skipped.  The whole round is recorded in one transaction
+# (see tournament.reportRound()); if any row is invalid, or is rejected
+# by the database (e.g. an unknown player id), nothing is, and the
+# offending line is reported.
+#
+# Usage:
+#     python report_round.py round3.csv [--tournament 12]
+
+import argparse
+import csv
+import sys
+
+import psycopg2
+
+from tournament import OUTCOME_POINTS, TournamentSession, reportRound
+
+
+def readResults(lines):
+    """
+    Parses CSV lines into a list of reportRound() results.  Raises a
+    ValueError naming the line of the first row that can't be parsed.
+    """
+    return [result for _, result in readNumberedResults(lines)]
+
+
+def readNumberedResults(lines):
+    """
+    As above, but returns a list of (line number, result) tuples.
+    """
+    results = []
+    reader = csv.reader(lines)
+    for row in reader:
+        row = [cell.strip() for cell in row]
+        if not any(row) or row[0].startswith("#") or row[0].lower() == "outcome":
+            continue
+        outcome = row[0].lower()
+        players = [cell for cell in row[1:] if cell]
+        points = OUTCOME_POINTS.get(outcome)
+        if points is None or len(players) != len(points):
+            raise ValueError("Line {}: expected win,<winner>,<loser>, "
+                "draw,<player>,<player> or bye,<player>".format(reader.line_num))
+        try:
+            results.append((reader.line_num,
+                (outcome,) + tuple(int(player) for player in players)))
+        except ValueError:
+            raise ValueError("Line {}: player ids should be numbers".format(
+                reader.line_num))
+    return results
+
+
+def findRejectedResult(numbered_results, tourney_id=None):
+    """
+    Replays (line number, result) tuples one at a time, in a transaction
+    that's rolled back afterwards, to find out which one the database
+    rejects.  Returns the (line number, psycopg2.Error) of the first
+    rejected result, or (None, None) if they're all accepted.
+    """
+    session = TournamentSession(transaction=True)
+    try:
+        for line_num, result in numbered_results:
+            try:
+                session.reportRound([result], tourney_id)
+            except psycopg2.Error as e:
+                return line_num, e
+        return None, None
+    finally:
+        session.close(commit=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Records a round of tournament results from a CSV file.")
+    parser.add_argument("results", help="CSV file of results (- for stdin)")
+    parser.add_argument("--tournament", type=int, default=None,
+        help="tournament id (defaults to the most recent tournament)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.results == "-":
+            numbered = readNumberedResults(sys.stdin)
+        else:
+            with open(args.results, "rb") as results_file:
+                numbered = readNumberedResults(results_file)
+    except (IOError, ValueError) as e:
+        print "Unable to read results: {}".format(e)
+        return 1
+    try:
+        count = reportRound([result for _, result in numbered], args.tournament)
+    except psycopg2.Error as e:
+        line_num, error = findRejectedResult(numbered, args.tournament)
+        if line_num is not None:
+            e = "Line {}: {}".format(line_num, error)
+        print "Unable to record results (nothing was recorded): {}".format(
+            " ".join(str(e).split()))
+        return 1
+    print "Recorded {} matches.".format(count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,422 +7,713 @@
 #
 # All operations will assume that if a tournament_id is not provided
 # the query should be applied to the most recent tourney
-# (the one with the largest tourney_id)
+# (the one with the largest tourney_id).  It's looked up once and then
+# remembered by the process until createTournament() or
+# deleteTournaments() changes it; call forgetCurrentTournament() if
+# another process may have created or deleted tournaments since.
+#
+# Operations are available as methods on a TournamentSession, which runs
+# them all over one pooled connection (and optionally one transaction):
+#
+#     with TournamentSession(transaction=True) as session:
+#         for winner, loser in results:
+#             session.reportMatch(winner, loser)
+#
+# The module-level functions are shortcuts that each run in a session
+# of their own.
 
 
 
 #TODO: swiss pairings, player rankings, mwp floor
 
+import threading
+import time
+
 import psycopg2
+import psycopg2.pool
 import bleach
 
+from pairing import pairPlayers
+
 
 WIN_POINTS = 3
 DRAW_POINTS = 1
 LOSE_POINTS = 0
 
+# Match outcomes for reportRound(), and the points awarded to each player
+WIN = "win"
+DRAW = "draw"
+BYE = "bye"
+OUTCOME_POINTS = {
+    WIN: (WIN_POINTS, LOSE_POINTS),
+    DRAW: (DRAW_POINTS, DRAW_POINTS),
+    BYE: (WIN_POINTS,),
+    }
+# Rows sent per multi-row INSERT statement
+INSERT_PAGE_SIZE = 1000
+
+DSN = "dbname=tournament"
+# Connections kept open by the pool, and the most it will hand out at once
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 10
+# Seconds a new session waits for a connection while they're all in use
+POOL_TIMEOUT = 30.0
+
+__pool = None
+__pool_lock = threading.Lock()
+# The id of the most recent tournament, once known
+__current_tourney = None
+
 def connect():
     """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    return psycopg2.connect(DSN)
 
 
-def wipeDatabase():
+class BlockingConnectionPool(psycopg2.pool.ThreadedConnectionPool):
     """
-    Remove *everything* from the database.
+    A ThreadedConnectionPool whose getconn() waits for a connection to be
+    put back when all maxconn of them are in use, instead of raising a
+    PoolError straight away.  It still raises one after timeout seconds.
     """
-    deleteTournaments()
-    deleteMatches()
-    deletePlayers()
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.timeout = kwargs.pop("timeout", POOL_TIMEOUT)
+        psycopg2.pool.ThreadedConnectionPool.__init__(
+            self, minconn, maxconn, *args, **kwargs)
+        self._returned = threading.Condition()
+        self._checked_out = 0
 
+    def getconn(self, key=None):
+        deadline = time.time() + self.timeout
+        with self._returned:
+            while self._checked_out >= self.maxconn:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(
+                        "Timed out waiting for a pooled connection")
+                self._returned.wait(remaining)
+            self._checked_out += 1
+        try:
+            return psycopg2.pool.ThreadedConnectionPool.getconn(self, key)
+        except:
+            self._release()
+            raise
 
-def deleteTournaments():
-    """
-    Remove all tournaments from the database.
-    """
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM tournaments")
-    conn.commit()
-    conn.close()
+    def putconn(self, conn=None, key=None, close=False):
+        psycopg2.pool.ThreadedConnectionPool.putconn(self, conn, key, close)
+        self._release()
 
+    def _release(self):
+        with self._returned:
+            self._checked_out -= 1
+            self._returned.notify()
 
-def deleteMatches(tourney_id=None):
-    """
-    Remove all the match records for the given tournament from the database.
 
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
+def getPool():
     """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM matches WHERE tourney_id = %s", (tourney_id,))
-    conn.commit()
-    conn.close()
-
-
-def deletePlayers():
-    """
-    Permanently removes all player records (including the players table).
+    Returns the connection pool shared by all sessions, creating it
+    on first use.  At most POOL_MAX_CONNECTIONS sessions can be open at
+    once; any more wait (up to POOL_TIMEOUT seconds) for one to close.
     """
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM players")
-    conn.commit()
-    conn.close()
+    global __pool
+    with __pool_lock:
+        if __pool is None:
+            __pool = BlockingConnectionPool(
+                POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, DSN, timeout=POOL_TIMEOUT)
+        return __pool
 
 
-def removePlayers(tourney_id=None):
+def closePool():
     """
-    Remove all the player records from the given tournament
-    (but not from the players table).
-
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
+    Closes every pooled connection (the pool is recreated if needed again).
     """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
+    global __pool
+    with __pool_lock:
+        if __pool is not None:
+            __pool.closeall()
+            __pool = None
+
+
+def forgetCurrentTournament():
+    """
+    Forgets the remembered id of the most recent tournament, so that it's
+    looked up again the next time it's needed.
+    """
+    _rememberTournament(None)
+
+
+def _rememberTournament(tourney_id):
+    global __current_tourney
+    __current_tourney = tourney_id
+
+
+def _currentTournament():
+    return __current_tourney
+
+
+def _insertValues(cursor, statement, template, rows, page_size=INSERT_PAGE_SIZE):
+    """
+    Inserts rows with as few multi-row INSERT statements as possible
+    (like psycopg2.extras.execute_values(), which the VM's psycopg2 predates).
+    """
+    for start in range(0, len(rows), page_size):
+        values = ", ".join(cursor.mogrify(template, row)
+            for row in rows[start:start + page_size])
+        cursor.execute(statement + values)
+
+
+class TournamentSession(object):
+    """
+    Runs tournament operations over a single connection borrowed from
+    the pool, which is returned by close() (or when used as a context
+    manager, at the end of the with block).
+
+    By default, every operation is committed as soon as it's done.  With
+    transaction=True, nothing is committed until the session is closed;
+    if the with block raises, everything is rolled back instead.
+
+    Operations apply to the given tourney_id when they aren't passed one
+    of their own (and to the most recent tournament if that's None too).
+    """
+    def __init__(self, transaction=False, tourney_id=None):
+        self.transaction = transaction
+        self.tourney_id = tourney_id
+        # (tourney_id,) of the most recent tournament, to be remembered
+        # once this session's transaction is committed
+        self._pending_current = None
+        self._pool = getPool()
+        self.conn = self._pool.getconn()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+    def close(self, commit=True):
+        """
+        Commits any outstanding work (or rolls it back if commit is false)
+        and returns the connection to the pool.
+        """
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        pending, self._pending_current = self._pending_current, None
+        try:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        except psycopg2.Error:
+            self._pool.putconn(conn, close=True)
+            raise
+        self._pool.putconn(conn, close=bool(conn.closed))
+        if commit and pending is not None:
+            _rememberTournament(pending[0])
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM tournament_player_maps WHERE tourney_id = %s",
-        (tourney_id,))
-    conn.commit()
-    conn.close()
+    def _cursor(self):
+        if self.conn is None:
+            raise psycopg2.InterfaceError("TournamentSession is closed")
+        return self.conn.cursor()
+
+    def _done(self):
+        """ Ends an operation, committing it unless the session is one transaction. """
+        if not self.transaction:
+            self.conn.commit()
 
+    def _tourney(self, tourney_id):
+        if not tourney_id:
+            tourney_id = self.tourney_id or self.getOrCreateTournament()
+        return tourney_id
+
+    def _remember(self, tourney_id):
+        """
+        Records tourney_id (or None if unknown) as the most recent tournament.
+        Inside a transaction, that only happens once it's committed; until
+        then, other sessions have to look it up for themselves.
+        """
+        if self.transaction:
+            _rememberTournament(None)
+            self._pending_current = (tourney_id,)
+        else:
+            _rememberTournament(tourney_id)
+
+
+    def wipeDatabase(self):
+        """
+        Remove *everything* from the database.
+        """
+        self.deleteTournaments()
+        self.deleteMatches()
+        self.deletePlayers()
+
+
+    def deleteTournaments(self):
+        """
+        Remove all tournaments from the database.
+        """
+        c = self._cursor()
+        c.execute("DELETE FROM tournaments")
+        self._done()
+        self._remember(None)
+
+
+    def deleteMatches(self, tourney_id=None):
+        """
+        Remove all the match records for the given tournament from the database.
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("DELETE FROM matches WHERE tourney_id = %s", (tourney_id,))
+        c.execute("SELECT refresh_standings(%s)", (tourney_id,))
+        self._done()
+
+
+    def deletePlayers(self):
+        """
+        Permanently removes all player records (including the players table).
+        """
+        c = self._cursor()
+        c.execute("DELETE FROM players")
+        self._done()
+
+
+    def removePlayers(self, tourney_id=None):
+        """
+        Remove all the player records from the given tournament
+        (but not from the players table).
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("DELETE FROM tournament_player_maps WHERE tourney_id = %s",
+            (tourney_id,))
+        self._done()
 
-def deactivatePlayers(tourney_id=None):
-    """
-    Marks all players in the given tournament as inactive
-    (their records will still exist in tournament_player_maps).
 
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
+    def deactivatePlayers(self, tourney_id=None):
+        """
+        Marks all players in the given tournament as inactive
+        (their records will still exist in tournament_player_maps).
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("UPDATE tournament_player_maps SET active = false " +
+                "WHERE tourney_id = %s", (tourney_id,))
+        self._done()
+
+
+    def deactivatePlayer(self, player_id, tourney_id=None):
+        """
+        As above, but for a single player.
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("UPDATE tournament_player_maps SET active = false " +
+                "WHERE tourney_id = %s AND player_id = %s",
+                (tourney_id, player_id))
+        self._done()
+
+
+    def countPlayers(self, tourney_id=None):
+        """
+        Returns the number of players currently registered.
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("SELECT COUNT(*) FROM tournament_player_maps " +
+                "WHERE tourney_id = %s AND active = true", (tourney_id,))
+        row_count = c.fetchone()[0]
+        self._done()
+        return row_count
+
+
+    def registerPlayer(self, name, tourney_id=None):
+        """
+        Adds a player to the tournament database and attaches them to the
+        given tournament.
+
+        The database assigns a unique serial id number for the player.  (This
+        should be handled by your SQL database schema, not in your Python code.)
+
+        Args:
+          name: the player's full name (need not be unique).
+          tourney_id: the id of the currently running tournament
+            (use None to auto-detect the most recent one)
+
+        Returns:
+            The new player's ID number.
+        """
+        name = bleach.clean(name)
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("INSERT INTO players(name) VALUES (%s) RETURNING player_id",(name,))
+        player_id = c.fetchone()[0]
+        self._done()
+
+        self.attachPlayer(player_id, tourney_id)
+        return player_id
+
+
+    def attachPlayer(self, player_id, tourney_id=None):
+        """
+        Attaches an existing player to the given tournament (does not create
+        a new record in the players table).
+
+        Args:
+            player_id: The id of the player to be added
+            tourney_id = The id of the tournament to which they should be attached.
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("INSERT INTO tournament_player_maps(tourney_id, player_id) " +
+            "VALUES (%s, %s)", (tourney_id, player_id,))
+        self._done()
+
+
+    def playerStandings(self, tourney_id=None):
+        """Returns a list of the players and their win records, sorted by wins.
+
+        The first entry in the list should be the player in first place, or a player
+        tied for first place if there is currently a tie.
+
+        Returns:
+          A list of tuples, each of which contains (id, name, wins, matches):
+            id: the player's unique id (assigned by the database)
+            name: the player's full name (as registered)
+            wins: the number of matches the player has won
+            matches: the number of matches the player has played
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("SELECT player_id, name, total_points, matches_played " +
+            "FROM player_standings " +
+            "WHERE tourney_id = %s AND active = true", (tourney_id,))
+        output = []
+        for result in c:
+            # 3 points == 1 match win; doing a conversion here so that
+            # the test cases will see a win count in the format they expect
+            points = result[2] or 0
+            matches = result[3] or 0
+            output.append((result[0], result[1], float(points)/3, matches))
+        self._done()
+
+        return output
+
+
+    def reportMatch(self, winner, loser, tourney_id=None):
+        """Records the outcome of a single match between two players.
+
+        Args:
+            winner:  the id number of the player who won
+            loser:  the id number of the player who lost
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        self.reportRound([(WIN, winner, loser)], tourney_id)
+
+
+    def reportDraw(self, player1, player2, tourney_id=None):
+        """
+        Reports that the game played between these two players was a draw.
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        self.reportRound([(DRAW, player1, player2)], tourney_id)
+
+
+    def reportBye(self, player, tourney_id=None):
+        """
+        Reports that the player received a bye, and updates the database so
+        that they will be ineligible for further byes.
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        self.reportRound([(BYE, player)], tourney_id)
+
+
+    def reportRound(self, results, tourney_id=None):
+        """
+        Records any number of match results together, in a single
+        transaction and a handful of statements (rather than three or
+        four statements per match).
+
+        Args:
+            results: a list of tuples, each of which is one of
+                (WIN, winner, loser)
+                (DRAW, player1, player2)
+                (BYE, player)
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+
+        Returns:
+            The number of matches recorded.
+        """
+        matches = []
+        byes = []
+        for index, result in enumerate(results):
+            outcome, players = result[0], tuple(result[1:])
+            points = OUTCOME_POINTS.get(outcome)
+            if points is None or len(players) != len(points):
+                raise ValueError(("Result {}: expected (win, winner, loser), " +
+                    "(draw, player1, player2) or (bye, player), got {!r}").format(
+                    index + 1, result))
+            matches.append(zip(players, points))
+            if outcome == BYE:
+                byes.append(players[0])
+        if not matches:
+            return 0
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("SELECT nextval(pg_get_serial_sequence('matches', 'match_id')) " +
+            "FROM generate_series(1, %s)", (len(matches),))
+        match_ids = [row[0] for row in c.fetchall()]
+        _insertValues(c, "INSERT INTO matches(match_id, tourney_id) VALUES ",
+            "(%s, %s)", [(match_id, tourney_id) for match_id in match_ids])
+        _insertValues(c, "INSERT INTO match_results(match_id, player_id, points_awarded) VALUES ",
+            "(%s, %s, %s)", [(match_id, player, points)
+                for match_id, match in zip(match_ids, matches)
+                for player, points in match])
+        if byes:
+            c.execute("UPDATE tournament_player_maps SET bye_awarded = true " +
+                "WHERE tourney_id = %s AND player_id = ANY(%s)", (tourney_id, byes))
+        self._done()
+        return len(matches)
+
+
+    def swissPairings(self, tourney_id=None):
+        """Returns a list of pairs of players for the next round of a match.
+
+        Assuming that there are an even number of players registered, each player
+        appears exactly once in the pairings.  Each player is paired with another
+        player with an equal or nearly-equal win record, that is, a player adjacent
+        to him or her in the standings, avoiding rematches wherever possible
+        (see pairing.py).
+
+        Returns:
+          A list of tuples, each of which contains (id1, name1, id2, name2)
+            id1: the first player's unique id
+            name1: the first player's name
+            id2: the second player's unique id
+            name2: the second player's name
+
+        Args:
+            tourney_id: the id of the currently running tournament
+              (use None to auto-detect the most recent one)
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        bye_player_id = self.calculateBye(tourney_id)
+
+        c = self._cursor()
+        c.execute("SELECT player_id, name FROM player_standings " +
+            "WHERE tourney_id = %s AND active = true",
+            (tourney_id,))
+        names = {}
+        player_list = []
+        for player_id, name in c.fetchall():
+            names[player_id] = name
+            if player_id != bye_player_id:
+                player_list.append(player_id)
+        c.execute("SELECT player_id, opp_id FROM opponents " +
+            "WHERE tourney_id = %s AND player_id < opp_id", (tourney_id,))
+        played = c.fetchall()
+        if bye_player_id is not None:
+            self.reportBye(bye_player_id, tourney_id)
+        self._done()
+
+        output = []
+        for player1, player2 in pairPlayers(player_list, played):
+            output.append((player2, names[player2], player1, names[player1]))
+        return output
+
+
+    def calculateBye(self, tourney_id=None):
+        """
+        If the current tournament has an odd number of active players,
+        returns the ID of the lowest-ranked player who has yet to receive
+        a bye.
+        Otherwise, returns None
+        """
+        tourney_id = self._tourney(tourney_id)
+
+        c = self._cursor()
+        c.execute("SELECT COUNT(*) FROM tournament_player_maps " +
+            "WHERE tourney_id = %s AND active = true", (tourney_id,))
+        count = c.fetchone()[0]
+
+        if count % 2 == 0:
+            self._done()
+            return None
+
+        c.execute("SELECT player_id FROM player_standings_asc " +
+            "WHERE tourney_id = %s AND bye_awarded = false AND active = true " +
+            "LIMIT 1", (tourney_id,))
+        bye_player_id = c.fetchone()[0]
+        self._done()
+
+        return bye_player_id
+
+
+    def getOrCreateTournament(self):
+        """
+        If there are any tournaments in the database, return the tourney_id
+        of the most recently created one.
+        Otherwise, create a new tournament and return its tourney_id.
+        """
+        if self._pending_current is not None and self._pending_current[0]:
+            return self._pending_current[0]
+        tourney_id = _currentTournament()
+        if tourney_id:
+            return tourney_id
+
+        c = self._cursor()
+        c.execute("SELECT tourney_id FROM tournaments ORDER BY tourney_id DESC LIMIT 1")
+        found = c.fetchone()
+        self._done()
+        if found:
+            self._remember(found[0])
+            return found[0]
+        else:
+            return self.createTournament()
+
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("UPDATE tournament_player_maps SET active = false " +
-            "WHERE tourney_id = %s", (tourney_id,))
-    conn.commit()
-    conn.close()
+    def createTournament(self):
+        """
+        Add a new tournament to the database and return its tourney_id.
+        """
+        c = self._cursor()
+        c.execute("INSERT INTO tournaments(tourney_id) VALUES(default) RETURNING tourney_id")
+        tourney_id = c.fetchone()[0]
+        self._done()
+        self._remember(tourney_id)
+        return tourney_id
 
 
-def deactivatePlayer(player_id, tourney_id=None):
-    """
-    As above, but for a single player.
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
+# Module-level shortcuts, each running in a session of its own
+# (see the TournamentSession methods of the same name for details)
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("UPDATE tournament_player_maps SET active = false " +
-            "WHERE tourney_id = %s AND player_id = %s",
-            (tourney_id, player_id))
-    conn.commit()
-    conn.close()
+def wipeDatabase():
+    with TournamentSession() as session:
+        session.wipeDatabase()
 
 
-def countPlayers(tourney_id=None):
-    """
-    Returns the number of players currently registered.
+def deleteTournaments():
+    with TournamentSession() as session:
+        session.deleteTournaments()
 
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM tournament_player_maps " +
-            "WHERE tourney_id = %s AND active = true", (tourney_id,))
-    row_count = c.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return row_count
+def deleteMatches(tourney_id=None):
+    with TournamentSession() as session:
+        session.deleteMatches(tourney_id)
 
 
-def registerPlayer(name, tourney_id=None):
-    """
-    Adds a player to the tournament database and attaches them to the
-    given tournament.
+def deletePlayers():
+    with TournamentSession() as session:
+        session.deletePlayers()
 
-    The database assigns a unique serial id number for the player.  (This
-    should be handled by your SQL database schema, not in your Python code.)
 
-    Args:
-      name: the player's full name (need not be unique).
-      tourney_id: the id of the currently running tournament
-        (use None to auto-detect the most recent one)
+def removePlayers(tourney_id=None):
+    with TournamentSession() as session:
+        session.removePlayers(tourney_id)
 
-    Returns:
-        The new player's ID number.
-    """
-    name = bleach.clean(name)
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("INSERT INTO players(name) VALUES (%s) RETURNING player_id",(name,))
-    player_id = c.fetchone()[0]
-    conn.commit()
-    conn.close()
+def deactivatePlayers(tourney_id=None):
+    with TournamentSession() as session:
+        session.deactivatePlayers(tourney_id)
 
-    attachPlayer(player_id, tourney_id)
-    return player_id
 
+def deactivatePlayer(player_id, tourney_id=None):
+    with TournamentSession() as session:
+        session.deactivatePlayer(player_id, tourney_id)
 
-def attachPlayer(player_id, tourney_id=None):
-    """
-    Attaches an existing player to the given tournament (does not create
-    a new record in the players table).
 
-    Args:
-        player_id: The id of the player to be added
-        tourney_id = The id of the tournament to which they should be attached.
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
+def countPlayers(tourney_id=None):
+    with TournamentSession() as session:
+        return session.countPlayers(tourney_id)
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("INSERT INTO tournament_player_maps(tourney_id, player_id) " +
-        "VALUES (%s, %s)", (tourney_id, player_id,))
-    conn.commit()
-    conn.close()
 
+def registerPlayer(name, tourney_id=None):
+    with TournamentSession() as session:
+        return session.registerPlayer(name, tourney_id)
 
-def playerStandings(tourney_id=None):
-    """Returns a list of the players and their win records, sorted by wins.
 
-    The first entry in the list should be the player in first place, or a player
-    tied for first place if there is currently a tie.
+def attachPlayer(player_id, tourney_id=None):
+    with TournamentSession() as session:
+        session.attachPlayer(player_id, tourney_id)
 
-    Returns:
-      A list of tuples, each of which contains (id, name, wins, matches):
-        id: the player's unique id (assigned by the database)
-        name: the player's full name (as registered)
-        wins: the number of matches the player has won
-        matches: the number of matches the player has played
 
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT player_id, name, total_points, matches_played " +
-        "FROM player_standings " +
-        "WHERE tourney_id = %s AND active = true", (tourney_id,))
-    output = []
-    for result in c:
-        # 3 points == 1 match win; doing a conversion here so that
-        # the test cases will see a win count in the format they expect
-        points = result[2] or 0
-        matches = result[3] or 0
-        output.append((result[0], result[1], float(points)/3, matches))
-    conn.commit()
-    conn.close()
-
-    return output
+def playerStandings(tourney_id=None):
+    with TournamentSession() as session:
+        return session.playerStandings(tourney_id)
 
 
 def reportMatch(winner, loser, tourney_id=None):
-    """Records the outcome of a single match between two players.
-
-    Args:
-        winner:  the id number of the player who won
-        loser:  the id number of the player who lost
-        draw: if true, both players should receive a draw result
-            instead of a win and loss, respectively
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("INSERT INTO matches(tourney_id) VALUES(%s) RETURNING match_id", (tourney_id,))
-    match_id = c.fetchone()[0]
-    c.execute("INSERT INTO match_results(match_id, player_id, points_awarded) " +
-            "VALUES(%s, %s, %s)", (match_id, winner, WIN_POINTS))
-    c.execute("INSERT INTO match_results(match_id, player_id, points_awarded) " +
-            "VALUES(%s, %s, %s)", (match_id, loser, LOSE_POINTS))
-    conn.commit()
-    conn.close()
+    with TournamentSession() as session:
+        session.reportMatch(winner, loser, tourney_id)
 
 
 def reportDraw(player1, player2, tourney_id=None):
-    """
-    Reports that the game played between these two players was a draw.
-
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("INSERT INTO matches(tourney_id) VALUES(%s) RETURNING match_id", (tourney_id,))
-    match_id = c.fetchone()[0]
-    c.execute("INSERT INTO match_results(match_id, player_id, points_awarded) " +
-            "VALUES(%s, %s, %s)", (match_id, player1, DRAW_POINTS))
-    c.execute("INSERT INTO match_results(match_id, player_id, points_awarded) " +
-            "VALUES(%s, %s, %s)", (match_id, player2, DRAW_POINTS))
-    conn.commit()
-    conn.close()
+    with TournamentSession() as session:
+        session.reportDraw(player1, player2, tourney_id)
 
 
 def reportBye(player, tourney_id=None):
-    """
-    Reports that the player received a bye, and updates the database so
-    that they will be ineligible for further byes.
+    with TournamentSession() as session:
+        session.reportBye(player, tourney_id)
 
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("INSERT INTO matches(tourney_id) VALUES(%s) RETURNING match_id", (tourney_id,))
-    match_id = c.fetchone()[0]
-    c.execute("INSERT INTO match_results(match_id, player_id, points_awarded) " +
-            "VALUES(%s, %s, %s)", (match_id, player, WIN_POINTS))
-    c.execute("UPDATE tournament_player_maps SET bye_awarded = true " +
-            "WHERE tourney_id = %s and player_id = %s", (tourney_id, player,))
-    conn.commit()
-    conn.close()
+def reportRound(results, tourney_id=None):
+    with TournamentSession() as session:
+        return session.reportRound(results, tourney_id)
 
 
 def swissPairings(tourney_id=None):
-    """Returns a list of pairs of players for the next round of a match.
-
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
-
-    Returns:
-      A list of tuples, each of which contains (id1, name1, id2, name2)
-        id1: the first player's unique id
-        name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
-
-    Args:
-        tourney_id: the id of the currently running tournament
-          (use None to auto-detect the most recent one)
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
-
-    bye_player_id = calculateBye(tourney_id)
-
-    player_list = []
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT player_id, name FROM player_standings " +
-        "WHERE tourney_id = %s AND active = true",
-        (tourney_id,))
-    for result in c:
-        if result[0] == bye_player_id:
-            reportBye(bye_player_id, tourney_id)
-        else:
-            player_list.append((result[0], result[1]))
-    conn.commit()
-    conn.close()
-
-    output = []
-    opponent = None
-    for player in player_list:
-        if opponent == None:
-            opponent = player
-        else:
-            output.append((player[0], player[1], opponent[0], opponent[1]))
-            opponent = None
-    return output
+    with TournamentSession() as session:
+        return session.swissPairings(tourney_id)
 
 
 def calculateBye(tourney_id=None):
-    """
-    If the current tournament has an odd number of active players,
-    returns the ID of the lowest-ranked player who has yet to receive
-    a bye.
-    Otherwise, returns None
-    """
-    if not tourney_id:
-        tourney_id = getOrCreateTournament()
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM player_standings " +
-        "WHERE tourney_id = %s AND active = true", (tourney_id,))
-    count = c.fetchone()[0]
-    conn.commit()
-    conn.close()
-
-    if count % 2 == 0:
-        return None
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT player_id FROM player_standings_asc " +
-        "WHERE tourney_id = %s AND bye_awarded = false AND active = true " +
-        "LIMIT 1", (tourney_id,))
-    bye_player_id = c.fetchone()[0]
-    conn.commit()
-    conn.close()
-
-    return bye_player_id
+    with TournamentSession() as session:
+        return session.calculateBye(tourney_id)
 
 
 def getOrCreateTournament():
-    """
-    If there are any tournaments in the database, return the tourney_id
-    of the most recently created one.
-    Otherwise, create a new tournament and return its tourney_id.
-    """
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT tourney_id FROM tournaments ORDER BY tourney_id DESC LIMIT 1")
-    found = c.fetchone()
-    conn.commit()
-    conn.close()
-    if found:
-        return found[0]
-    else:
-        return createTournament()
+    with TournamentSession() as session:
+        return session.getOrCreateTournament()
 
 
 def createTournament():
-    """
-    Add a new tournament to the database and return its tourney_id.
-    """
-    conn = connect()
-    c = conn.cursor()
-    c.execute("INSERT INTO tournaments(tourney_id) VALUES(default) RETURNING tourney_id")
-    tourney_id = c.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return tourney_id
-
+    with TournamentSession() as session:
+        return session.createTournament()
@@ -69,58 +69,129 @@ CREATE VIEW player_match_results AS
         RIGHT JOIN match_results b ON (a.match_id = b.match_id)
     ;
 
--- A player's match win percentage during a given tournament
--- (using the DCI's scoring method).
-CREATE VIEW match_win_perc AS
-    SELECT tourney_id,
-        player_id,
-        COUNT(*) AS matches_played,
-        SUM(points_awarded) AS total_points,
-        SUM(points_awarded) / (3 * COUNT(*)) AS match_win_perc
-    FROM player_match_results
-    GROUP BY tourney_id, player_id
-    ;
+-- Materialized standings --
+
+-- Recomputing match points and opponent match win percentages from
+-- every match on each query is quadratic in the size of a tournament,
+-- so they are kept up to date as match results are reported instead.
+
+-- Each player's match record during a given tournament, plus the
+-- combined records of all of their opponents (for the OMW tiebreaker,
+-- using the DCI's scoring method).  Byes count towards a player's
+-- record but don't add an opponent.
+CREATE TABLE standings (
+    tourney_id integer NOT NULL REFERENCES tournaments ON DELETE CASCADE,
+    player_id integer NOT NULL REFERENCES players ON DELETE CASCADE,
+    matches_played integer DEFAULT 0 NOT NULL,
+    total_points float DEFAULT 0 NOT NULL,
+    opp_matches_played integer DEFAULT 0 NOT NULL,
+    opp_total_points float DEFAULT 0 NOT NULL,
+    PRIMARY KEY(tourney_id, player_id)
+    );
 
 -- Listing of all the opponents a player has been matched with
--- during a given tournament.
-CREATE VIEW opponents AS
-    SELECT DISTINCT tourney_id, player_id, opp_id
-    FROM matches c
-    RIGHT JOIN (
-        SELECT a.match_id,
-            a.player_id,
-            b.player_id AS opp_id
-        FROM player_match_results a
-        LEFT JOIN player_match_results b
-        ON a.match_id = b.match_id
-        WHERE a.player_id <> b.player_id
-        ) d
-    ON c.match_id = d.match_id
-    ;
+-- during a given tournament (one row for each side of a pairing).
+CREATE TABLE opponents (
+    tourney_id integer NOT NULL REFERENCES tournaments ON DELETE CASCADE,
+    player_id integer NOT NULL REFERENCES players ON DELETE CASCADE,
+    opp_id integer NOT NULL REFERENCES players ON DELETE CASCADE,
+    PRIMARY KEY(tourney_id, player_id, opp_id)
+    );
 
--- Helper to clean up the next view, shows raw match stats for
--- all opponents
-CREATE VIEW omw_subquery AS
-    SELECT a.tourney_id, a.player_id, a.opp_id,
-        b.matches_played, b.total_points
-    FROM opponents a
-    LEFT JOIN match_win_perc b
-    ON a.opp_id = b.player_id
-    WHERE a.tourney_id = b.tourney_id
-    ;
+CREATE INDEX matches_by_tourney ON matches(tourney_id);
+
+-- Keeps standings and opponents current as each match result is added:
+-- the player's own record changes, which changes the OMW of everyone
+-- they've already played, and the first time two players meet, each
+-- one's whole record joins the other's OMW.
+CREATE FUNCTION record_match_result() RETURNS trigger AS $$
+DECLARE
+    tourney integer;
+    opp integer;
+BEGIN
+    SELECT tourney_id INTO tourney FROM matches WHERE match_id = NEW.match_id;
+
+    UPDATE standings
+        SET matches_played = matches_played + 1,
+            total_points = total_points + NEW.points_awarded
+        WHERE tourney_id = tourney AND player_id = NEW.player_id;
+    IF NOT FOUND THEN
+        INSERT INTO standings(tourney_id, player_id, matches_played, total_points)
+            VALUES (tourney, NEW.player_id, 1, NEW.points_awarded);
+    END IF;
+
+    UPDATE standings
+        SET opp_matches_played = opp_matches_played + 1,
+            opp_total_points = opp_total_points + NEW.points_awarded
+        WHERE tourney_id = tourney AND player_id IN (
+            SELECT opp_id FROM opponents
+            WHERE tourney_id = tourney AND player_id = NEW.player_id);
+
+    FOR opp IN
+        SELECT a.player_id FROM match_results a
+        WHERE a.match_id = NEW.match_id AND a.player_id <> NEW.player_id
+            AND NOT EXISTS (SELECT 1 FROM opponents b
+                WHERE b.tourney_id = tourney AND b.player_id = NEW.player_id
+                AND b.opp_id = a.player_id)
+    LOOP
+        INSERT INTO opponents(tourney_id, player_id, opp_id)
+            VALUES (tourney, NEW.player_id, opp), (tourney, opp, NEW.player_id);
+        -- When a match's results are inserted in one statement, the
+        -- opponent's own result (and standings row) may not be in yet;
+        -- their trigger adds it to this player's OMW once it is
+        INSERT INTO standings(tourney_id, player_id)
+            SELECT tourney, opp
+            WHERE NOT EXISTS (SELECT 1 FROM standings
+                WHERE tourney_id = tourney AND player_id = opp);
+        UPDATE standings a
+            SET opp_matches_played = a.opp_matches_played + b.matches_played,
+                opp_total_points = a.opp_total_points + b.total_points
+            FROM standings b
+            WHERE a.tourney_id = tourney AND b.tourney_id = tourney
+                AND ((a.player_id = NEW.player_id AND b.player_id = opp)
+                    OR (a.player_id = opp AND b.player_id = NEW.player_id));
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER match_results_standings AFTER INSERT ON match_results
+    FOR EACH ROW EXECUTE PROCEDURE record_match_result();
+
+-- Rebuilds the standings of a tournament from scratch.  Needed after
+-- match results are deleted (the trigger above only handles inserts).
+CREATE FUNCTION refresh_standings(tourney integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM opponents WHERE tourney_id = tourney;
+    DELETE FROM standings WHERE tourney_id = tourney;
+    INSERT INTO standings(tourney_id, player_id, matches_played, total_points)
+        SELECT tourney_id, player_id, COUNT(*), SUM(points_awarded)
+        FROM player_match_results
+        WHERE tourney_id = tourney
+        GROUP BY tourney_id, player_id;
+    INSERT INTO opponents(tourney_id, player_id, opp_id)
+        SELECT DISTINCT a.tourney_id, a.player_id, b.player_id
+        FROM player_match_results a
+        JOIN match_results b
+            ON a.match_id = b.match_id AND a.player_id <> b.player_id
+        WHERE a.tourney_id = tourney;
+    UPDATE standings a
+        SET opp_matches_played = b.opp_matches_played,
+            opp_total_points = b.opp_total_points
+        FROM (
+            SELECT c.player_id,
+                SUM(d.matches_played) AS opp_matches_played,
+                SUM(d.total_points) AS opp_total_points
+            FROM opponents c
+            JOIN standings d
+                ON c.tourney_id = d.tourney_id AND c.opp_id = d.player_id
+            WHERE c.tourney_id = tourney
+            GROUP BY c.player_id
+            ) b
+        WHERE a.tourney_id = tourney AND a.player_id = b.player_id;
+END;
+$$ LANGUAGE plpgsql;
 
--- The aggregate match win percentage of a player's opponents during
--- a given tournament (using the DCI's scoring method)
-CREATE VIEW opp_match_win_perc AS
-    SELECT a.tourney_id,
-        a.player_id,
-        SUM(a.matches_played) as all_opps_matches_played,
-        SUM(a.total_points) as all_opps_total_points,
-        SUM(a.total_points) / (3 * SUM(a.matches_played))
-            AS all_opps_match_win_perc
-    FROM omw_subquery a
-    GROUP BY a.tourney_id, a.player_id
-    ;
 
 -- Most tournament pairing code will use this view.
 -- Contains all fields needed to list the current tournament standings
@@ -131,19 +202,17 @@ CREATE VIEW player_standings AS
         a.bye_awarded,
         b.matches_played,
         b.total_points,
-        c.all_opps_match_win_perc,
+        b.opp_total_points / NULLIF(3 * b.opp_matches_played, 0)
+            AS all_opps_match_win_perc,
         d.name
     FROM tournament_player_maps a
-        LEFT JOIN match_win_perc b
+        LEFT JOIN standings b
             ON a.player_id = b.player_id
             AND a.tourney_id = b.tourney_id
-        LEFT JOIN opp_match_win_perc c
-            ON a.player_id = c.player_id
-            AND a.tourney_id = c.tourney_id
         LEFT JOIN players d ON a.player_id = d.player_id
     ORDER BY a.tourney_id,
         b.total_points DESC NULLS LAST,
-        c.all_opps_match_win_perc DESC NULLS LAST,
+        all_opps_match_win_perc DESC NULLS LAST,
         a.player_id
     ;
 
@@ -155,18 +224,16 @@ CREATE VIEW player_standings_asc AS
         a.bye_awarded,
         b.matches_played,
         b.total_points,
-        c.all_opps_match_win_perc,
+        b.opp_total_points / NULLIF(3 * b.opp_matches_played, 0)
+            AS all_opps_match_win_perc,
         d.name
     FROM tournament_player_maps a
-        LEFT JOIN match_win_perc b
+        LEFT JOIN standings b
             ON a.player_id = b.player_id
             AND a.tourney_id = b.tourney_id
-        LEFT JOIN opp_match_win_perc c
-            ON a.player_id = c.player_id
-            AND a.tourney_id = c.tourney_id
         LEFT JOIN players d ON a.player_id = d.player_id
     ORDER BY a.tourney_id,
         b.total_points NULLS FIRST,
-        c.all_opps_match_win_perc NULLS FIRST,
+        all_opps_match_win_perc NULLS FIRST,
         a.player_id DESC
     ;
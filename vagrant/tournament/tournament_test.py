@@ -2,7 +2,14 @@
 #
 # Test cases for tournament.py
 
+import threading
+
+import psycopg2.pool
+
+import tournament
 from tournament import *
+from report_round import findRejectedResult, readNumberedResults, readResults
+import pairing
 
 
 def testDeleteMatches():
@@ -222,6 +229,213 @@ def testTournaments():
     print "12. Multiple tournaments can be created"
 
 
+# Standings are maintained as results come in; check them against
+# a full recalculation
+def testIncrementalStandings():
+    wipeDatabase()
+    ids = [registerPlayer(name) for name in
+        ("Mario", "Luigi", "Peach", "Toad", "Yoshi")]
+    reportMatch(ids[0], ids[1])
+    reportDraw(ids[2], ids[3])
+    reportBye(ids[4])
+    reportMatch(ids[0], ids[2])
+    reportMatch(ids[3], ids[1])
+    reportMatch(ids[1], ids[0])
+    reportDraw(ids[4], ids[0])
+
+    query = ("SELECT player_id, matches_played, total_points, " +
+        "all_opps_match_win_perc FROM player_standings WHERE tourney_id = %s")
+    tourney_id = getOrCreateTournament()
+    conn = connect()
+    c = conn.cursor()
+    c.execute(query, (tourney_id,))
+    incremental = c.fetchall()
+    c.execute("SELECT refresh_standings(%s)", (tourney_id,))
+    c.execute(query, (tourney_id,))
+    recalculated = c.fetchall()
+    conn.commit()
+    conn.close()
+    if incremental != recalculated:
+        raise ValueError(
+            "Incrementally maintained standings should match a full " +
+            "recalculation ({} != {})".format(incremental, recalculated))
+
+    deleteMatches()
+    for record in playerStandings():
+        if record[2] != 0 or record[3] != 0:
+            raise ValueError(
+                "Standings should be reset after deleting matches")
+    print "13. Standings are kept up to date as matches are reported"
+
+
+# Batches of operations can share a connection and a transaction
+def testSessions():
+    wipeDatabase()
+    try:
+        with TournamentSession(transaction=True) as session:
+            session.registerPlayer("Wesley")
+            raise RuntimeError("As you wish")
+    except RuntimeError:
+        pass
+    if countPlayers() != 0:
+        raise ValueError(
+            "A failed session transaction should be rolled back")
+
+    with TournamentSession(transaction=True) as session:
+        conn = session.conn
+        ids = [session.registerPlayer(name) for name in
+            ("Buttercup", "Inigo", "Fezzik", "Vizzini")]
+        session.reportMatch(ids[0], ids[1])
+        session.reportMatch(ids[2], ids[3])
+        if len(session.swissPairings()) != 2 or session.conn is not conn:
+            raise ValueError(
+                "A session should run every operation over one connection")
+    if [row[3] for row in playerStandings()] != [1, 1, 1, 1]:
+        raise ValueError(
+            "A session transaction should be committed when it ends")
+    print "14. Operations can be batched into one session and transaction"
+
+
+# A whole round can be reported at once
+def testReportRound():
+    wipeDatabase()
+    ids = [registerPlayer(name) for name in
+        ("Kirk", "Spock", "McCoy", "Scotty", "Uhura")]
+    lines = ["outcome,player1,player2",
+        "win,{},{}".format(ids[0], ids[1]),
+        "draw,{},{}".format(ids[2], ids[3]),
+        "",
+        "bye,{}".format(ids[4])]
+    if reportRound(readResults(lines)) != 3:
+        raise ValueError("reportRound should record one match per result")
+    wins = dict((record[0], record[2]) for record in playerStandings())
+    expected = {ids[0]: 1, ids[1]: 0, ids[2]: 1.0/3, ids[3]: 1.0/3, ids[4]: 1}
+    if wins != expected:
+        raise ValueError(
+            "Round results should be recorded ({} != {})".format(wins, expected))
+    if calculateBye() == ids[4]:
+        raise ValueError("Byes reported with a round should be remembered")
+
+    try:
+        reportRound([(WIN, ids[1], ids[0]), ("forfeit", ids[2])])
+        raise ValueError("Invalid results should be rejected")
+    except ValueError as e:
+        if "Result 2" not in str(e):
+            raise
+    if [record[3] for record in playerStandings()] != [1] * 5:
+        raise ValueError("Nothing should be recorded from an invalid round")
+
+    unknown = max(ids) + 1000
+    lines = ["win,{},{}".format(ids[0], ids[1]), "bye,{}".format(unknown)]
+    line_num, error = findRejectedResult(readNumberedResults(lines))
+    if line_num != 2 or str(unknown) not in str(error):
+        raise ValueError(
+            "The line of a result rejected by the database should be found")
+    if [record[3] for record in playerStandings()] != [1] * 5:
+        raise ValueError("Looking for rejected results shouldn't record them")
+    print "15. Whole rounds can be reported at once"
+
+
+# Pairings avoid rematches, even when that means pairing players
+# further apart in the standings
+def testRematches():
+    wipeDatabase()
+    id1 = registerPlayer("Athos")
+    id2 = registerPlayer("Porthos")
+    id3 = registerPlayer("Aramis")
+    id4 = registerPlayer("D'Artagnan")
+    reportMatch(id1, id2)
+    reportMatch(id3, id4)
+    reportMatch(id1, id3)
+    reportMatch(id2, id4)
+    pairings = swissPairings()
+    actual_pairs = set(frozenset([row[0], row[2]]) for row in pairings)
+    if actual_pairs != set([frozenset([id1, id4]), frozenset([id2, id3])]):
+        raise ValueError(
+            "Players who have already met shouldn't be paired again")
+
+    # With no way around it, rematches are allowed
+    everyone = [(1, 2), (1, 3), (1, 4), (2, 3), (2, 4), (3, 4)]
+    pairs = pairing.pairPlayers([1, 2, 3, 4], everyone, max_steps=10)
+    if sorted(pairs) != [(1, 2), (3, 4)]:
+        raise ValueError(
+            "When everyone has played, adjacent players should be paired")
+
+    # The last player can only be paired with the top seed, which is more
+    # than backtracking can find; the fallback still avoids rematches
+    players = range(1000)
+    played = [(999, player) for player in players[1:-1]]
+    pairs = pairing.pairPlayers(players, played)
+    if (0, 999) not in pairs or len(set(sum(pairs, ()))) != 1000:
+        raise ValueError(
+            "Rematches should be avoided whenever possible, got {}".format(
+                [pair for pair in pairs if 999 in pair]))
+    print "16. Pairings avoid rematches"
+
+
+# The most recent tournament is looked up once, then remembered
+def testCurrentTournament():
+    wipeDatabase()
+    t1 = createTournament()
+    # Another process creates a tournament behind our back
+    conn = connect()
+    c = conn.cursor()
+    c.execute("INSERT INTO tournaments(tourney_id) VALUES(default) " +
+        "RETURNING tourney_id")
+    t2 = c.fetchone()[0]
+    conn.commit()
+    conn.close()
+    if getOrCreateTournament() != t1:
+        raise ValueError("The current tournament should be remembered")
+    forgetCurrentTournament()
+    if getOrCreateTournament() != t2:
+        raise ValueError(
+            "The current tournament should be looked up once forgotten")
+
+    try:
+        with TournamentSession(transaction=True) as session:
+            session.createTournament()
+            raise RuntimeError("Don't panic")
+    except RuntimeError:
+        pass
+    if getOrCreateTournament() != t2:
+        raise ValueError(
+            "A rolled back tournament shouldn't become the current one")
+
+    with TournamentSession(tourney_id=t1) as session:
+        session.registerPlayer("Ford Prefect")
+    if countPlayers(t1) != 1 or countPlayers() != 0:
+        raise ValueError(
+            "A session's tournament should be used by default")
+    print "17. The current tournament is remembered between calls"
+
+
+# Sessions beyond the pool's size wait for a connection instead of failing
+def testPoolLimit():
+    closePool()
+    limits = (tournament.POOL_MAX_CONNECTIONS, tournament.POOL_TIMEOUT)
+    tournament.POOL_MAX_CONNECTIONS, tournament.POOL_TIMEOUT = 2, 0.2
+    try:
+        sessions = [TournamentSession(), TournamentSession()]
+        try:
+            TournamentSession()
+            raise ValueError("Waiting for a connection should time out")
+        except psycopg2.pool.PoolError:
+            pass
+        closer = threading.Timer(0.05, sessions.pop().close)
+        closer.start()
+        sessions.append(TournamentSession())
+        closer.join()
+        if sessions[1].countPlayers() != 0:
+            raise ValueError("A session that waited should get a connection")
+        for session in sessions:
+            session.close()
+    finally:
+        tournament.POOL_MAX_CONNECTIONS, tournament.POOL_TIMEOUT = limits
+        closePool()
+    print "18. Sessions wait for a pooled connection when they're all in use"
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -236,5 +450,11 @@ if __name__ == '__main__':
     testDraws()
     testTiebreaks()
     testTournaments()
+    testIncrementalStandings()
+    testSessions()
+    testReportRound()
+    testRematches()
+    testCurrentTournament()
+    testPoolLimit()
 
     print "Success!  All tests pass!"